@@ -0,0 +1,474 @@
+"""
+故宫开放数据平台的本地模拟服务，供 benchmark/run_benchmark.py 做性能基准测试，不访问真实网站。
+
+模拟的端点与真实网站一致:
+    POST /opendata/Pub/Search                    列表页（JSON 请求，返回 HTML）
+    GET  /opendata/Pub/Detail/<id>               详情页，支持 ETag / If-None-Match
+    GET  /opendata/Image/GetCaptchaImageFor600   验证码图片，答案按会话 Cookie 记录
+    POST /opendata/Image/DownloadDialog600       校验验证码，返回下载参数 JSON
+    GET  /opendata/Image/Download600             图片 JPEG，支持 Range 断点续传；令牌无效时返回 HTML 错误页
+    GET  /__stats                                各端点的请求数和状态码（测试用）
+
+详情页可以用录制的页面（--recorded 指向响应缓存目录 output/html_cache 或 <Detail ID>.html 目录），
+否则按 --items 生成结构完整的合成页面；图片可以用 --recorded-images 目录中的真实 JPEG，否则生成合成图片。
+可配置的条件: 响应延迟 (--latency/--jitter)、错误率 (--error-rate 返回 503，--throttle-rate 返回 429)、
+下载带宽 (--bandwidth)、验证码难度 (--captcha-noise/--captcha-rotate/--captcha-reject-rate)，
+以及验证码和令牌的有效期 (--captcha-ttl/--token-ttl)。
+
+用法:
+    python benchmark/mock_server.py --port 8765 --latency 80 --error-rate 0.02
+    NPM_BASE_URL=http://127.0.0.1:8765 python src/harvest_urls.py
+"""
+import io
+import os
+import re
+import sys
+import json
+import time
+import random
+import secrets
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+# --- 动态路径处理 ---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+sys.path.insert(0, os.path.join(PROJECT_ROOT, 'src'))
+# ---
+
+from captcha_solver import CHAR_WHITELIST
+from response_cache import ResponseCache
+from url_frontier import detail_id_from_url
+
+FIRST_DETAIL_ID = 10001
+CAPTCHA_LENGTH = 4
+CAPTCHA_SIZE = (120, 40)
+IMAGE_VARIANTS = 8
+CHUNK_SIZE = 64 * 1024
+SESSION_COOKIE = 'ASP.NET_SessionId'
+
+
+def synthetic_detail_html(detail_id, images_per_item=2):
+    """生成与真实详情页结构相同的页面，包含 details-1 至 details-9 的全部区块。"""
+    gallery = ''.join(f'<img data-image-name="K{detail_id}_{n:02d}" data-image-id="{detail_id}{n:02d}" '
+                      f'data-image-code="c{detail_id}{n:02d}">' for n in range(1, images_per_item + 1))
+    return f"""<html><head><title>文物 {detail_id} 號　畫</title></head><body>
+<script>var jsonUrl = "/opendata/Pub/GetJson?cid={detail_id + 500000}";</script>
+<div class="details-title"> 宋 &nbsp;佚名 畫 {detail_id} <span>卷</span></div>
+<div id="gallery">{gallery}</div>
+<div id="details-1"><table><tr><th>統一編號</th><td>故-畫-{detail_id:06d}</td></tr>
+<tr><th>品名</th><td>畫 {detail_id}<br>Painting</td></tr><tr><th>作者</th><td>佚名</td></tr></table></div>
+<div id="details-2"><table><tr><th>位置</th><th>尺寸</th></tr><tr><td>本幅</td><td>{detail_id % 200} x 50 公分</td></tr></table></div>
+<div id="details-3"><table><tr><th>位置</th><th>質地</th></tr><tr><td>本幅</td><td>絹</td></tr></table></div>
+<div id="details-4"><table><tbody><tr><th>作者</th><th>位置</th><th>內容</th></tr>
+<tr><td>乾隆</td><td>本幅</td><td>雪山行旅<br/>御題詩</td></tr>
+<tr><td colspan="3"><table class="table-details2"><tr><th>印記</th><th>類別</th></tr>
+<tr><td>乾隆御覽之寶</td><td>鑑藏寶璽</td></tr></table></td></tr>
+</tbody></table></div>
+<div id="details-5"><table><tr><th>印記</th><th>所有者</th></tr><tr><td>石渠寶笈</td><td>乾隆</td></tr></table></div>
+<div id="details-6"><table><tr><th>類別</th><th>主題</th></tr><tr><td>山水</td><td>雪景</td></tr></table></div>
+<div id="details-7"><table><tr><th>技法</th></tr><tr><td>設色</td></tr></table></div>
+<div id="details-8"><table><tr><th>內容簡介</th><td>合成的詳情頁 {detail_id}</td></tr></table></div>
+<div id="details-9"><div class="nav-info">保存維護說明</div><a class="btn-project2" onclick="openReport({detail_id})">報告</a></div>
+</body></html>"""
+
+
+def load_recorded_pages(path):
+    """读取录制的详情页，返回 {Detail ID: HTML}。path 为响应缓存目录或 <Detail ID>.html 文件所在目录。"""
+    pages = {}
+    if os.path.isdir(os.path.join(path, 'index')):
+        cache = ResponseCache(path)
+        for entry in cache.entries():
+            detail_id = detail_id_from_url(entry['url'])
+            if detail_id:
+                pages[int(detail_id)] = cache.read_body(entry)
+        return pages
+    for name in sorted(os.listdir(path)):
+        stem, ext = os.path.splitext(name)
+        if ext in ('.html', '.htm') and stem.isdigit():
+            with open(os.path.join(path, name), "r", encoding="utf-8") as f:
+                pages[int(stem)] = f.read()
+    return pages
+
+
+def load_recorded_images(path, limit=IMAGE_VARIANTS * 4):
+    """读取目录（含子目录）中最多 limit 张 JPEG 的字节。"""
+    images = []
+    for dirpath, _, filenames in os.walk(path):
+        for name in sorted(filenames):
+            if name.lower().endswith(('.jpg', '.jpeg')):
+                with open(os.path.join(dirpath, name), 'rb') as f:
+                    images.append(f.read())
+                if len(images) >= limit:
+                    return images
+    return images
+
+
+def synthetic_jpegs(size, count=IMAGE_VARIANTS, seed=0):
+    """生成 count 张带渐变和噪点的 JPEG，压缩后的大小接近真实的书画扫描图。"""
+    rng = np.random.default_rng(seed)
+    width, height = size
+    ys, xs = np.mgrid[0:height, 0:width]
+    images = []
+    for _ in range(count):
+        base = rng.uniform(60, 200, size=3)
+        gradient = (xs / width * 40 + ys / height * 30)[..., None]
+        noise = rng.normal(0, 18, size=(height, width, 3))
+        pixels = np.clip(base + gradient + noise, 0, 255).astype(np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, 'JPEG', quality=85)
+        images.append(buffer.getvalue())
+    return images
+
+
+def _captcha_font():
+    try:
+        return ImageFont.load_default(size=26)
+    except TypeError:  # Pillow < 10.1 没有可缩放的默认字体
+        return ImageFont.load_default()
+
+
+class MockMuseum:
+    """
+    模拟服务的状态: 详情页、图片池、每个会话当前的验证码答案，以及请求计数。
+
+    captcha_noise 为验证码中噪点像素的比例（同时每 0.05 加一条干扰线），captcha_rotate 为每个字符的最大
+    旋转角度；captcha_reject_rate 为即使答案正确也拒绝的概率，用于模拟 OCR 之外的识别难度。
+    lenient_captcha 为 True 时接受任何非空答案，只测量请求链路和 OCR 的开销。
+    captcha_ttl 为验证码下发后可以提交的秒数（0 为不限）。通过验证的验证码即为 Download600 的令牌，
+    始终可以下载验证时的那张图片；token_ttl 秒内（0 为不允许复用）还可以用它下载其他图片，
+    或者再次提交 DownloadDialog600。
+    """
+
+    def __init__(self, items=200, images_per_item=2, recorded=None, recorded_images=None, image_size=(1600, 1200),
+                 latency=50.0, jitter=0.3, error_rate=0.0, throttle_rate=0.0, bandwidth=0.0, captcha_noise=0.05,
+                 captcha_rotate=10.0, captcha_reject_rate=0.0, lenient_captcha=False, captcha_ttl=0.0, token_ttl=0.0,
+                 seed=0):
+        self.pages = load_recorded_pages(recorded) if recorded else {}
+        if not self.pages:
+            self.pages = {detail_id: None for detail_id in range(FIRST_DETAIL_ID, FIRST_DETAIL_ID + items)}
+        self.detail_ids = sorted(self.pages)
+        self.images_per_item = images_per_item
+        self.images = load_recorded_images(recorded_images) if recorded_images else []
+        if not self.images:
+            self.images = synthetic_jpegs(image_size, seed=seed)
+        self.latency = latency / 1000
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.bandwidth = bandwidth * 1024 * 1024
+        self.captcha_noise = captcha_noise
+        self.captcha_rotate = captcha_rotate
+        self.captcha_reject_rate = captcha_reject_rate
+        self.lenient_captcha = lenient_captcha
+        self.captcha_ttl = captcha_ttl
+        self.token_ttl = token_ttl
+        self.random = random.Random(seed)
+        self.font = _captcha_font()
+        self._captchas = {}
+        self._tokens = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    # --- 模拟的网络条件 ---
+    def delay(self):
+        if self.latency > 0:
+            time.sleep(max(0.0, self.random.gauss(self.latency, self.latency * self.jitter)))
+
+    def injected_failure(self):
+        """按错误率返回要注入的状态码 (503 / 429)，不注入时返回 None。"""
+        roll = self.random.random()
+        if roll < self.error_rate:
+            return 503
+        if roll < self.error_rate + self.throttle_rate:
+            return 429
+        return None
+
+    def count(self, endpoint, status):
+        with self._lock:
+            counts = self._counts.setdefault(endpoint, {})
+            counts[status] = counts.get(status, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            return {endpoint: dict(counts) for endpoint, counts in self._counts.items()}
+
+    # --- 页面 ---
+    def search_page(self, page_index, page_size):
+        total_pages = max(1, -(-len(self.detail_ids) // page_size))
+        ids = self.detail_ids[(page_index - 1) * page_size:page_index * page_size]
+        links = ''.join(f'<li><a class="openblank" href="/opendata/Pub/Detail/{detail_id}?lang=zh">文物 {detail_id}</a></li>'
+                        for detail_id in ids)
+        return (f'<html><body><ul class="result-list">{links}</ul>'
+                f'<div class="pager">共 <span id="total-pageCount">{total_pages}</span> 頁</div></body></html>')
+
+    def detail_page(self, detail_id):
+        if detail_id not in self.pages:
+            return None
+        return self.pages[detail_id] or synthetic_detail_html(detail_id, self.images_per_item)
+
+    def image_bytes(self, image_id):
+        return self.images[sum(map(ord, image_id)) % len(self.images)]
+
+    # --- 验证码 ---
+    def new_captcha(self, session_id):
+        text = ''.join(self.random.choice(CHAR_WHITELIST) for _ in range(CAPTCHA_LENGTH))
+        with self._lock:
+            self._captchas[session_id] = (text, time.monotonic())
+        width, height = CAPTCHA_SIZE
+        image = Image.new('L', CAPTCHA_SIZE, 255)
+        step = (width - 16) // CAPTCHA_LENGTH
+        for i, char in enumerate(text):
+            glyph = Image.new('L', (step + 8, height), 0)
+            ImageDraw.Draw(glyph).text((4, 4), char, fill=255, font=self.font)
+            glyph = glyph.rotate(self.random.uniform(-self.captcha_rotate, self.captcha_rotate), resample=Image.BILINEAR)
+            image.paste(0, (8 + i * step, 0, 8 + i * step + glyph.width, height), glyph)
+        draw = ImageDraw.Draw(image)
+        for _ in range(int(self.captcha_noise / 0.05)):
+            draw.line([(self.random.randrange(width), self.random.randrange(height)) for _ in range(2)], fill=90)
+        for _ in range(int(width * height * self.captcha_noise)):
+            draw.point((self.random.randrange(width), self.random.randrange(height)), fill=self.random.randrange(256))
+        buffer = io.BytesIO()
+        image.save(buffer, 'PNG')
+        return buffer.getvalue()
+
+    def check_captcha(self, session_id, answer, image_id=None):
+        if answer and self.token_valid(session_id, answer, None):
+            # 有效期内再次提交通过的验证码
+            self._issue_token(session_id, answer, image_id)
+            return True
+        with self._lock:
+            # 与真实网站一样，每个验证码只能提交一次
+            expected, issued_at = self._captchas.pop(session_id, (None, None))
+        if not answer or expected is None:
+            return False
+        if self.captcha_ttl and time.monotonic() - issued_at > self.captcha_ttl:
+            return False
+        if not self.lenient_captcha and answer.strip().upper() != expected:
+            return False
+        if self.random.random() < self.captcha_reject_rate:
+            return False
+        self._issue_token(session_id, answer, image_id)
+        return True
+
+    def _issue_token(self, session_id, answer, image_id):
+        with self._lock:
+            self._tokens[session_id] = (answer, image_id, time.monotonic())
+
+    def token_valid(self, session_id, token, image_id):
+        """token 是否为该会话通过验证的验证码，且用于验证时的图片 image_id 或仍在 token_ttl 有效期内。"""
+        with self._lock:
+            answer, issued_for, issued_at = self._tokens.get(session_id, (None, None, None))
+        if answer is None or token != answer:
+            return False
+        if image_id is not None and image_id == issued_for:
+            return True
+        return self.token_ttl > 0 and time.monotonic() - issued_at <= self.token_ttl
+
+
+def make_handler(museum):
+    class MockHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _send(self, endpoint, status, body=b'', content_type='text/html; charset=utf-8', headers=None):
+            if isinstance(body, str):
+                body = body.encode('utf-8')
+            museum.count(endpoint, status)
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            if self.command != 'HEAD':
+                self.wfile.write(body)
+
+        def _session_id(self):
+            match = re.search(rf'{SESSION_COOKIE}=([^;]+)', self.headers.get('Cookie', ''))
+            return match.group(1) if match else None
+
+        def _simulate_network(self, endpoint):
+            """模拟延迟并按错误率注入失败，已发送失败响应时返回 True。"""
+            museum.delay()
+            status = museum.injected_failure()
+            if status is None:
+                return False
+            headers = {'Retry-After': '1'} if status == 429 else None
+            self._send(endpoint, status, 'Service Unavailable' if status == 503 else 'Too Many Requests',
+                       headers=headers)
+            return True
+
+        def _read_body(self):
+            return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        def do_POST(self):
+            path = urlparse(self.path).path
+            body = self._read_body()
+            if path == '/opendata/Pub/Search':
+                if self._simulate_network('Search'):
+                    return
+                try:
+                    page_info = json.loads(body)['PageInfo']
+                    page = museum.search_page(int(page_info['PageIndex']), int(page_info['PageSize']))
+                except (ValueError, KeyError, TypeError):
+                    self._send('Search', 400, 'Bad Request')
+                    return
+                self._send('Search', 200, page)
+            elif path == '/opendata/Image/DownloadDialog600':
+                if self._simulate_network('DownloadDialog600'):
+                    return
+                form = {key: values[0] for key, values in parse_qs(body.decode('utf-8')).items()}
+                accepted = museum.check_captcha(self._session_id(), form.get('CaptchaCode'), form.get('ImageId'))
+                result = {'result': accepted, 'message': '' if accepted else '驗證碼錯誤',
+                          'ImageId': form.get('ImageId'), 'Dep': form.get('Dep', 'U'), 'Cid': form.get('ItemId'),
+                          'Captcha': form.get('CaptchaCode'), 'ImageCode': form.get('RandomCode')}
+                self._send('DownloadDialog600', 200, json.dumps(result, ensure_ascii=False),
+                           'application/json; charset=utf-8')
+            else:
+                self._send('other', 404, 'Not Found')
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == '/__stats':
+                self._send('stats', 200, json.dumps(museum.stats()), 'application/json')
+            elif url.path.startswith('/opendata/Pub/Detail/'):
+                self._detail(url.path.rsplit('/', 1)[1])
+            elif url.path == '/opendata/Image/GetCaptchaImageFor600':
+                if self._simulate_network('Captcha'):
+                    return
+                session_id = self._session_id()
+                headers = None
+                if session_id is None:
+                    session_id = secrets.token_hex(12)
+                    headers = {'Set-Cookie': f'{SESSION_COOKIE}={session_id}; path=/; HttpOnly'}
+                self._send('Captcha', 200, museum.new_captcha(session_id), 'image/png', headers)
+            elif url.path == '/opendata/Image/Download600':
+                self._download(parse_qs(url.query))
+            else:
+                self._send('other', 404, 'Not Found')
+
+        def _detail(self, detail_id):
+            if self._simulate_network('Detail'):
+                return
+            html = museum.detail_page(int(detail_id)) if detail_id.isdigit() else None
+            if html is None:
+                self._send('Detail', 404, 'Not Found')
+                return
+            etag = f'"detail-{detail_id}"'
+            if self.headers.get('If-None-Match') == etag:
+                self._send('Detail', 304, headers={'ETag': etag})
+                return
+            self._send('Detail', 200, html, headers={'ETag': etag})
+
+        def _download(self, params):
+            if self._simulate_network('Download600'):
+                return
+            if not all(params.get(key) for key in ('imageId', 'cid', 'capchaCode', 'code')):
+                self._send('Download600', 400, 'Bad Request')
+                return
+            if not museum.token_valid(self._session_id(), params['capchaCode'][0], params['imageId'][0]):
+                # 与真实网站的错误页一样返回 200 的 HTML，客户端需要检查 Content-Type
+                self._send('Download600', 200, '<html><body>驗證碼已失效，請重新驗證</body></html>')
+                return
+            data = museum.image_bytes(params['imageId'][0])
+            start, status, headers = 0, 200, {'Accept-Ranges': 'bytes'}
+            match = re.match(r'bytes=(\d+)-', self.headers.get('Range', ''))
+            if match and int(match.group(1)) < len(data):
+                start, status = int(match.group(1)), 206
+                headers['Content-Range'] = f'bytes {start}-{len(data) - 1}/{len(data)}'
+            museum.count('Download600', status)
+            self.send_response(status)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Content-Length', str(len(data) - start))
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.end_headers()
+            # 按 --bandwidth 限制单个连接的传输速度
+            for offset in range(start, len(data), CHUNK_SIZE):
+                chunk = data[offset:offset + CHUNK_SIZE]
+                self.wfile.write(chunk)
+                if museum.bandwidth:
+                    time.sleep(len(chunk) / museum.bandwidth)
+
+        def log_message(self, format, *args):
+            pass
+
+    return MockHandler
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 客户端超时或中断下载时连接被重置，属于正常情况
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+
+def start_server(museum, host='127.0.0.1', port=0):
+    """在后台线程中启动模拟服务，返回 (server, 基础URL)。port 为 0 时自动选择空闲端口。"""
+    server = MockServer((host, port), make_handler(museum))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def add_server_arguments(parser):
+    """添加模拟服务的命令行参数，run_benchmark.py 与本脚本共用。"""
+    group = parser.add_argument_group("模拟服务")
+    group.add_argument('--items', type=int, default=200, help="合成详情页的数量，使用录制页面时忽略 (默认: 200)")
+    group.add_argument('--images-per-item', type=int, default=2, help="每个合成详情页的图片数 (默认: 2)")
+    group.add_argument('--recorded', help="录制的详情页: 响应缓存目录（如 output/html_cache）或 <Detail ID>.html 文件所在目录")
+    group.add_argument('--recorded-images', help="作为 Download600 响应的真实 JPEG 所在目录（如 output/taipei_museum_artifacts）")
+    group.add_argument('--image-size', default='1600x1200', help="合成图片的尺寸 宽x高 (默认: 1600x1200)")
+    group.add_argument('--latency', type=float, default=50.0, help="每个响应的平均延迟，毫秒 (默认: 50)")
+    group.add_argument('--jitter', type=float, default=0.3, help="延迟的标准差与平均值之比 (默认: 0.3)")
+    group.add_argument('--error-rate', type=float, default=0.0, help="返回 503 的概率 (默认: 0)")
+    group.add_argument('--throttle-rate', type=float, default=0.0, help="返回 429 (Retry-After: 1) 的概率 (默认: 0)")
+    group.add_argument('--bandwidth', type=float, default=0.0, help="每个连接的下载带宽 MB/s，0 为不限 (默认: 0)")
+    group.add_argument('--captcha-noise', type=float, default=0.05, help="验证码噪点像素比例，每 0.05 另加一条干扰线 (默认: 0.05)")
+    group.add_argument('--captcha-rotate', type=float, default=10.0, help="验证码字符的最大旋转角度 (默认: 10)")
+    group.add_argument('--captcha-reject-rate', type=float, default=0.0, help="答案正确时仍然拒绝的概率 (默认: 0)")
+    group.add_argument('--lenient-captcha', action='store_true', help="接受任何非空的验证码答案")
+    group.add_argument('--captcha-ttl', type=float, default=0.0, help="验证码下发后可以提交的秒数，0 为不限 (默认: 0)")
+    group.add_argument('--token-ttl', type=float, default=0.0,
+                       help="通过验证的验证码可用于其他图片的秒数，0 为只能下载验证时的图片 (默认: 0)")
+    group.add_argument('--seed', type=int, default=0, help="随机数种子 (默认: 0)")
+    return group
+
+
+def museum_from_args(args):
+    width, height = (int(value) for value in args.image_size.lower().split('x'))
+    return MockMuseum(items=args.items, images_per_item=args.images_per_item, recorded=args.recorded,
+                      recorded_images=args.recorded_images, image_size=(width, height), latency=args.latency,
+                      jitter=args.jitter, error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+                      bandwidth=args.bandwidth, captcha_noise=args.captcha_noise, captcha_rotate=args.captcha_rotate,
+                      captcha_reject_rate=args.captcha_reject_rate, lenient_captcha=args.lenient_captcha,
+                      captcha_ttl=args.captcha_ttl, token_ttl=args.token_ttl, seed=args.seed)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="启动故宫开放数据平台的本地模拟服务。")
+    parser.add_argument('--host', default='127.0.0.1', help="监听地址 (默认: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8765, help="监听端口，0 为自动选择 (默认: 8765)")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    museum = museum_from_args(args)
+    server, base_url = start_server(museum, args.host, args.port)
+    # 第一行输出服务地址，run_benchmark.py 从这里读取
+    print(base_url, flush=True)
+    print(f"模拟服务已启动: {len(museum.detail_ids)} 个详情页，{len(museum.images)} 张图片样本。"
+          f"使用方法: NPM_BASE_URL={base_url} python src/harvest_urls.py", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,326 @@
+"""
+抓取流程的性能基准测试。
+
+启动本地模拟服务 (mock_server.py)，在临时工作目录中依次运行各阶段，报告每个阶段的吞吐量
+（文物/秒或图片/秒、MB/s）、各端点响应延迟的 p50/p99、CPU 时间和峰值内存:
+- harvest:  列表页采集 (harvest_urls.harvest_category)；
+- metadata: 详情页抓取、解析、写入 (scrape_metadata.run_pipeline)，工作进程的 CPU 时间即 HTML 解析开销；
+- images:   验证码识别与图片下载 (download_new.run_concurrent_download)，工作进程的 CPU 时间即 OCR 开销；
+- analysis: 图片分析 (analyze_images.analyze_images)。
+
+每个阶段在独立的子进程中运行，因此 ru_maxrss 就是该阶段的峰值 RSS，与之前的阶段无关；模拟服务运行在
+当前进程中，它的 CPU 开销不计入任何阶段。各阶段的输出写入工作目录下的 logs/<阶段>.log。
+模拟服务的参数（延迟、错误率、验证码难度等）见 mock_server.py。
+
+用法:
+    python benchmark/run_benchmark.py
+    python benchmark/run_benchmark.py --items 500 --latency 120 --error-rate 0.02 --captcha-noise 0.1
+    python benchmark/run_benchmark.py --stages metadata --recorded output/html_cache --fetch-workers 16
+    python benchmark/run_benchmark.py --stages images --token-ttl 30 --warm-sessions 0
+    python benchmark/run_benchmark.py --stages metadata --http2        # 需安装 httpx[http2]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+
+# --- 动态路径处理 ---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+sys.path.insert(0, os.path.join(PROJECT_ROOT, 'src'))
+# ---
+
+from http_client import HTTP_CONNECTIONS, add_http_arguments, configure_http, new_session
+from mock_server import add_server_arguments, museum_from_args, start_server
+from rate_limit import Throttle, metric_endpoint_of
+from telemetry import REGISTRY
+
+STAGES = ['harvest', 'metadata', 'images', 'analysis']
+# 运行某个阶段之前必须先完成的阶段；没有被要求的前置阶段照常运行，但不出现在报告中
+PREREQUISITES = {'harvest': [], 'metadata': ['harvest'], 'images': ['harvest'], 'analysis': ['harvest', 'images']}
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/138.0.0.0 Safari/537.36'}
+CATEGORY = "繪畫"
+
+
+class RecordingThrottle(Throttle):
+    """在 Throttle 的基础上记录每个端点的响应延迟（秒）和响应体字节数（按 Content-Length）。"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latencies = {}
+        self.bytes = 0
+
+    def record(self, url, response=None, error=None, latency=None):
+        super().record(url, response, error, latency)
+        name = metric_endpoint_of(url)
+        with self._lock:
+            if latency is not None:
+                self.latencies.setdefault(name, []).append(latency)
+            if response is not None:
+                self.bytes += int(response.headers.get('Content-Length') or 0)
+
+    def latency_summary(self):
+        with self._lock:
+            return {name: {'count': len(values), 'p50_ms': round(percentile(values, 50) * 1000, 1),
+                           'p99_ms': round(percentile(values, 99) * 1000, 1)}
+                    for name, values in sorted(self.latencies.items())}
+
+
+def percentile(values, q):
+    """最近秩法的第 q 百分位数。"""
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * q // 100))
+    return ordered[int(rank) - 1]
+
+
+def peak_rss_mb():
+    """当前进程的峰值 RSS (MB)。"""
+    # exec 之后 ru_maxrss 仍然保留父进程的峰值，Linux 上改读只属于当前进程的 VmHWM
+    try:
+        with open('/proc/self/status', "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    # ru_maxrss 在 Linux 上以 KB 为单位，在 macOS 上以字节为单位
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def cpu_seconds(usage):
+    return usage.ru_utime + usage.ru_stime
+
+
+def file_stats(root):
+    """返回目录下 JPEG 文件的 (数量, 总字节数)。"""
+    count = total = 0
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            if name.lower().endswith(('.jpg', '.jpeg')):
+                count += 1
+                total += os.path.getsize(os.path.join(dirpath, name))
+    return count, total
+
+
+# --- 各阶段（在子进程中运行） ---
+def harvest_stage(work_dir, args, limiter):
+    from harvest_urls import harvest_category
+    from url_frontier import UrlFrontier
+
+    frontier = UrlFrontier(os.path.join(work_dir, 'output', 'url_frontier.tsv'))
+    with new_session(args.harvest_concurrency) as session:
+        new_count, failed_pages = harvest_category(session, limiter, frontier, CATEGORY, args.page_size,
+                                                   args.harvest_concurrency)
+    return {'unit': '文物', 'items': new_count, 'failed_pages': len(failed_pages)}
+
+
+def metadata_stage(work_dir, args, limiter):
+    import csv
+    from metadata_store import open_store
+    from response_cache import ResponseCache
+    from scrape_metadata import CSV_HEADERS, run_pipeline
+    from url_frontier import UrlFrontier
+
+    urls = UrlFrontier(os.path.join(work_dir, 'output', 'url_frontier.tsv')).urls()
+    cache = ResponseCache(os.path.join(work_dir, 'output', 'html_cache'))
+    with open_store(args.store, work_dir) as store, \
+            open(os.path.join(work_dir, 'output', 'metadata.csv'), 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_HEADERS)
+        writer.writeheader()
+        run_pipeline(urls, HEADERS, writer, store, fetch_workers=args.fetch_workers, parse_workers=args.parse_workers,
+                     backend=args.parser, cache=cache, limiter=limiter)
+        written = len(store)
+    return {'unit': '文物', 'items': written, 'failed': len(urls) - written}
+
+
+def images_stage(work_dir, args, limiter):
+    from captcha_solver import CaptchaSolver, CaptchaStats
+    from download_new import run_concurrent_download
+    from url_frontier import UrlFrontier
+
+    urls = UrlFrontier(os.path.join(work_dir, 'output', 'url_frontier.tsv')).urls()
+    stats = CaptchaStats()
+    done = []
+    with CaptchaSolver(args.ocr_workers) as solver:
+        result = run_concurrent_download(list(enumerate(urls, start=1)), HEADERS, work_dir,
+                                         workers=args.download_workers, solver=solver, stats=stats, limiter=limiter,
+                                         on_image_done=done.append, warm_sessions=args.warm_sessions,
+                                         reuse_tokens=not args.no_token_reuse)
+    return {'unit': '图片', 'items': len(done), 'bytes': sum(os.path.getsize(path) for path in done),
+            'captcha': stats.summary(), 'sessions': result['sessions']}
+
+
+def analysis_stage(work_dir, args, limiter):
+    from analyze_images import analyze_images
+
+    root = os.path.join(work_dir, 'output', 'taipei_museum_artifacts')
+    count, total = file_stats(root)
+    analyze_images(root, os.path.join(work_dir, 'output', 'image_analysis_results.csv'), workers=args.analysis_workers,
+                   use_processes=True, with_metrics=args.metrics)
+    return {'unit': '图片', 'items': count, 'bytes': total}
+
+
+STAGE_FUNCS = {'harvest': harvest_stage, 'metadata': metadata_stage, 'images': images_stage,
+               'analysis': analysis_stage}
+
+
+def run_stage(stage, work_dir, args):
+    """在当前（子）进程中运行一个阶段，返回测量结果。"""
+    configure_http(args)
+    limiter = RecordingThrottle(args.rate, args.max_rate)
+    self_before = resource.getrusage(resource.RUSAGE_SELF)
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    started = time.perf_counter()
+    result = STAGE_FUNCS[stage](work_dir, args, limiter)
+    elapsed = time.perf_counter() - started
+    self_after = resource.getrusage(resource.RUSAGE_SELF)
+    # 进程池在阶段结束前已经关闭，工作进程都已被回收，因此计入 RUSAGE_CHILDREN
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    transferred = result.pop('bytes', None)
+    transferred = limiter.bytes if transferred is None else transferred
+    result.update({
+        'stage': stage,
+        'elapsed_s': round(elapsed, 3),
+        'items_per_s': round(result['items'] / elapsed, 2) if elapsed else None,
+        'mb': round(transferred / 1024 / 1024, 2),
+        'mb_per_s': round(transferred / 1024 / 1024 / elapsed, 2) if elapsed else None,
+        'latency': limiter.latency_summary(),
+        # 新建的 HTTP 连接数，连接被复用时远小于请求数
+        'connections': sum(sample['value'] for sample in HTTP_CONNECTIONS.snapshot()),
+        'requests': limiter.summary(),
+        'cpu_main_s': round(cpu_seconds(self_after) - cpu_seconds(self_before), 3),
+        'cpu_workers_s': round(cpu_seconds(children_after) - cpu_seconds(children_before), 3),
+        'peak_rss_main_mb': peak_rss_mb(),
+        # 所有工作进程中最大的峰值 RSS (Linux 上 ru_maxrss 的单位为 KB)
+        'peak_rss_workers_mb': round(children_after.ru_maxrss / 1024, 1),
+        # telemetry 中各函数的耗时分布、验证码尝试次数等，只保存在结果 JSON 中
+        'telemetry': REGISTRY.snapshot(),
+    })
+    return result
+
+
+def spawn_stage(stage, work_dir, base_url):
+    """在子进程中运行一个阶段，输出写入 logs/<阶段>.log，返回测量结果。"""
+    log_path = os.path.join(work_dir, 'logs', f"{stage}.log")
+    result_path = os.path.join(work_dir, 'logs', f"{stage}.json")
+    command = [sys.executable, os.path.abspath(__file__), *sys.argv[1:], '--run-stage', stage, '--work-dir', work_dir]
+    env = dict(os.environ, NPM_BASE_URL=base_url, PYTHONUNBUFFERED='1')
+    with open(log_path, 'w', encoding='utf-8') as log:
+        returncode = subprocess.call(command, stdout=log, stderr=subprocess.STDOUT, env=env)
+    if returncode != 0 or not os.path.exists(result_path):
+        raise RuntimeError(f"阶段 {stage} 运行失败 (退出码 {returncode})，详见 {log_path}")
+    with open(result_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def print_report(results, server_stats):
+    print(f"\n{'阶段':<10}{'数量':>8}{'耗时(s)':>10}{'每秒':>10}{'MB/s':>9}{'CPU主(s)':>10}{'CPU工作(s)':>11}"
+          f"{'RSS主(MB)':>11}{'RSS工作(MB)':>12}")
+    for r in results:
+        print(f"{r['stage']:<10}{r['items']:>8}{r['elapsed_s']:>10.2f}{r['items_per_s']:>10.2f}{r['mb_per_s']:>9.2f}"
+              f"{r['cpu_main_s']:>10.2f}{r['cpu_workers_s']:>11.2f}{r['peak_rss_main_mb']:>11.1f}"
+              f"{r['peak_rss_workers_mb']:>12.1f}")
+
+    print("\n响应延迟 (ms):")
+    for r in results:
+        for name, latency in r['latency'].items():
+            print(f"  {r['stage']:<10}{name:<20}n={latency['count']:<7}p50={latency['p50_ms']:<9}p99={latency['p99_ms']}")
+
+    print("\n新建连接: " + ", ".join(f"{r['stage']}={r['connections']} (请求 "
+                                   f"{sum(c['ok'] + c['failed'] for c in r['requests'].values())})" for r in results))
+
+    by_stage = {r['stage']: r for r in results}
+    if 'metadata' in by_stage and by_stage['metadata']['items']:
+        r = by_stage['metadata']
+        print(f"\nHTML 解析 CPU: {r['cpu_workers_s']:.2f} s，每个文物 {r['cpu_workers_s'] / r['items'] * 1000:.1f} ms")
+    if 'images' in by_stage:
+        r = by_stage['images']
+        captcha = r['captcha']
+        if captcha['attempts']:
+            print(f"验证码 OCR CPU: {r['cpu_workers_s']:.2f} s，每次识别 "
+                  f"{r['cpu_workers_s'] / captcha['attempts'] * 1000:.1f} ms")
+        print(f"验证码统计: {json.dumps(captcha, ensure_ascii=False)}")
+        if r['sessions']:
+            print(f"验证码会话池: {json.dumps(r['sessions'], ensure_ascii=False)}")
+    print(f"模拟服务请求统计: {json.dumps(server_stats, ensure_ascii=False)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在本地模拟服务上运行抓取流程的性能基准测试。")
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES, help="要测量的阶段 (默认: 全部)")
+    parser.add_argument('--work-dir', help="工作目录，保留在测试结束后 (默认: 临时目录，结束后删除)")
+    parser.add_argument('--output', help="结果 JSON 的保存路径 (默认: output/benchmark_<时间>.json)")
+    parser.add_argument('--rate', type=float, default=50.0, help="每个端点的初始每秒请求次数 (默认: 50)")
+    parser.add_argument('--max-rate', type=float, default=500.0, help="自适应调速的上限，次/秒 (默认: 500)")
+    parser.add_argument('--page-size', type=int, default=30, help="列表页每页的文物数 (默认: 30)")
+    parser.add_argument('--harvest-concurrency', type=int, default=4, help="列表页并发请求数 (默认: 4)")
+    parser.add_argument('--fetch-workers', type=int, default=8, help="详情页抓取线程数 (默认: 8)")
+    parser.add_argument('--parse-workers', type=int, default=None, help="详情页解析进程数 (默认: CPU核数)")
+    parser.add_argument('--parser', choices=['bs4', 'lxml'], default='bs4',
+                        help="HTML解析后端；lxml 更快，页面结构不完整时自动改用 bs4 解析 (默认: bs4)")
+    parser.add_argument('--store', choices=['json', 'segments'], default='json', help="元数据存储方式 (默认: json)")
+    parser.add_argument('--download-workers', type=int, default=4, help="图片下载线程数 (默认: 4)")
+    parser.add_argument('--ocr-workers', type=int, default=2, help="验证码 OCR 进程数 (默认: 2)")
+    parser.add_argument('--warm-sessions', type=int, default=None,
+                        help="预先识别好验证码的会话数，0 表示不预热 (默认: 下载线程数 + 2；只有 1 个下载线程时为 0)")
+    parser.add_argument('--no-token-reuse', action='store_true', help="不尝试复用验证成功的验证码令牌")
+    parser.add_argument('--analysis-workers', type=int, default=2, help="图片分析进程数 (默认: 2)")
+    parser.add_argument('--metrics', action='store_true', help="分析时同时计算图片质量指标")
+    parser.add_argument('--run-stage', choices=STAGES, help=argparse.SUPPRESS)
+    add_http_arguments(parser)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    if args.run_stage:
+        result = run_stage(args.run_stage, args.work_dir, args)
+        with open(os.path.join(args.work_dir, 'logs', f"{args.run_stage}.json"), 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False)
+        return
+
+    stages = [stage for stage in STAGES
+              if stage in args.stages or any(stage in PREREQUISITES[s] for s in args.stages)]
+    work_dir = os.path.abspath(args.work_dir) if args.work_dir else tempfile.mkdtemp(prefix='npm-benchmark-')
+    os.makedirs(os.path.join(work_dir, 'logs'), exist_ok=True)
+    output_path = args.output or os.path.join(PROJECT_ROOT, 'output', f"benchmark_{time.strftime('%Y%m%d-%H%M%S')}.json")
+
+    print("正在准备模拟服务...")
+    museum = museum_from_args(args)
+    server, base_url = start_server(museum)
+    print(f"模拟服务: {base_url}，{len(museum.detail_ids)} 个详情页；工作目录: {work_dir}")
+    results = []
+    try:
+        for stage in stages:
+            print(f"正在运行阶段 {stage} ...")
+            result = spawn_stage(stage, work_dir, base_url)
+            print(f"  {result['items']} 个{result['unit']}，用时 {result['elapsed_s']:.2f} 秒")
+            if stage in args.stages:
+                results.append(result)
+    except RuntimeError as e:
+        # 保留工作目录以便查看日志
+        print(f"错误: {e}")
+        sys.exit(1)
+    finally:
+        server.shutdown()
+        server.server_close()
+    if not args.work_dir:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_report(results, museum.stats())
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    report = {'timestamp': time.strftime("%Y-%m-%d %H:%M:%S"), 'argv': sys.argv[1:], 'stages': results,
+              'server': museum.stats()}
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已保存至: {output_path}")
+
+
+if __name__ == '__main__':
+    main()
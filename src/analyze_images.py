@@ -1,71 +1,313 @@
 import os
 import csv
 import sys
+import struct
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from PIL import Image
+from tqdm import tqdm
 
-def analyze_images(root_folder, output_csv):
+from image_index import ImageIndex
+from image_metrics import METRIC_COLUMNS, compute_metrics, metrics_to_columns
+from telemetry import REGISTRY, add_telemetry_arguments, start_telemetry
+
+# Supported image extensions
+SUPPORTED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp')
+JPEG_EXTENSIONS = ('.jpg', '.jpeg')
+CSV_COLUMNS = ['File Path', 'Width (px)', 'Height (px)', 'Size (KB)']
+
+# SOF0-SOF15 carry the frame size; C4 (DHT), C8 (JPG) and CC (DAC) share the range but do not
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# Number of files handed to a worker per task, so the pool is not dominated by scheduling overhead
+BATCH_SIZE = 64
+
+IMAGES_ANALYZED = REGISTRY.counter('npm_images_analyzed_total', "已分析的图片数: ok / failed", ['result'])
+
+
+def iter_image_entries(root_folder):
+    """
+    Yields os.DirEntry objects for the images below root_folder.
+
+    Directories are visited depth-first and entries are sorted per directory, so the
+    output order is stable and memory use depends only on the depth of the tree,
+    not on the number of files.
+    """
+    stack = [root_folder]
+    while stack:
+        folder = stack.pop()
+        try:
+            with os.scandir(folder) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError as e:
+            print(f"\n无法读取目录 {folder}: {e}")
+            continue
+        subdirs = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+            elif entry.name.lower().endswith(SUPPORTED_EXTENSIONS):
+                yield entry
+        stack.extend(reversed(subdirs))
+
+
+def iter_image_files(root_folder):
+    """Yields image file paths below root_folder, see iter_image_entries."""
+    for entry in iter_image_entries(root_folder):
+        yield entry.path
+
+
+def jpeg_dimensions(file_path):
+    """
+    Reads (width, height) from the first SOF segment of a JPEG file.
+
+    Only the marker headers are read, the image data is never decoded.
+    Returns None if the file is not a JPEG or no SOF segment is found.
+    """
+    with open(file_path, 'rb') as f:
+        if f.read(2) != b'\xff\xd8':
+            return None
+        while True:
+            byte = f.read(1)
+            if not byte:
+                return None
+            if byte != b'\xff':
+                continue
+            marker = f.read(1)
+            # Skip fill bytes between markers
+            while marker == b'\xff':
+                marker = f.read(1)
+            if not marker:
+                return None
+            code = marker[0]
+            # Standalone markers (TEM, RSTn, SOI) have no length field
+            if code == 0x01 or 0xD0 <= code <= 0xD8:
+                continue
+            if code == 0xD9:
+                return None
+            header = f.read(2)
+            if len(header) < 2:
+                return None
+            length = struct.unpack('>H', header)[0]
+            if code in JPEG_SOF_MARKERS:
+                frame = f.read(5)
+                if len(frame) < 5:
+                    return None
+                height, width = struct.unpack('>xHH', frame)
+                return width, height
+            f.seek(length - 2, os.SEEK_CUR)
+
+
+def image_dimensions(file_path):
+    """Returns (width, height), probing JPEG headers directly and falling back to Pillow."""
+    if file_path.lower().endswith(JPEG_EXTENSIONS):
+        size = jpeg_dimensions(file_path)
+        if size:
+            return size
+    # Image.open only parses the header; pixel data is not loaded until needed
+    with Image.open(file_path) as img:
+        return img.size
+
+
+def probe_image(file_path, root_folder):
+    """Returns a CSV row [relative path, width, height, size KB] for one image."""
+    file_size_kb = round(os.path.getsize(file_path) / 1024, 2)
+    width, height = image_dimensions(file_path)
+    return [os.path.relpath(file_path, root_folder), width, height, file_size_kb]
+
+
+def csv_columns(with_metrics=False):
+    return CSV_COLUMNS + [header for _, header in METRIC_COLUMNS] if with_metrics else CSV_COLUMNS
+
+
+def probe_batch(file_paths, root_folder, with_metrics=False):
+    """
+    Probes a batch of files. Returns (rows, errors) so one bad file does not fail the batch.
+    With with_metrics the quality metrics of image_metrics are appended to each row.
+    """
+    rows, errors = [], []
+    probed = []
+    for file_path in file_paths:
+        try:
+            rows.append(probe_image(file_path, root_folder))
+            probed.append(file_path)
+        except Exception as e:
+            errors.append((file_path, str(e)))
+    if with_metrics and rows:
+        metrics, metric_errors = compute_metrics(probed)
+        errors.extend(metric_errors)
+        rows = [row + metrics_to_columns(metrics[file_path])
+                for row, file_path in zip(rows, probed) if file_path in metrics]
+    return rows, errors
+
+
+def batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_batch_results(batches, func, args=(), workers=1, use_processes=False):
+    """
+    Yields func(batch, *args) for each batch, in order.
+
+    With workers > 1 the batches run on a thread pool (or a process pool when use_processes
+    is set). At most workers * 4 batches are in flight at any time, so memory stays flat
+    regardless of how many batches the iterable produces.
+    """
+    if workers <= 1:
+        for batch in batches:
+            yield func(batch, *args)
+        return
+
+    executor_cls = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    max_in_flight = workers * 4
+    with executor_cls(max_workers=workers) as executor:
+        in_flight = deque()
+        for batch in batches:
+            in_flight.append(executor.submit(func, batch, *args))
+            if len(in_flight) >= max_in_flight:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+def iter_probed_batches(root_folder, workers=1, use_processes=False, files=None, with_metrics=False):
+    """
+    Yields (rows, errors) per batch of files, in directory order.
+    files defaults to every image below root_folder.
+    """
+    batches = batched(iter_image_files(root_folder) if files is None else files, BATCH_SIZE)
+    return iter_batch_results(batches, probe_batch, (root_folder, with_metrics), workers, use_processes)
+
+
+def analyze_images(root_folder, output_csv, workers=1, use_processes=False, with_metrics=False):
     """
     Analyzes images in a root folder to extract resolution and file size.
 
+    Rows are written to the CSV as soon as each batch finishes, in directory order.
+
     Args:
         root_folder (str): The path to the folder containing images.
         output_csv (str): The path to the output CSV file.
+        workers (int): Number of parallel workers; 1 probes files in the calling thread.
+        use_processes (bool): Use a process pool instead of a thread pool.
+        with_metrics (bool): Also compute the image_metrics quality metrics.
     """
-    image_data = []
-    # Supported image extensions
-    supported_extensions = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp')
-
     print(f"\n开始分析目录: {root_folder}")
-    # Use a generator to count files to show progress
-    all_files = list(os.walk(root_folder))
-    total_files = sum(len(files) for _, _, files in all_files)
-    processed_files = 0
-
-    for subdir, _, files in all_files:
-        for file in files:
-            processed_files += 1
-            print(f"\r正在处理: {processed_files}/{total_files}", end="")
-            if file.lower().endswith(supported_extensions):
-                file_path = os.path.join(subdir, file)
-                try:
-                    # Get file size
-                    file_size_kb = round(os.path.getsize(file_path) / 1024, 2)
-
-                    # Get image dimensions
-                    with Image.open(file_path) as img:
-                        width, height = img.size
-
-                    # Get relative path for cleaner output
-                    relative_path = os.path.relpath(file_path, root_folder)
-
-                    image_data.append([relative_path, width, height, file_size_kb])
-
-                except Exception as e:
-                    print(f"\n无法处理 {file_path}: {e}")
-
-    # Write data to CSV
-    if image_data:
-        # Sort data by folder, then filename
-        image_data.sort(key=lambda x: os.path.dirname(x[0]))
-        
-        with open(output_csv, 'w', newline='', encoding='utf-8') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(['File Path', 'Width (px)', 'Height (px)', 'Size (KB)'])
-            writer.writerows(image_data)
-        print(f"\n\n成功分析 {len(image_data)} 张图片。")
+    image_count = 0
+    with open(output_csv, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(csv_columns(with_metrics))
+        with tqdm(desc="正在处理", unit="张") as progress:
+            for rows, errors in iter_probed_batches(root_folder, workers, use_processes, with_metrics=with_metrics):
+                writer.writerows(rows)
+                image_count += len(rows)
+                IMAGES_ANALYZED.inc(len(rows), result='ok')
+                IMAGES_ANALYZED.inc(len(errors), result='failed')
+                for file_path, error in errors:
+                    tqdm.write(f"无法处理 {file_path}: {error}")
+                progress.update(len(rows) + len(errors))
+
+    if image_count:
+        print(f"\n成功分析 {image_count} 张图片。")
         print(f"结果已保存至: {output_csv}")
     else:
+        os.remove(output_csv)
         print("\n在指定目录中未找到任何图片。")
 
+
+def write_index_csv(index, output_csv, with_metrics=False):
+    """Writes every row of an ImageIndex to output_csv, ordered by path."""
+    with open(output_csv, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(csv_columns(with_metrics))
+        if with_metrics:
+            writer.writerows(list(row[:4]) + metrics_to_columns(row[4]) for row in index.iter_rows())
+        else:
+            writer.writerows(row[:4] for row in index.iter_rows())
+
+
+def analyze_images_incremental(root_folder, output_csv, index_path, workers=1, use_processes=False,
+                               with_metrics=False):
+    """
+    Incremental variant of analyze_images backed by an ImageIndex.
+
+    Files whose (relative path, size, mtime_ns) match the index are not opened again; only new or
+    changed files are probed, rows for deleted files are dropped, and the full CSV is rewritten
+    from the index (ordered by path). With with_metrics, indexed files that have no metrics yet
+    are probed again as well.
+    """
+    print(f"\n开始增量分析目录: {root_folder}")
+    index = ImageIndex(index_path)
+    stats = {}  # relpath -> (size, mtime_ns) of the files that need probing
+    unchanged = 0
+
+    def changed_files():
+        nonlocal unchanged
+        for entry in iter_image_entries(root_folder):
+            st = entry.stat()
+            relpath = os.path.relpath(entry.path, root_folder)
+            if index.is_current(relpath, st.st_size, st.st_mtime_ns, need_metrics=with_metrics):
+                unchanged += 1
+            else:
+                stats[relpath] = (st.st_size, st.st_mtime_ns)
+                yield entry.path
+
+    probed = failed = 0
+    try:
+        with tqdm(desc="正在处理新增或修改的图片", unit="张") as progress:
+            for rows, errors in iter_probed_batches(root_folder, workers, use_processes, files=changed_files(),
+                                                    with_metrics=with_metrics):
+                for relpath, width, height, size_kb, *metric_values in rows:
+                    size, mtime_ns = stats.pop(relpath)
+                    metrics = dict(zip((key for key, _ in METRIC_COLUMNS), metric_values)) if metric_values else None
+                    index.upsert(relpath, size, mtime_ns, width, height, size_kb, metrics)
+                for file_path, error in errors:
+                    relpath = os.path.relpath(file_path, root_folder)
+                    stats.pop(relpath, None)
+                    index.discard(relpath)
+                    tqdm.write(f"无法处理 {file_path}: {error}")
+                index.commit()
+                probed += len(rows)
+                failed += len(errors)
+                IMAGES_ANALYZED.inc(len(rows), result='ok')
+                IMAGES_ANALYZED.inc(len(errors), result='failed')
+                progress.update(len(rows) + len(errors))
+        removed = index.remove_unseen()
+        index.commit()
+
+        write_index_csv(index, output_csv, with_metrics)
+        total = len(index)
+    finally:
+        index.close()
+
+    print(f"\n未变化 {unchanged} 张，新分析 {probed} 张，失败 {failed} 张，移除已删除的 {removed} 张。")
+    print(f"共 {total} 张图片，结果已保存至: {output_csv}")
+
+
 if __name__ == '__main__':
-    # Check if the user provided a directory path as a command-line argument
-    if len(sys.argv) < 2:
-        print("\n错误: 请提供要分析的图片目录路径。")
-        print("用法: python src/analyze_images.py <图片目录路径>")
-        print("例如: python src/analyze_images.py output/main_images")
-        sys.exit(1)  # Exit the script if no directory is provided
+    parser = argparse.ArgumentParser(description="统计目录中所有图片的分辨率和文件大小。",
+                                     epilog="例如: python src/analyze_images.py output/main_images --workers 8")
+    parser.add_argument('directory', help="要分析的图片目录路径")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="并行分析的线程（或进程）数，1 表示串行 (默认: 1；加 --metrics 时为 CPU 核数)")
+    parser.add_argument('--processes', action='store_true', help="使用进程池代替线程池")
+    parser.add_argument('--incremental', action='store_true',
+                        help="增量模式：只分析新增或修改过的图片，其余结果取自上次的索引")
+    parser.add_argument('--metrics', action='store_true',
+                        help="同时计算清晰度、曝光、各通道均值/标准差和感知哈希"
+                             "（CPU 密集，使用进程池，默认每个 CPU 核一个进程）")
+    add_telemetry_arguments(parser)
+    args = parser.parse_args()
+    start_telemetry(args)
 
-    artifacts_directory = sys.argv[1]
+    artifacts_directory = args.directory
 
     # --- 动态路径处理 ---
     SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -73,10 +315,18 @@ if __name__ == '__main__':
     # Create a descriptive name for the output CSV file based on the input directory
     dir_name = os.path.basename(os.path.normpath(artifacts_directory))
     output_file = os.path.join(PROJECT_ROOT, "output", f"analysis_{dir_name}.csv")
+    index_file = os.path.join(PROJECT_ROOT, "output", f"analysis_{dir_name}.sqlite")
     # ---
-    
+
     # The input directory path can be relative, so we don't force it to be absolute
     if not os.path.isdir(artifacts_directory):
         print(f"\n错误: 找不到指定的目录 '{artifacts_directory}'")
+        sys.exit(1)
+    use_processes = args.processes or args.metrics
+    workers = args.workers or ((os.cpu_count() or 1) if args.metrics else 1)
+    if args.incremental:
+        analyze_images_incremental(artifacts_directory, output_file, index_file, workers=workers,
+                                   use_processes=use_processes, with_metrics=args.metrics)
     else:
-        analyze_images(artifacts_directory, output_file)
+        analyze_images(artifacts_directory, output_file, workers=workers, use_processes=use_processes,
+                       with_metrics=args.metrics)
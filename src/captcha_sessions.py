@@ -0,0 +1,247 @@
+"""
+预热的验证码会话池。
+
+下载一张图片原本要依次: 下载验证码 -> OCR -> 提交 DownloadDialog600 -> 请求 Download600，
+前两步都在每张图片的关键路径上。CaptchaSessionPool 维护若干个 HTTP 会话（每个会话有自己的
+验证码 Cookie），后台线程提前在每个会话上下载并识别一张验证码；下载线程领取一个已经带有答案的会话，
+直接提交 DownloadDialog600，用完后归还，由后台线程为它准备下一张验证码。
+后台每次只为会话准备一张验证码；识别结果为空时该验证码同样计入图片的尝试次数 (download_new.MAX_RETRIES)，
+下载线程不再另外识别一张，因此每次尝试最多请求一张验证码，与不使用会话池时相同。
+
+验证成功后服务器返回的下载参数（validation_data，其中 Captcha 为通过验证的验证码）保存在会话上，
+同一会话处理下一张图片时依次尝试复用它:
+    download  用旧的 Captcha 令牌直接请求新图片的 Download600，省掉验证码和 DownloadDialog600；
+    dialog    用旧的验证码为新图片再提交一次 DownloadDialog600，省掉下载验证码和 OCR
+              （只在会话上没有预先识别的答案时尝试，因为每张验证码只能提交一次）。
+每次复用都按令牌的年龄记录成败。某种复用最初几次都失败时不再尝试；出现过成功也出现过失败时，
+只在令牌年龄不超过最久一次成功、或小于最早一次失败时尝试，summary() 据此给出服务器端有效期的估计。
+"""
+import queue
+import threading
+import time
+
+from http_client import new_session
+from telemetry import QUEUE_DEPTH, REGISTRY
+
+# 会话池默认比下载线程多几个，使归还的会话在重新预热期间仍有现成的会话可用
+EXTRA_SESSIONS = 2
+# 预先识别的答案超过该秒数后不再使用，避免服务器端的验证码已过期
+MAX_ANSWER_AGE = 120.0
+# 某种复用最初连续失败这么多次（且从未成功）时，本次运行不再尝试
+REUSE_PROBES = 3
+REUSE_LEVELS = ('download', 'dialog')
+AGE_BUCKETS = (1, 2, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+POOL_WAIT_SECONDS = REGISTRY.histogram('npm_captcha_pool_wait_seconds', "下载线程等待预热会话的时间（秒）")
+WARM_RESULTS = REGISTRY.counter('npm_captcha_warm_total', "后台预先识别验证码的结果: answer / empty", ['result'])
+TOKEN_REUSE = REGISTRY.counter('npm_captcha_token_reuse_total', "验证码令牌复用: level=download / dialog，result=hit / miss",
+                               ['level', 'result'])
+TOKEN_AGE_SECONDS = REGISTRY.histogram('npm_captcha_token_age_seconds', "尝试复用时令牌的年龄（秒）",
+                                       ['level', 'result'], buckets=AGE_BUCKETS)
+ANSWER_AGE_SECONDS = REGISTRY.histogram('npm_captcha_answer_age_seconds', "预先识别的答案提交时的年龄（秒）",
+                                        ['result'], buckets=AGE_BUCKETS)
+
+
+class CaptchaLease:
+    """
+    池中的一个会话，以及其上预先识别好的验证码答案和最近一次验证成功得到的下载参数。
+    empty 表示后台已为该会话下载了验证码但识别结果为空；ocr_ms 为后台识别这张验证码的耗时。
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.answer = None
+        self.solved_at = None
+        self.empty = False
+        self.ocr_ms = None
+        self.token = None
+        self.token_at = None
+
+    def take_answer(self, max_age=MAX_ANSWER_AGE):
+        """取出预先识别的答案及其年龄。每个验证码只能提交一次，取出后即清空；没有或已过期时返回 (None, None)。"""
+        answer, solved_at = self.answer, self.solved_at
+        self.answer = self.solved_at = None
+        if not answer:
+            return None, None
+        age = time.monotonic() - solved_at
+        return (answer, age) if age <= max_age else (None, None)
+
+    def token_age(self):
+        return time.monotonic() - self.token_at if self.token else None
+
+    def set_token(self, validation_data):
+        self.token = validation_data
+        self.token_at = time.monotonic()
+
+    def drop_token(self):
+        self.token = self.token_at = None
+
+
+class _ReuseLevel:
+    """一种复用方式的成败记录，用于决定是否值得尝试以及估计令牌有效期。"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.max_hit_age = None
+        self.min_miss_age = None
+
+    def worth_trying(self, age):
+        if not self.hits:
+            return self.misses < REUSE_PROBES
+        if self.max_hit_age is not None and age <= self.max_hit_age:
+            return True
+        return self.min_miss_age is None or age < self.min_miss_age
+
+    def record(self, age, hit):
+        if hit:
+            self.hits += 1
+            self.max_hit_age = age if self.max_hit_age is None else max(self.max_hit_age, age)
+        else:
+            self.misses += 1
+            self.min_miss_age = age if self.min_miss_age is None else min(self.min_miss_age, age)
+
+    def summary(self):
+        tried = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / tried, 3) if tried else None,
+            # 有效期至少为最久一次成功时的年龄；最早一次失败给出一个（可能偏低的）上界
+            "max_hit_age_s": round(self.max_hit_age, 1) if self.max_hit_age is not None else None,
+            "min_miss_age_s": round(self.min_miss_age, 1) if self.min_miss_age is not None else None,
+        }
+
+
+class CaptchaSessionPool:
+    """
+    预热的验证码会话池。solve(session) 在给定会话上下载并识别一张验证码，返回 (答案, OCR 耗时毫秒)
+    （失败时答案为空字符串），通常为绑定了验证码地址、限速器和 OCR 进程池的 download_new.solve_captcha。
+
+    size 个会话各由一个后台线程准备验证码，请求速率仍由 solve 内部的限速器控制。
+    reuse_tokens 为 False 时不尝试复用验证成功的令牌。
+    """
+
+    def __init__(self, solve, size=4, max_answer_age=MAX_ANSWER_AGE, reuse_tokens=True):
+        self._solve = solve
+        self.max_answer_age = max_answer_age
+        self._ready = queue.Queue()
+        self._cold = queue.Queue()
+        self._leases = [CaptchaLease(new_session(1)) for _ in range(size)]
+        self._levels = {level: _ReuseLevel() for level in REUSE_LEVELS} if reuse_tokens else {}
+        self._lock = threading.Lock()
+        self.acquired = 0
+        self.acquired_warm = 0
+        self.wait_seconds = 0.0
+        self.warmed = 0
+        self.warmed_empty = 0
+        self.answers_accepted = 0
+        self.answers_rejected = 0
+        self.answers_expired = 0
+        for lease in self._leases:
+            self._cold.put(lease)
+        QUEUE_DEPTH.set_function(self._ready.qsize, queue='captcha_warm_sessions')
+        self._threads = [threading.Thread(target=self._warm, daemon=True) for _ in range(size)]
+        for thread in self._threads:
+            thread.start()
+
+    def _warm(self):
+        while True:
+            lease = self._cold.get()
+            if lease is None:
+                return
+            # 识别为空时不在这里重试，而是照常交出会话，由下载线程计为一次失败的尝试
+            answer, lease.ocr_ms = self._solve(lease.session)
+            WARM_RESULTS.inc(result='answer' if answer else 'empty')
+            lease.answer, lease.solved_at, lease.empty = answer or None, time.monotonic(), not answer
+            with self._lock:
+                self.warmed += 1
+                if not answer:
+                    self.warmed_empty += 1
+            self._ready.put(lease)
+
+    def acquire(self):
+        """领取一个会话，没有现成的会话时等待后台线程预热完成。用完后必须调用 release()。"""
+        started = time.monotonic()
+        lease = self._ready.get()
+        waited = time.monotonic() - started
+        POOL_WAIT_SECONDS.observe(waited)
+        with self._lock:
+            self.acquired += 1
+            self.wait_seconds += waited
+            if lease.answer or lease.token:
+                self.acquired_warm += 1
+        return lease
+
+    def release(self, lease):
+        """归还会话。答案还没用掉时直接放回，否则交给后台线程准备下一张验证码。"""
+        if lease.answer and time.monotonic() - lease.solved_at <= self.max_answer_age:
+            self._ready.put(lease)
+        else:
+            self._cold.put(lease)
+
+    def take_empty(self, lease):
+        """
+        后台为该会话下载的验证码识别结果为空时返回 True 并清除该标记。
+        这张验证码计入图片的尝试次数，下载线程不应再另外识别一张。
+        """
+        empty, lease.empty = lease.empty, False
+        return empty
+
+    def take_answer(self, lease):
+        """取出会话上预先识别的答案，返回 (答案, 年龄)；没有可用答案时返回 (None, None)。"""
+        had_answer = bool(lease.answer)
+        answer, age = lease.take_answer(self.max_answer_age)
+        if had_answer and answer is None:
+            with self._lock:
+                self.answers_expired += 1
+        return answer, age
+
+    def record_answer(self, age, accepted):
+        """记录一个预先识别的答案提交后是否被接受。"""
+        ANSWER_AGE_SECONDS.observe(age, result='accepted' if accepted else 'rejected')
+        with self._lock:
+            if accepted:
+                self.answers_accepted += 1
+            else:
+                self.answers_rejected += 1
+
+    def reusable_token(self, lease, level):
+        """会话上有值得按 level 方式复用的令牌时返回 (validation_data, 年龄)，否则返回 (None, None)。"""
+        if level not in self._levels or not lease.token:
+            return None, None
+        age = lease.token_age()
+        with self._lock:
+            worth_trying = self._levels[level].worth_trying(age)
+        return (lease.token, age) if worth_trying else (None, None)
+
+    def record_reuse(self, level, age, hit):
+        result = 'hit' if hit else 'miss'
+        TOKEN_REUSE.inc(level=level, result=result)
+        TOKEN_AGE_SECONDS.observe(age, level=level, result=result)
+        with self._lock:
+            self._levels[level].record(age, hit)
+
+    def summary(self):
+        with self._lock:
+            submitted = self.answers_accepted + self.answers_rejected
+            return {
+                "sessions": len(self._leases),
+                "acquired": self.acquired,
+                "warm_rate": round(self.acquired_warm / self.acquired, 3) if self.acquired else None,
+                "mean_wait_ms": round(self.wait_seconds / self.acquired * 1000, 1) if self.acquired else None,
+                "captchas_warmed": self.warmed,
+                "warm_empty_ocr": self.warmed_empty,
+                "warm_answer_accuracy": round(self.answers_accepted / submitted, 3) if submitted else None,
+                "answers_expired": self.answers_expired,
+                "token_reuse": {level: stats.summary() for level, stats in self._levels.items()},
+            }
+
+    def close(self):
+        for _ in self._threads:
+            self._cold.put(None)
+        for thread in self._threads:
+            thread.join()
+        for lease in self._leases:
+            lease.session.close()
+        QUEUE_DEPTH.remove(queue='captcha_warm_sessions')
@@ -0,0 +1,186 @@
+"""
+验证码识别服务。
+
+OCR 在常驻的进程池中执行，下载线程只需提交验证码图片字节并等待结果，
+不会在下载线程上直接 fork tesseract 子进程。若安装了 tesserocr，每个 OCR 进程只初始化一次
+Tesseract 引擎并在之后的所有识别中复用；否则退回到 pytesseract。
+
+识别前先用 NumPy 做预处理（Otsu 二值化 -> 去除孤立噪点 -> 按列投影切分字符并重新等距排列），
+以提高首次识别的成功率。CaptchaStats 记录每次尝试的结果，用来衡量每张图片平均需要几次
+DownloadDialog600 往返。
+"""
+import io
+import json
+import time
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+import pytesseract
+
+try:
+    import tesserocr
+except ImportError:  # tesserocr 为可选依赖
+    tesserocr = None
+
+CHAR_WHITELIST = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+TESSERACT_CONFIG = rf'--psm 7 -c tessedit_char_whitelist={CHAR_WHITELIST}'
+
+
+# --- 预处理 ---
+def otsu_threshold(gray):
+    """对 uint8 灰度数组计算 Otsu 阈值。"""
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    total = gray.size
+    weight_bg = np.cumsum(hist)
+    weight_fg = total - weight_bg
+    cum_mean = np.cumsum(hist * np.arange(256))
+    mean_bg = cum_mean / np.maximum(weight_bg, 1)
+    mean_fg = (cum_mean[-1] - cum_mean) / np.maximum(weight_fg, 1)
+    between_var = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+    return int(np.argmax(between_var))
+
+
+def remove_isolated_pixels(binary, min_neighbors=2):
+    """去掉 8 邻域内前景像素少于 min_neighbors 个的孤立噪点。binary 中 True 表示字符像素。"""
+    padded = np.pad(binary, 1).astype(np.uint8)
+    h, w = binary.shape
+    neighbors = sum(padded[1 + dy:1 + dy + h, 1 + dx:1 + dx + w]
+                    for dy in (-1, 0, 1) for dx in (-1, 0, 1) if (dy, dx) != (0, 0))
+    return binary & (neighbors >= min_neighbors)
+
+
+def segment_columns(binary, gap=4, margin=8):
+    """
+    按列投影切分字符，去掉字符之间和四周多余的空白，再以固定间距重新拼接，
+    使字符粘连或间距不均的验证码更容易被按单行文本识别。
+    """
+    columns = binary.any(axis=0)
+    rows = np.flatnonzero(binary.any(axis=1))
+    if not columns.any():
+        return binary
+    top, bottom = rows[0], rows[-1] + 1
+    # 找出连续的前景列区间
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], columns.astype(np.int8), [0]))))
+    segments = [binary[top:bottom, start:end] for start, end in zip(edges[::2], edges[1::2])]
+    height = bottom - top
+    spacer = np.zeros((height, gap), dtype=bool)
+    pieces = []
+    for segment in segments:
+        pieces.extend((segment, spacer))
+    joined = np.hstack(pieces[:-1])
+    return np.pad(joined, margin)
+
+
+def preprocess_captcha(image):
+    """返回适合 OCR 的二值化图像（白底黑字）。"""
+    gray = np.asarray(image.convert('L'), dtype=np.uint8)
+    binary = gray < otsu_threshold(gray)
+    # 如果“前景”占了大多数像素，说明是浅色字深色底，取反
+    if binary.mean() > 0.5:
+        binary = ~binary
+    binary = remove_isolated_pixels(binary)
+    binary = segment_columns(binary)
+    return Image.fromarray(np.where(binary, 0, 255).astype(np.uint8), mode='L')
+
+
+# --- OCR 进程 ---
+_tess_api = None
+
+
+def _init_worker():
+    global _tess_api
+    if tesserocr is not None:
+        _tess_api = tesserocr.PyTessBaseAPI(psm=tesserocr.PSM.SINGLE_LINE)
+        _tess_api.SetVariable('tessedit_char_whitelist', CHAR_WHITELIST)
+
+
+def ocr_captcha_bytes(data, preprocess=True):
+    """识别一张验证码图片，返回 (识别结果, 耗时毫秒)。可在进程池或当前进程中调用。"""
+    started = time.perf_counter()
+    image = Image.open(io.BytesIO(data))
+    if preprocess:
+        image = preprocess_captcha(image)
+    if _tess_api is not None:
+        _tess_api.SetImage(image)
+        text = _tess_api.GetUTF8Text()
+    else:
+        text = pytesseract.image_to_string(image, config=TESSERACT_CONFIG)
+    return text.strip(), round((time.perf_counter() - started) * 1000, 1)
+
+
+class CaptchaSolver:
+    """常驻的 OCR 进程池。多个下载线程可以同时调用 solve()。"""
+
+    def __init__(self, workers=2, preprocess=True):
+        self.preprocess = preprocess
+        self._pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+
+    def solve(self, data):
+        return self._pool.submit(ocr_captcha_bytes, data, self.preprocess).result()
+
+    def close(self):
+        self._pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CaptchaStats:
+    """
+    记录每次验证码尝试的结果。
+
+    每次尝试写一行 JSON 到 log_path（可省略），并累计：
+    识别次数、空结果次数、DownloadDialog600 往返次数、被服务器接受的次数，以及每张图片的往返次数。
+    """
+
+    def __init__(self, log_path=None):
+        self.log_path = log_path
+        self._lock = threading.Lock()
+        self.attempts = 0
+        self.empty = 0
+        self.round_trips = 0
+        self.accepted = 0
+        self.images = 0
+        self.images_first_try = 0
+        self.round_trips_per_image = []
+
+    def record_attempt(self, image_id, attempt, ocr_text, accepted, ocr_ms=None):
+        """accepted 为 None 表示识别结果为空、没有提交 DownloadDialog600。"""
+        with self._lock:
+            self.attempts += 1
+            if accepted is None:
+                self.empty += 1
+            else:
+                self.round_trips += 1
+                self.accepted += bool(accepted)
+            if self.log_path:
+                entry = {"timestamp": time.strftime("%Y-%m-%d %H:%M:%S"), "image_id": image_id, "attempt": attempt,
+                         "ocr": ocr_text, "accepted": accepted, "ocr_ms": ocr_ms}
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def record_image(self, round_trips, success):
+        with self._lock:
+            self.images += 1
+            if success and round_trips == 1:
+                self.images_first_try += 1
+            self.round_trips_per_image.append(round_trips)
+
+    def summary(self):
+        with self._lock:
+            per_image = self.round_trips_per_image
+            return {
+                "attempts": self.attempts,
+                "empty_ocr": self.empty,
+                "dialog_round_trips": self.round_trips,
+                "accepted": self.accepted,
+                "accuracy": round(self.accepted / self.round_trips, 3) if self.round_trips else None,
+                "images": self.images,
+                "first_try_rate": round(self.images_first_try / self.images, 3) if self.images else None,
+                "mean_round_trips_per_image": round(sum(per_image) / len(per_image), 2) if per_image else None,
+            }
@@ -0,0 +1,429 @@
+"""
+端到端的流水线爬取：采集URL -> 抓取元数据 -> 下载图片 -> 分析图片，各阶段同时运行。
+
+分步运行时每一步都要等上一步全部完成；这里各阶段之间用有界队列连接：
+- 采集: 每拿到一页列表页，新发现的文物立即登记到状态库并进入元数据队列；
+- 元数据: fetch_workers 个线程抓取详情页（写入共享的响应缓存），解析交给 parse_workers 个进程，
+  单独的写入线程按顺序写元数据存储、CSV 和导出目标，然后把文物交给图片阶段；
+- 图片: 即 download_new.run_concurrent_download，详情页直接命中元数据阶段写入的缓存，不再重复请求；
+- 分析: 每张图片下载完成后立即送去分析，结果写入与 analyze_images.py --incremental 相同的索引；
+- 派生图 (--derivatives): 每张图片下载完成后同时在进程池中生成缩略图、预览图（及可选的 DeepZoom 瓦片），
+  与 derivatives.py 的输出相同。
+
+队列满时上游阻塞等待，因此无论文物总数多少，内存占用都有上限。所有阶段共享一个按端点自适应调速的
+Throttle。中断后重新运行即可：状态库中尚未完成的文物会先于新采集的文物进入流水线。
+任一阶段出错（如无法写入导出目标）时流水线立即中止并以非零状态退出，已完成的部分保存在状态库中。
+
+用法:
+    python src/crawl_pipeline.py --category 繪畫 銅器 --both --download-workers 4
+    python src/crawl_pipeline.py --skip-harvest --metrics     # 只处理状态库中尚未完成的文物
+    python src/crawl_pipeline.py --derivatives --tiles        # 同时生成派生图和瓦片
+    python src/crawl_pipeline.py --skip-harvest --shard 2/4   # 多机分片，见 sharding.py
+"""
+import os
+import sys
+import csv
+import json
+import heapq
+import queue
+import argparse
+import threading
+from itertools import groupby
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+
+from tqdm import tqdm
+
+from analyze_images import BATCH_SIZE, IMAGES_ANALYZED, iter_batch_results, probe_batch, write_index_csv
+from captcha_solver import CaptchaSolver, CaptchaStats
+from crawl_state import open_default_state
+from derivatives import (DEFAULT_SIZES, DERIVATIVE_BATCH_SIZE, DERIVATIVES_CREATED, SIZES, DerivativePlanner,
+                         derive_batch)
+from download_new import DOWNLOAD_MODES, add_session_pool_arguments, run_concurrent_download
+from harvest_urls import harvest_all_urls
+from http_client import add_http_arguments, configure_http, new_session
+from image_index import ImageIndex
+from image_metrics import METRIC_COLUMNS
+from metadata_export import ParquetExporter
+from metadata_search import SearchIndex, default_index_path
+from metadata_store import STORE_KINDS, open_store
+from rate_limit import Throttle
+from response_cache import ResponseCache
+from scrape_metadata import (CSV_HEADERS, METADATA_RESULTS, fetch_detail_page, parse_artifact_html_timed,
+                             record_parse_time, write_metadata)
+from sharding import add_shard_argument, write_shard_marker
+from telemetry import QUEUE_DEPTH, add_telemetry_arguments, start_telemetry
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/138.0.0.0 Safari/537.36'}
+# 分析和派生图阶段等待凑满一批的最长时间（秒），图片下载较慢时也能及时处理
+ANALYSIS_FLUSH_INTERVAL = 2.0
+# 等待各阶段结束时检查是否有阶段出错的间隔（秒）
+STAGE_POLL_INTERVAL = 0.5
+
+
+def iter_queue(q):
+    """逐个取出队列中的元素，直到遇到 None。"""
+    while True:
+        item = q.get()
+        if item is None:
+            return
+        yield item
+
+
+class CrawlPipeline:
+    """
+    把各阶段连接起来的编排器。各阶段在各自的线程中运行，通过有界队列传递
+    (文物序号, 详情页URL, 是否需要抓取元数据)、(文物序号, 详情页URL) 和图片路径。
+    """
+
+    def __init__(self, project_root, categories, modes=('all',), harvest=True, refresh=False, images=True,
+                 analysis=True, with_metrics=False, fetch_workers=4, parse_workers=None, download_workers=4,
+                 analysis_workers=2, harvest_concurrency=4, queue_size=64, rate=2.0, max_rate=None,
+                 store_kind='json', parquet=False, ocr_workers=2, backend='bs4', warm_sessions=None,
+                 reuse_tokens=True, derivative_sizes=(), tiles=False, derivative_workers=2, shard=None,
+                 preprocess=True):
+        self.project_root = project_root
+        self.output_dir = os.path.join(project_root, 'output')
+        self.categories = categories
+        self.modes = modes
+        self.harvest = harvest
+        self.refresh = refresh
+        self.images = images
+        self.analysis = analysis and images
+        self.derivatives = bool(derivative_sizes or tiles) and images
+        self.derivative_sizes = derivative_sizes
+        self.tiles = tiles
+        self.derivative_workers = derivative_workers
+        self.with_metrics = with_metrics
+        self.fetch_workers = fetch_workers
+        self.parse_workers = parse_workers
+        self.download_workers = download_workers
+        self.analysis_workers = analysis_workers
+        self.harvest_concurrency = harvest_concurrency
+        self.store_kind = store_kind
+        self.parquet = parquet
+        self.ocr_workers = ocr_workers
+        self.preprocess = preprocess
+        self.backend = backend
+        self.warm_sessions = warm_sessions
+        self.reuse_tokens = reuse_tokens
+        self.shard = shard
+
+        self.state = open_default_state()
+        self.cache = ResponseCache(os.path.join(self.output_dir, 'html_cache'))
+        self.limiter = Throttle(rate, max_rate)
+        self.url_queue = queue.Queue(maxsize=queue_size)
+        self.parsed_queue = queue.Queue(maxsize=queue_size)
+        self.image_queue = queue.Queue(maxsize=queue_size)
+        self.analysis_queue = queue.Queue(maxsize=queue_size * 4)
+        self.derivative_queue = queue.Queue(maxsize=queue_size * 4)
+        for name in ('url', 'parsed', 'image', 'analysis', 'derivative'):
+            QUEUE_DEPTH.set_function(getattr(self, f"{name}_queue").qsize, queue=name)
+        self._seen = set()
+        self._seen_lock = threading.Lock()
+        # 任一阶段抛出异常时置位；上下游阶段可能因此永远阻塞在队列上，run() 不再等待它们
+        self.failed = threading.Event()
+        self.errors = []
+        self.counts = {'harvested': 0, 'metadata_ok': 0, 'metadata_failed': 0, 'images_queued': 0,
+                       'analyzed': 0, 'analysis_failed': 0, 'derived': 0, 'derivatives_failed': 0}
+
+    # --- 采集阶段 ---
+    def _enqueue(self, index, url, needs_metadata):
+        with self._seen_lock:
+            if url in self._seen:
+                return
+            self._seen.add(url)
+        self.url_queue.put((index, url, needs_metadata))
+
+    def _on_new_urls(self, urls, category):
+        self.state.add_artifacts((url, category, None) for url in urls)
+        self.counts['harvested'] += len(urls)
+        for url in urls:
+            # 分片运行时其他分片的文物只登记，不处理
+            if self.shard is None or self.shard.contains_url(url):
+                self._enqueue(self.state.index_of(url), url, True)
+
+    def harvest_stage(self):
+        try:
+            # 先处理状态库中之前未完成的文物。两个查询都按序号分页读取，归并后按序号逐个入队
+            sources = [((index, url, True) for index, url in self.state.pending_metadata(shard=self.shard))]
+            if self.images:
+                sources.append((index, url, False)
+                               for index, url in self.state.pending_image_artifacts(self.modes, shard=self.shard))
+            for index, group in groupby(heapq.merge(*sources), key=lambda item: item[0]):
+                group = list(group)
+                self._enqueue(index, group[0][1], any(needs_metadata for _, _, needs_metadata in group))
+            if self.harvest:
+                harvest_all_urls(self.categories, concurrency=self.harvest_concurrency, refresh=self.refresh,
+                                 limiter=self.limiter, on_new_urls=self._on_new_urls)
+        finally:
+            # 出错时也通知抓取线程结束；异常由 _run_stage 记录并中止流水线
+            for _ in range(self.fetch_workers):
+                self.url_queue.put(None)
+
+    # --- 元数据阶段 ---
+    def fetch_stage(self, session, parse_pool):
+        for index, url, needs_metadata in iter_queue(self.url_queue):
+            if not needs_metadata:
+                self.parsed_queue.put((index, url, None))
+                continue
+            try:
+                html = fetch_detail_page(session, url, HEADERS, self.cache, limiter=self.limiter)
+                # 解析在进程池中进行，写入线程按顺序等待结果，抓取线程不必等待解析
+                self.parsed_queue.put((index, url, parse_pool.submit(parse_artifact_html_timed, url, html,
+                                                                     self.backend)))
+            except Exception as e:
+                self.parsed_queue.put((index, url, e))
+        self.parsed_queue.put(None)
+
+    def write_stage(self, writer, store, exporters):
+        finished_fetchers = 0
+        while finished_fetchers < self.fetch_workers:
+            item = self.parsed_queue.get()
+            if item is None:
+                finished_fetchers += 1
+                continue
+            index, url, result = item
+            if result is not None:
+                try:
+                    if isinstance(result, Exception):
+                        raise result
+                    metadata, seconds = result.result()
+                    record_parse_time(seconds)
+                    write_metadata(metadata, writer, store, exporters)
+                    self.state.mark_metadata(url, True, item_id=metadata['UniqueID'])
+                    self.counts['metadata_ok'] += 1
+                except Exception as e:
+                    tqdm.write(f"抓取元数据 {url} 时发生错误: {e}")
+                    METADATA_RESULTS.inc(result='failed')
+                    self.state.mark_metadata(url, False, str(e))
+                    self.counts['metadata_failed'] += 1
+                    # 元数据失败的文物留待下次运行重试，不进入图片阶段
+                    continue
+            if self.images:
+                self.image_queue.put((index, url))
+                self.counts['images_queued'] += 1
+
+    def metadata_stage(self):
+        store = open_store(self.store_kind, self.project_root)
+        index_file = default_index_path(self.project_root)
+        search_index = SearchIndex(index_file) if os.path.exists(index_file) else None
+        csv_file = os.path.join(self.output_dir, 'metadata.csv')
+        try:
+            with open(csv_file, "a", encoding="utf-8", newline="") as f, \
+                    new_session(self.fetch_workers) as session, \
+                    ProcessPoolExecutor(max_workers=self.parse_workers) as parse_pool, \
+                    (ParquetExporter(os.path.join(self.output_dir, 'metadata_parquet'))
+                     if self.parquet else nullcontext()) as parquet:
+                writer = csv.DictWriter(f, fieldnames=CSV_HEADERS)
+                if f.tell() == 0: writer.writeheader()
+                exporters = [e for e in (parquet, search_index) if e is not None]
+
+                fetchers = [threading.Thread(target=self.fetch_stage, args=(session, parse_pool), daemon=True)
+                            for _ in range(self.fetch_workers)]
+                for thread in fetchers:
+                    thread.start()
+                self.write_stage(writer, store, exporters)
+                for thread in fetchers:
+                    thread.join()
+        finally:
+            # 出错时也通知图片阶段结束，已排队的图片照常下载
+            if self.images:
+                self.image_queue.put(None)
+            store.close()
+            if search_index is not None:
+                search_index.close()
+
+    # --- 图片阶段 ---
+    def image_stage(self):
+        solver = CaptchaSolver(self.ocr_workers, self.preprocess) if self.ocr_workers > 0 else None
+        stats = CaptchaStats(os.path.join(self.output_dir, 'captcha_attempts.jsonl'))
+        done_queues = [q for q, enabled in ((self.analysis_queue, self.analysis),
+                                            (self.derivative_queue, self.derivatives)) if enabled]
+
+        def on_image_done(path):
+            for q in done_queues:
+                q.put(path)
+
+        try:
+            run_concurrent_download(iter_queue(self.image_queue), HEADERS, self.project_root,
+                                    workers=self.download_workers, solver=solver, stats=stats, state=self.state,
+                                    modes=self.modes, limiter=self.limiter,
+                                    on_image_done=on_image_done if done_queues else None,
+                                    warm_sessions=self.warm_sessions, reuse_tokens=self.reuse_tokens,
+                                    preprocess=self.preprocess)
+        finally:
+            if solver:
+                solver.close()
+            for q in done_queues:
+                q.put(None)
+        print(f"验证码统计: {json.dumps(stats.summary(), ensure_ascii=False)}")
+
+    # --- 分析阶段 ---
+    def _batches(self, source_queue, size=BATCH_SIZE):
+        """从队列中凑批：凑满 size 张，或等待 ANALYSIS_FLUSH_INTERVAL 秒后有多少算多少。"""
+        batch = []
+        while True:
+            try:
+                path = source_queue.get(timeout=ANALYSIS_FLUSH_INTERVAL if batch else None)
+            except queue.Empty:
+                yield batch
+                batch = []
+                continue
+            if path is None:
+                break
+            batch.append(path)
+            if len(batch) == size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def analysis_stage(self):
+        """
+        分析下载完成的图片。路径相对 output/ 计算，第一级目录（taipei_museum_artifacts 或 main_images）
+        决定写入哪个索引 output/analysis_<目录>.sqlite，结束时由索引重新生成对应的 CSV。
+        """
+        indexes = {}
+        metric_keys = [key for key, _ in METRIC_COLUMNS]
+        try:
+            for rows, errors in iter_batch_results(self._batches(self.analysis_queue), probe_batch,
+                                                   (self.output_dir, self.with_metrics), self.analysis_workers,
+                                                   use_processes=self.with_metrics):
+                for relpath, width, height, size_kb, *metric_values in rows:
+                    root, relpath_in_root = relpath.split(os.sep, 1)
+                    if root not in indexes:
+                        indexes[root] = ImageIndex(os.path.join(self.output_dir, f"analysis_{root}.sqlite"))
+                    st = os.stat(os.path.join(self.output_dir, relpath))
+                    metrics = dict(zip(metric_keys, metric_values)) if metric_values else None
+                    indexes[root].upsert(relpath_in_root, st.st_size, st.st_mtime_ns, width, height, size_kb, metrics)
+                for file_path, error in errors:
+                    tqdm.write(f"无法分析 {file_path}: {error}")
+                for index in indexes.values():
+                    index.commit()
+                IMAGES_ANALYZED.inc(len(rows), result='ok')
+                IMAGES_ANALYZED.inc(len(errors), result='failed')
+                self.counts['analyzed'] += len(rows)
+                self.counts['analysis_failed'] += len(errors)
+            for root, index in indexes.items():
+                write_index_csv(index, os.path.join(self.output_dir, f"analysis_{root}.csv"), self.with_metrics)
+        finally:
+            for index in indexes.values():
+                index.close()
+
+    # --- 派生图阶段 ---
+    def derivative_stage(self):
+        """为下载完成的图片生成派生图，写入 output/derivatives/。已是最新的跳过，同一文件的硬链接只解码一次。"""
+        planner = DerivativePlanner(os.path.join(self.output_dir, 'derivatives'), self.derivative_sizes, self.tiles)
+        # 路径相对 output/ 计算，与 derivatives.py 的默认目录一致
+        planned = ([item for item in (planner.plan(path, self.output_dir) for path in batch) if item]
+                   for batch in self._batches(self.derivative_queue, DERIVATIVE_BATCH_SIZE))
+        failed = set()
+        for results, errors in iter_batch_results((batch for batch in planned if batch), derive_batch,
+                                               planner.derive_args(), self.derivative_workers, use_processes=True):
+            for source_path, _, _ in results:
+                planner.done(source_path)
+            for source_path, error in errors:
+                failed.add(planner.done(source_path))
+                tqdm.write(f"无法生成派生图 {source_path}: {error}")
+            DERIVATIVES_CREATED.inc(len(results), result='ok')
+            DERIVATIVES_CREATED.inc(len(errors), result='failed')
+            self.counts['derived'] += len(results)
+            self.counts['derivatives_failed'] += len(errors)
+        self.counts['derived'] += planner.link_duplicates(failed)
+
+    def _run_stage(self, stage):
+        try:
+            stage()
+        except BaseException as e:
+            self.errors.append((stage.__name__, e))
+            tqdm.write(f"{stage.__name__} 发生错误，流水线中止: {e!r}")
+            self.failed.set()
+
+    def run(self):
+        """运行全部阶段直到结束，返回是否成功。任一阶段出错时立即返回 False，其余阶段的守护线程随进程退出。"""
+        stages = [self.harvest_stage, self.metadata_stage]
+        if self.images:
+            stages.append(self.image_stage)
+        if self.analysis:
+            stages.append(self.analysis_stage)
+        if self.derivatives:
+            stages.append(self.derivative_stage)
+        threads = [threading.Thread(target=self._run_stage, args=(stage,), name=stage.__name__, daemon=True)
+                   for stage in stages]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            while thread.is_alive() and not self.failed.is_set():
+                thread.join(STAGE_POLL_INTERVAL)
+
+        print(f"\n流水线{'中止' if self.failed.is_set() else '结束'}: {json.dumps(self.counts, ensure_ascii=False)}")
+        print(f"请求统计: {json.dumps(self.limiter.summary(), ensure_ascii=False)}")
+        print(f"爬取状态: {json.dumps(self.state.progress(), ensure_ascii=False)}")
+        for name, error in self.errors:
+            print(f"错误: {name}: {error!r}")
+        return not self.failed.is_set()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="以流水线方式依次运行 URL 采集、元数据抓取、图片下载和图片分析。")
+    parser.add_argument('--category', nargs='+', default=["繪畫"], help="要采集的文物分类，可指定多个 (默认: 繪畫)")
+    parser.add_argument('--refresh', action='store_true', help="增量采集：遇到全部已知的列表页即停止翻页")
+    parser.add_argument('--skip-harvest', action='store_true', help="不采集新的URL，只处理状态库中尚未完成的文物")
+    parser.add_argument('--skip-images', action='store_true', help="只抓取元数据，不下载图片")
+    parser.add_argument('--skip-analysis', action='store_true', help="下载图片后不做分析")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--all', dest='mode', action='store_const', const='all', help="下载全部图片 (默认)")
+    mode.add_argument('--main-only', dest='mode', action='store_const', const='main', help="只下载主图")
+    mode.add_argument('--both', dest='mode', action='store_const', const='both', help="全部图片和主图")
+    parser.add_argument('--harvest-concurrency', type=int, default=4, help="列表页并发请求数 (默认: 4)")
+    parser.add_argument('--fetch-workers', type=int, default=4, help="详情页抓取线程数 (默认: 4)")
+    parser.add_argument('--parse-workers', type=int, default=None, help="详情页解析进程数 (默认: CPU核数)")
+    parser.add_argument('--download-workers', type=int, default=4, help="图片下载线程数 (默认: 4)")
+    parser.add_argument('--analysis-workers', type=int, default=2, help="图片分析线程（或进程）数 (默认: 2)")
+    parser.add_argument('--queue-size', type=int, default=64, help="阶段之间队列的容量，决定内存上限 (默认: 64)")
+    parser.add_argument('--rate', type=float, default=2.0, help="每个端点的初始每秒请求次数 (默认: 2.0)")
+    parser.add_argument('--max-rate', type=float, default=None, help="自适应调速的上限，次/秒 (默认: --rate 的 4 倍)")
+    parser.add_argument('--parser', choices=['bs4', 'lxml'], default='bs4',
+                        help="HTML解析后端；lxml 更快，页面结构不完整时自动改用 bs4 解析 (默认: bs4)")
+    parser.add_argument('--store', choices=STORE_KINDS, default='json', help="元数据存储方式 (默认: json)")
+    parser.add_argument('--parquet', action='store_true', help="同时把元数据写入 output/metadata_parquet/")
+    parser.add_argument('--metrics', action='store_true', help="分析时同时计算图片质量指标（使用进程池）")
+    parser.add_argument('--ocr-workers', type=int, default=2, help="验证码 OCR 进程数，0 表示在下载线程中直接识别 (默认: 2)")
+    parser.add_argument('--no-preprocess', action='store_true', help="OCR 前不做验证码图像预处理")
+    parser.add_argument('--derivatives', action='store_true',
+                        help="图片下载后生成派生图到 output/derivatives/，见 derivatives.py")
+    parser.add_argument('--derivative-sizes', nargs='+', choices=list(SIZES), default=list(DEFAULT_SIZES),
+                        help=f"派生图的尺寸 (默认: {' '.join(DEFAULT_SIZES)})")
+    parser.add_argument('--tiles', action='store_true', help="同时生成 DeepZoom 瓦片（隐含 --derivatives）")
+    parser.add_argument('--derivative-workers', type=int, default=2, help="生成派生图的进程数 (默认: 2)")
+    add_session_pool_arguments(parser)
+    add_shard_argument(parser)
+    add_http_arguments(parser)
+    add_telemetry_arguments(parser)
+    args = parser.parse_args()
+    start_telemetry(args)
+    configure_http(args)
+
+    # --- 动态路径处理 ---
+    SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+    PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+    # ---
+
+    if args.shard:
+        write_shard_marker(os.path.join(PROJECT_ROOT, 'output'), args.shard)
+        print(f"只处理分片 {args.shard}。")
+
+    pipeline = CrawlPipeline(
+        PROJECT_ROOT, args.category, modes=DOWNLOAD_MODES[args.mode or 'all'], harvest=not args.skip_harvest,
+        refresh=args.refresh, images=not args.skip_images, analysis=not args.skip_analysis,
+        with_metrics=args.metrics, fetch_workers=args.fetch_workers, parse_workers=args.parse_workers,
+        download_workers=args.download_workers, analysis_workers=args.analysis_workers,
+        harvest_concurrency=args.harvest_concurrency, queue_size=args.queue_size, rate=args.rate,
+        max_rate=args.max_rate, store_kind=args.store, parquet=args.parquet, ocr_workers=args.ocr_workers,
+        backend=args.parser, warm_sessions=args.warm_sessions, reuse_tokens=not args.no_token_reuse,
+        derivative_sizes=args.derivative_sizes if args.derivatives or args.tiles else (), tiles=args.tiles,
+        derivative_workers=args.derivative_workers, shard=args.shard, preprocess=not args.no_preprocess)
+    if not pipeline.run():
+        sys.exit(1)
@@ -0,0 +1,406 @@
+"""
+基于 SQLite (WAL 模式) 的爬取状态库。
+
+每个文物按 harvested -> metadata_fetched -> images_pending -> done / failed 的流程推进，
+每张图片单独记录状态和尝试次数。各脚本从这里领取待处理任务、写回结果，因此断点续传、
+只重试失败项和进度统计都是索引查询，不再需要重新扫描 urls.txt、日志和图片目录。
+
+用法：
+    python src/crawl_state.py status              # 查看整体进度
+    python src/crawl_state.py failed [all|main]   # 列出失败的图片
+    python src/crawl_state.py import <urls.txt>   # 导入旧的 URL 列表
+    python src/crawl_state.py merge <db>...       # 合并其他分片主机上的状态库
+"""
+import os
+import sys
+import time
+import hashlib
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from url_frontier import detail_id_from_url
+
+# 图片类型：all 为详情页中的全部图片，main 为主图（图集中的第一张），见 download_new.py 的 --all/--main-only
+IMAGE_KINDS = {'all': 'images_status', 'main': 'main_image_status'}
+# 按 rowid 分页读取待处理任务时每页的行数
+PENDING_PAGE_SIZE = 1000
+# 合并状态库时各状态的优先级：done > failed > pending
+STATUS_RANK = "CASE {} WHEN 'done' THEN 2 WHEN 'failed' THEN 1 ELSE 0 END"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    id TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    category TEXT,
+    first_seen TEXT,
+    item_id TEXT,
+    status TEXT NOT NULL DEFAULT 'harvested',
+    metadata_status TEXT NOT NULL DEFAULT 'pending',
+    metadata_attempts INTEGER NOT NULL DEFAULT 0,
+    images_status TEXT NOT NULL DEFAULT 'pending',
+    main_image_status TEXT NOT NULL DEFAULT 'pending',
+    last_error TEXT,
+    updated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_artifacts_status ON artifacts(status);
+CREATE INDEX IF NOT EXISTS idx_artifacts_metadata ON artifacts(metadata_status);
+CREATE INDEX IF NOT EXISTS idx_artifacts_images ON artifacts(images_status);
+CREATE INDEX IF NOT EXISTS idx_artifacts_main_image ON artifacts(main_image_status);
+
+CREATE TABLE IF NOT EXISTS images (
+    artifact_id TEXT NOT NULL,
+    image_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    name TEXT,
+    code TEXT,
+    path TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    updated_at TEXT,
+    PRIMARY KEY (artifact_id, image_id, kind)
+);
+CREATE INDEX IF NOT EXISTS idx_images_status ON images(kind, status);
+CREATE INDEX IF NOT EXISTS idx_images_image_id ON images(image_id);
+"""
+
+
+def _now():
+    return time.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def artifact_shard(artifact_id, count):
+    """
+    文物所属的分片 (0 ~ count-1)：对文物ID取 blake2b 哈希后取模。
+    只取决于文物ID，与导入顺序和状态库的 rowid 无关，各主机对同一文物总是得到同一个分片。
+    """
+    digest = hashlib.blake2b(str(artifact_id).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % count
+
+
+class PendingArtifacts:
+    """
+    待处理文物 (序号, url) 的惰性序列。len() 是一次 COUNT 查询；迭代时按 rowid 每次读取
+    PENDING_PAGE_SIZE 行，不会把几十万个URL一次性放进内存。迭代期间状态被改写的文物
+    （例如刚处理完的）不会再次出现，因为分页只向 rowid 增大的方向前进。
+    """
+
+    def __init__(self, state, condition, params, limit=None):
+        self._state = state
+        self._condition = condition
+        self._params = list(params)
+        self._limit = limit
+
+    def __len__(self):
+        count = self._state._conn().execute(
+            f"SELECT COUNT(*) FROM artifacts WHERE {self._condition}", self._params).fetchone()[0]
+        return min(count, self._limit) if self._limit else count
+
+    def __iter__(self):
+        last_rowid, produced = 0, 0
+        while True:
+            # 每页重新取当前线程的连接，生成器可以在任意线程中消费
+            rows = self._state._conn().execute(
+                f"SELECT rowid, url FROM artifacts WHERE ({self._condition}) AND rowid > ? ORDER BY rowid LIMIT ?",
+                self._params + [last_rowid, PENDING_PAGE_SIZE]).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield row['rowid'], row['url']
+                produced += 1
+                if self._limit and produced >= self._limit:
+                    return
+            last_rowid = rows[-1]['rowid']
+
+
+class CrawlState:
+    """
+    爬取状态库。每个线程使用独立的 SQLite 连接，可以在下载线程中直接调用。
+    图片路径以相对 db 所在目录（通常为 output/）的形式保存。
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.base_dir = os.path.dirname(os.path.abspath(db_path))
+        self._local = threading.local()
+        os.makedirs(self.base_dir, exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.create_function('artifact_shard', 2, artifact_shard, deterministic=True)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def relpath(self, path):
+        return os.path.relpath(os.path.abspath(path), self.base_dir)
+
+    def abspath(self, relpath):
+        return os.path.join(self.base_dir, relpath)
+
+    # --- URL 采集 ---
+    def add_artifacts(self, rows):
+        """登记 (url, category, first_seen) 序列，已存在的ID保持不变，返回新增数量。"""
+        with self._transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO artifacts (id, url, category, first_seen, updated_at) VALUES (?, ?, ?, ?, ?)",
+                ((detail_id_from_url(url), url, category, first_seen or _now(), _now())
+                 for url, category, first_seen in rows if detail_id_from_url(url)))
+            return conn.total_changes - before
+
+    def import_url_file(self, url_file, category=None):
+        """导入旧版 urls.txt。"""
+        with open(url_file, "r", encoding="utf-8") as f:
+            return self.add_artifacts((line.strip(), category, None) for line in f if line.strip())
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM artifacts").fetchone()[0]
+
+    def index_of(self, url):
+        """返回文物的登记序号（与 pending_* 返回的序号相同），未登记时返回 None。"""
+        row = self._conn().execute("SELECT rowid FROM artifacts WHERE id = ?", (detail_id_from_url(url),)).fetchone()
+        return row[0] if row else None
+
+    # --- 状态推进 ---
+    def _refresh_status(self, artifact_id=None):
+        """根据各状态列重新计算 status；artifact_id 为 None 时刷新全部文物。"""
+        sql = """
+            UPDATE artifacts SET status = CASE
+                WHEN metadata_status = 'failed' OR images_status = 'failed' THEN 'failed'
+                WHEN metadata_status = 'done' AND images_status = 'done' THEN 'done'
+                WHEN images_status = 'pending'
+                     AND EXISTS (SELECT 1 FROM images WHERE artifact_id = artifacts.id AND kind = 'all') THEN 'images_pending'
+                WHEN metadata_status = 'done' THEN 'metadata_fetched'
+                ELSE 'harvested' END"""
+        if artifact_id is None:
+            self._conn().execute(sql)
+        else:
+            self._conn().execute(sql + " WHERE id = ?", (artifact_id,))
+
+    def _pending(self, columns, statuses, limit, shard):
+        placeholders = ", ".join("?" * len(statuses))
+        condition = "(" + " OR ".join(f"{column} IN ({placeholders})" for column in columns) + ")"
+        params = list(statuses) * len(columns)
+        if shard:
+            condition += " AND artifact_shard(id, ?) = ?"
+            params += [shard.count, shard.index - 1]
+        return PendingArtifacts(self, condition, params, limit)
+
+    def pending_metadata(self, retry_failed=False, limit=None, shard=None, include_done=False):
+        """
+        返回待抓取元数据的 (序号, url) 惰性序列；retry_failed=True 时只返回之前失败的。
+        include_done=True 时同时返回已完成的文物（重新检查详情页是否有更新）。
+        shard 为 sharding.Shard（序号从 1 开始）时只返回属于该分片的文物。
+        """
+        statuses = ['failed' if retry_failed else 'pending'] + (['done'] if include_done else [])
+        return self._pending(['metadata_status'], statuses, limit, shard)
+
+    def mark_metadata(self, url, ok, error=None, item_id=None):
+        artifact_id = detail_id_from_url(url)
+        conn = self._conn()
+        conn.execute("""
+            UPDATE artifacts SET metadata_status = ?, metadata_attempts = metadata_attempts + 1,
+                item_id = COALESCE(?, item_id), last_error = ?, updated_at = ?
+            WHERE id = ?""", ('done' if ok else 'failed', item_id, error, _now(), artifact_id))
+        self._refresh_status(artifact_id)
+
+    def pending_image_artifacts(self, kinds=('all',), retry_failed=False, limit=None, shard=None):
+        """返回在 kinds 中任一类型还有图片未下载的文物 (序号, url) 惰性序列。kinds 也可以是单个类型。"""
+        if isinstance(kinds, str):
+            kinds = (kinds,)
+        status = 'failed' if retry_failed else 'pending'
+        return self._pending([IMAGE_KINDS[kind] for kind in kinds], [status], limit, shard)
+
+    def register_images(self, url, kind, item_id, images):
+        """
+        登记一个文物的图片列表，images 为含 name/id/code/path 的字典列表。
+        第一次登记时若文件已经存在（旧版本下载的）直接记为完成。
+        返回尚未完成的图片信息列表。
+        """
+        artifact_id = detail_id_from_url(url)
+        with self._transaction() as conn:
+            for info in images:
+                existed = os.path.exists(info['path'])
+                conn.execute("""
+                    INSERT OR IGNORE INTO images (artifact_id, image_id, kind, name, code, path, status, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                             (artifact_id, info['id'], kind, info['name'], info['code'], self.relpath(info['path']),
+                              'done' if existed else 'pending', _now()))
+            conn.execute("UPDATE artifacts SET item_id = COALESCE(item_id, ?) WHERE id = ?", (item_id, artifact_id))
+        self._refresh_image_status(artifact_id, kind)
+        done = {row['image_id'] for row in conn.execute(
+            "SELECT image_id FROM images WHERE artifact_id = ? AND kind = ? AND status = 'done'", (artifact_id, kind))}
+        return [info for info in images if info['id'] not in done]
+
+    def mark_image(self, url, image_id, kind, ok, error=None):
+        artifact_id = detail_id_from_url(url)
+        self._conn().execute("""
+            UPDATE images SET status = ?, attempts = attempts + 1, last_error = ?, updated_at = ?
+            WHERE artifact_id = ? AND image_id = ? AND kind = ?""",
+                             ('done' if ok else 'failed', error, _now(), artifact_id, image_id, kind))
+        self._refresh_image_status(artifact_id, kind)
+
+    def mark_images_failed(self, url, kind, error):
+        """详情页本身处理失败（找不到图片列表等）时，把整个文物记为失败。"""
+        artifact_id = detail_id_from_url(url)
+        self._conn().execute(f"UPDATE artifacts SET {IMAGE_KINDS[kind]} = 'failed', last_error = ?, updated_at = ? "
+                             "WHERE id = ?", (error, _now(), artifact_id))
+        self._refresh_status(artifact_id)
+
+    def _refresh_image_status(self, artifact_id, kind):
+        # 全部完成 -> done；已没有待下载但有失败 -> failed；否则仍为 pending
+        self._conn().execute(f"""
+            UPDATE artifacts SET {IMAGE_KINDS[kind]} = CASE
+                WHEN EXISTS (SELECT 1 FROM images WHERE artifact_id = ?1 AND kind = ?2 AND status = 'pending') THEN 'pending'
+                WHEN EXISTS (SELECT 1 FROM images WHERE artifact_id = ?1 AND kind = ?2 AND status = 'failed') THEN 'failed'
+                ELSE 'done' END, updated_at = ?3
+            WHERE id = ?1""", (artifact_id, kind, _now()))
+        self._refresh_status(artifact_id)
+
+    # --- 合并 ---
+    def merge_from(self, db_path):
+        """
+        把另一个状态库（通常是某台分片主机的 output/crawl_state.sqlite）合并进来。
+        本库没有的文物和图片直接加入；两边都有时，每个状态列取 done > failed > pending 中较好的一方。
+        返回 (新增文物数, 新增或更新的图片记录数)。
+        """
+        conn = self._conn()
+        # ATTACH 不能在事务中执行
+        conn.execute("ATTACH DATABASE ? AS shard", (os.path.abspath(db_path),))
+        try:
+            with self._transaction():
+                before = conn.total_changes
+                conn.execute("""
+                    INSERT OR IGNORE INTO artifacts (id, url, category, first_seen, item_id, metadata_status,
+                        metadata_attempts, images_status, main_image_status, last_error, updated_at)
+                    SELECT id, url, category, first_seen, item_id, metadata_status,
+                        metadata_attempts, images_status, main_image_status, last_error, updated_at
+                    FROM shard.artifacts ORDER BY rowid""")
+                added = conn.total_changes - before
+                columns = ('metadata_status', 'images_status', 'main_image_status')
+                newer = {column: f"{STATUS_RANK.format('s.' + column)} > {STATUS_RANK.format('artifacts.' + column)}"
+                         for column in columns}
+                pick = ", ".join(f"{column} = CASE WHEN {newer[column]} THEN s.{column} ELSE artifacts.{column} END"
+                                 for column in columns)
+                better = " OR ".join(newer.values())
+                conn.execute(f"""
+                    UPDATE artifacts SET {pick}, item_id = COALESCE(artifacts.item_id, s.item_id),
+                        metadata_attempts = MAX(artifacts.metadata_attempts, s.metadata_attempts),
+                        last_error = s.last_error, updated_at = s.updated_at
+                    FROM shard.artifacts AS s WHERE s.id = artifacts.id AND ({better})""")
+                before = conn.total_changes
+                conn.execute(f"""
+                    INSERT INTO images (artifact_id, image_id, kind, name, code, path, status, attempts,
+                        last_error, updated_at)
+                    SELECT artifact_id, image_id, kind, name, code, path, status, attempts, last_error, updated_at
+                    FROM shard.images WHERE true
+                    ON CONFLICT (artifact_id, image_id, kind) DO UPDATE SET
+                        path = excluded.path, status = excluded.status, attempts = excluded.attempts,
+                        last_error = excluded.last_error, updated_at = excluded.updated_at
+                    WHERE {STATUS_RANK.format('excluded.status')} > {STATUS_RANK.format('images.status')}""")
+                images = conn.total_changes - before
+                self._refresh_status()
+        finally:
+            conn.execute("DETACH DATABASE shard")
+        return added, images
+
+    # --- 查询 ---
+    def find_done_image(self, image_id):
+        """返回任意类型中已下载完成、且文件仍然存在的同一张图片 (image_id) 的绝对路径，没有则返回 None。"""
+        for row in self._conn().execute(
+                "SELECT path FROM images WHERE image_id = ? AND status = 'done'", (image_id,)):
+            path = self.abspath(row['path'])
+            if os.path.exists(path):
+                return path
+        return None
+
+    def done_image_paths(self, kind=None):
+        """遍历已下载完成的图片的绝对路径。"""
+        sql = "SELECT DISTINCT path FROM images WHERE status = 'done'"
+        params = []
+        if kind:
+            sql += " AND kind = ?"
+            params.append(kind)
+        for row in self._conn().execute(sql, params):
+            yield self.abspath(row['path'])
+
+    def failed_images(self, kind='all'):
+        return [dict(row) for row in self._conn().execute(
+            "SELECT a.url, i.image_id, i.name, i.attempts, i.last_error FROM images i "
+            "JOIN artifacts a ON a.id = i.artifact_id WHERE i.kind = ? AND i.status = 'failed'", (kind,))]
+
+    def pending_by_shard(self, count):
+        """统计各分片中还有元数据或图片待处理的文物数，返回长度为 count 的列表。"""
+        condition = " OR ".join(f"{column} = 'pending'" for column in ('metadata_status',) + tuple(IMAGE_KINDS.values()))
+        counts = [0] * count
+        for row in self._conn().execute(
+                f"SELECT artifact_shard(id, ?), COUNT(*) FROM artifacts WHERE {condition} GROUP BY 1", (count,)):
+            counts[row[0]] = row[1]
+        return counts
+
+    def progress(self):
+        """按各个状态列统计文物数和图片数。"""
+        conn = self._conn()
+        result = {}
+        for column in ('status', 'metadata_status', 'images_status', 'main_image_status'):
+            result[column] = {row[0]: row[1] for row in conn.execute(
+                f"SELECT {column}, COUNT(*) FROM artifacts GROUP BY {column}")}
+        result['images'] = {f"{row[0]}/{row[1]}": row[2] for row in conn.execute(
+            "SELECT kind, status, COUNT(*) FROM images GROUP BY kind, status")}
+        return result
+
+
+def default_state_path():
+    """项目默认的状态库路径 output/crawl_state.sqlite。"""
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(project_root, 'output', 'crawl_state.sqlite')
+
+
+def open_default_state():
+    """打开默认状态库；状态库为空而存在旧版 urls.txt 时自动导入一次。"""
+    state = CrawlState(default_state_path())
+    url_file = os.path.join(state.base_dir, 'urls.txt')
+    if len(state) == 0 and os.path.exists(url_file):
+        imported = state.import_url_file(url_file)
+        print(f"状态库为空，已从 '{url_file}' 导入 {imported} 个URL。")
+    return state
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'status'
+    state = CrawlState(default_state_path())
+    if command == 'status':
+        for column, counts in state.progress().items():
+            print(f"{column}: " + ", ".join(f"{k}={v}" for k, v in sorted(counts.items())))
+    elif command == 'failed':
+        kind = sys.argv[2] if len(sys.argv) > 2 else 'all'
+        for row in state.failed_images(kind):
+            print(f"{row['url']}\t{row['name']}\t尝试 {row['attempts']} 次\t{row['last_error'] or ''}")
+    elif command == 'import' and len(sys.argv) > 2:
+        print(f"导入 {state.import_url_file(sys.argv[2])} 个新URL。")
+    elif command == 'merge' and len(sys.argv) > 2:
+        for db_path in sys.argv[2:]:
+            added, images = state.merge_from(db_path)
+            print(f"已合并 '{db_path}': 新增 {added} 个文物，新增或更新 {images} 条图片记录。")
+    else:
+        print(__doc__)
+        sys.exit(1)
@@ -0,0 +1,316 @@
+"""
+Duplicate image index across the downloaded image folders.
+
+Every image gets a SHA-256 of its bytes plus a 64-bit pHash and dHash. The hashes are kept in
+output/dedup_index.sqlite, keyed by (path, size, mtime_ns) so only new or changed files are
+hashed again. Near-duplicates are found with a BK-tree over the pHash (sub-linear Hamming
+distance queries) and confirmed with the dHash; byte-identical files can be replaced by
+hardlinks to a single copy.
+
+Usage:
+    python src/dedup_images.py                      # report duplicate clusters
+    python src/dedup_images.py --threshold 6        # looser near-duplicate matching
+    python src/dedup_images.py --hardlink           # hardlink byte-identical copies
+"""
+import io
+import os
+import sys
+import json
+import sqlite3
+import hashlib
+import argparse
+
+import numpy as np
+from PIL import Image
+from tqdm import tqdm
+
+from analyze_images import iter_image_entries, iter_batch_results, batched, BATCH_SIZE
+from image_metrics import HASH_SIZE, phash_batch
+from stream_download import link_or_copy
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    phash TEXT NOT NULL,
+    dhash TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_hashes_sha256 ON hashes(sha256);
+"""
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over 64-bit integer hashes with Hamming distance.
+
+    A query for all hashes within distance d only descends into children whose edge distance
+    lies in [dist - d, dist + d], so it visits a small fraction of the tree for small d.
+    """
+
+    def __init__(self):
+        self._root = None  # [hash, [item ids], {distance: child node}]
+
+    def add(self, value, item):
+        if self._root is None:
+            self._root = [value, [item], {}]
+            return
+        node = self._root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    def query(self, value, max_distance):
+        """Returns the items whose hash is within max_distance of value."""
+        if self._root is None:
+            return []
+        found = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= max_distance:
+                found.extend(node[1])
+            for edge, child in node[2].items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        return found
+
+
+def dhash_bits(gray):
+    """64-bit difference hash of a (8, 9) grayscale array."""
+    bits = (gray[:, 1:] > gray[:, :-1]).ravel()
+    return int(''.join('1' if bit else '0' for bit in bits), 2)
+
+
+def hash_batch(file_paths):
+    """
+    Hashes a batch of files. Returns ([(path, sha256, phash hex, dhash hex)], [(path, error)]).
+    Each file is read once; the decoder works on the in-memory bytes at reduced scale.
+    """
+    results, errors, grays = [], [], []
+    for file_path in file_paths:
+        try:
+            with open(file_path, 'rb') as f:
+                data = f.read()
+            with Image.open(io.BytesIO(data)) as img:
+                img.draft('L', (HASH_SIZE * 2, HASH_SIZE * 2))
+                gray = img.convert('L')
+            phash_gray = np.asarray(gray.resize((HASH_SIZE, HASH_SIZE), Image.BILINEAR), dtype=np.float32)
+            dhash_gray = np.asarray(gray.resize((9, 8), Image.BILINEAR), dtype=np.int16)
+        except Exception as e:
+            errors.append((file_path, str(e)))
+            continue
+        results.append((file_path, hashlib.sha256(data).hexdigest(), f"{dhash_bits(dhash_gray):016x}"))
+        grays.append(phash_gray)
+    if not results:
+        return [], errors
+    phashes = phash_batch(np.stack(grays))
+    return [(path, sha, phash, dhash) for (path, sha, dhash), phash in zip(results, phashes)], errors
+
+
+class DedupIndex:
+    """Hash index stored in SQLite; paths are relative to base_dir (normally output/)."""
+
+    def __init__(self, db_path, base_dir):
+        self.base_dir = base_dir
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def relpath(self, path):
+        return os.path.relpath(os.path.abspath(path), self.base_dir)
+
+    def abspath(self, relpath):
+        return os.path.join(self.base_dir, relpath)
+
+    def prefixes(self, roots):
+        """Relative path prefixes (with a trailing separator) of the given roots."""
+        return [self.relpath(root).rstrip(os.sep) + os.sep for root in roots]
+
+    def update(self, roots, workers=1):
+        """
+        Hashes new or changed images below roots and drops entries for deleted files below roots.
+        Entries under other folders are left alone, so indexing one folder keeps the hashes of the rest.
+        """
+        known = {row[0]: (row[1], row[2]) for row in self.conn.execute("SELECT path, size, mtime_ns FROM hashes")}
+        seen, stats = set(), {}
+
+        def changed_files():
+            for root in roots:
+                for entry in iter_image_entries(root):
+                    st = entry.stat()
+                    relpath = self.relpath(entry.path)
+                    seen.add(relpath)
+                    if known.get(relpath) != (st.st_size, st.st_mtime_ns):
+                        stats[entry.path] = (relpath, st.st_size, st.st_mtime_ns)
+                        yield entry.path
+
+        hashed = 0
+        with tqdm(desc="计算图片哈希", unit="张") as progress:
+            for results, errors in iter_batch_results(batched(changed_files(), BATCH_SIZE), hash_batch,
+                                                      workers=workers, use_processes=True):
+                for path, sha, phash, dhash in results:
+                    relpath, size, mtime_ns = stats.pop(path)
+                    self.conn.execute("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?)",
+                                      (relpath, size, mtime_ns, sha, phash, dhash))
+                for path, error in errors:
+                    stats.pop(path, None)
+                    tqdm.write(f"无法处理 {path}: {error}")
+                self.conn.commit()
+                hashed += len(results)
+                progress.update(len(results) + len(errors))
+
+        prefixes = tuple(self.prefixes(roots))
+        removed = [path for path in known if path not in seen and path.startswith(prefixes)]
+        self.conn.executemany("DELETE FROM hashes WHERE path = ?", ((path,) for path in removed))
+        self.conn.commit()
+        return hashed, len(removed)
+
+    def rows(self, roots):
+        """All indexed (path, size, sha256, phash, dhash) below roots, in root order then path order."""
+        result = []
+        for prefix in self.prefixes(roots):
+            result.extend(self.conn.execute(
+                "SELECT path, size, sha256, phash, dhash FROM hashes WHERE substr(path, 1, ?) = ? ORDER BY path",
+                (len(prefix), prefix)).fetchall())
+        return result
+
+    def touch(self, relpath):
+        """Refreshes the stored size/mtime after a file was replaced by an identical hardlink."""
+        st = os.stat(self.abspath(relpath))
+        self.conn.execute("UPDATE hashes SET size = ?, mtime_ns = ? WHERE path = ?", (st.st_size, st.st_mtime_ns, relpath))
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+def find_clusters(rows, threshold=4):
+    """
+    Groups rows into clusters of near-duplicates.
+
+    Two images are linked when both their pHash and dHash differ in at most threshold bits
+    (or when their bytes are identical). Returns lists of row indices with more than one member.
+    """
+    parent = list(range(len(rows)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i, j):
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    phashes = [int(row[3], 16) for row in rows]
+    dhashes = [int(row[4], 16) for row in rows]
+    by_sha = {}
+    tree = BKTree()
+    for i, row in enumerate(rows):
+        if row[2] in by_sha:
+            union(i, by_sha[row[2]])
+        else:
+            by_sha[row[2]] = i
+        for j in tree.query(phashes[i], threshold):
+            if hamming(dhashes[i], dhashes[j]) <= threshold:
+                union(i, j)
+        tree.add(phashes[i], i)
+
+    clusters = {}
+    for i in range(len(rows)):
+        clusters.setdefault(find(i), []).append(i)
+    return [members for members in clusters.values() if len(members) > 1]
+
+
+def hardlink_identical(index, rows, cluster):
+    """
+    Replaces byte-identical copies within a cluster by hardlinks to the first copy.
+    Returns the number of bytes freed.
+    """
+    freed = 0
+    keep_by_sha = {}
+    for i in cluster:
+        path, size, sha = rows[i][:3]
+        keep = keep_by_sha.setdefault(sha, path)
+        if keep == path:
+            continue
+        src, dest = index.abspath(keep), index.abspath(path)
+        if os.path.samefile(src, dest):
+            continue
+        if link_or_copy(src, dest) == 'link':
+            freed += size
+        index.touch(path)
+    return freed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="查找重复或近似重复的图片，并可用硬链接合并完全相同的文件。")
+    parser.add_argument('dirs', nargs='*', help="要检查的图片目录 (默认: output/taipei_museum_artifacts 和 output/main_images)")
+    parser.add_argument('--threshold', type=int, default=4, help="pHash 和 dHash 允许的最大汉明距离 (默认: 4)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="计算哈希的进程数 (默认: CPU核数)")
+    parser.add_argument('--hardlink', action='store_true', help="把字节完全相同的重复文件替换为指向同一份数据的硬链接")
+    args = parser.parse_args()
+
+    # --- 动态路径处理 ---
+    SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+    PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+    OUTPUT_DIR = os.path.join(PROJECT_ROOT, 'output')
+    INDEX_FILE = os.path.join(OUTPUT_DIR, 'dedup_index.sqlite')
+    REPORT_FILE = os.path.join(OUTPUT_DIR, 'duplicate_clusters.json')
+    # ---
+
+    roots = args.dirs or [os.path.join(OUTPUT_DIR, 'taipei_museum_artifacts'), os.path.join(OUTPUT_DIR, 'main_images')]
+    roots = [root for root in roots if os.path.isdir(root)]
+    if not roots:
+        print("错误: 没有找到可检查的图片目录。")
+        sys.exit(1)
+
+    index = DedupIndex(INDEX_FILE, OUTPUT_DIR)
+    try:
+        hashed, removed = index.update(roots, workers=args.workers)
+        print(f"新计算哈希 {hashed} 张，移除已删除的 {removed} 张。")
+
+        rows = index.rows(roots)
+        clusters = find_clusters(rows, args.threshold)
+        report = []
+        reclaimable = freed = 0
+        for cluster in clusters:
+            members = [{'path': rows[i][0], 'size': rows[i][1], 'sha256': rows[i][2], 'phash': rows[i][3],
+                        'dhash': rows[i][4]} for i in cluster]
+            identical = {}
+            for member in members:
+                identical.setdefault(member['sha256'], []).append(member)
+            for group in identical.values():
+                # 已经是硬链接的副本不再占用额外空间
+                inodes = {(st.st_dev, st.st_ino) for st in (os.stat(index.abspath(m['path'])) for m in group)}
+                reclaimable += group[0]['size'] * (len(inodes) - 1)
+            report.append({'members': members, 'identical_groups': sum(len(g) > 1 for g in identical.values())})
+            if args.hardlink:
+                freed += hardlink_identical(index, rows, cluster)
+
+        with open(REPORT_FILE, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    finally:
+        index.close()
+
+    print(f"共 {len(rows)} 张图片，发现 {len(clusters)} 组重复或近似重复的图片。")
+    print(f"字节完全相同的重复文件共 {reclaimable / 1024 / 1024:.1f} MB（未计入已是硬链接的文件）。")
+    if args.hardlink:
+        print(f"已用硬链接合并，释放 {freed / 1024 / 1024:.1f} MB。")
+    print(f"详细结果已保存至: {REPORT_FILE}")
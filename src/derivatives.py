@@ -0,0 +1,313 @@
+"""
+Derived images for the downloaded JPEGs: multi-resolution previews and optional DeepZoom tiles.
+
+For a source output/<root>/<relpath>.jpg the derivatives are written to
+    output/derivatives/<size>/<root>/<relpath>.jpg            one file per size in SIZES
+    output/derivatives/tiles/<root>/<relpath>.dzi (+ _files/) with --tiles
+so a thumbnail or preview is served from a file of a few KB instead of the full original.
+
+A source is skipped when all its derivatives exist and are not older than the source, so re-runs
+only process new or re-downloaded images. Decoding uses JPEG draft mode, letting libjpeg decode
+directly at 1/2, 1/4 or 1/8 scale when only small sizes are needed; the remaining downscale uses
+Image.reduce (integer box filter) down to within REDUCING_GAP of the target followed by a single
+LANCZOS resize, and each size is derived from the next larger one. Tiles need the full-resolution
+image, so they disable draft mode for that source.
+
+Several paths can share one file (main_images are hardlinks into taipei_museum_artifacts with
+download_new.py --both). Such a file is decoded once; the other paths get hardlinked derivatives.
+
+Usage:
+    python src/derivatives.py                                # thumb + preview for both image folders
+    python src/derivatives.py --sizes thumb preview large --tiles --workers 8
+    python src/derivatives.py output/main_images --force
+"""
+import os
+import sys
+import math
+import shutil
+import argparse
+
+from PIL import Image
+from tqdm import tqdm
+
+from analyze_images import batched, iter_batch_results, iter_image_entries
+from stream_download import link_or_copy
+from telemetry import REGISTRY, add_telemetry_arguments, start_telemetry
+
+# Longest edge in pixels of each derivative size
+SIZES = {'thumb': 256, 'preview': 1024, 'large': 2048}
+DEFAULT_SIZES = ('thumb', 'preview')
+JPEG_QUALITY = 85
+# Image.reduce stops once the image is within this factor of the target; LANCZOS does the rest
+REDUCING_GAP = 2
+TILE_SIZE = 254
+TILE_OVERLAP = 1
+TILES_DIR = 'tiles'
+# Sources per worker task; originals are tens of MB, so batches stay small
+DERIVATIVE_BATCH_SIZE = 4
+
+DERIVATIVES_CREATED = REGISTRY.counter('npm_derivatives_total', "生成派生图的源图片数: ok / failed / linked",
+                                       ['result'])
+
+
+def derivative_path(derivatives_dir, size, relpath):
+    """Path of the `size` derivative of the source at relpath (relative to output/)."""
+    return os.path.join(derivatives_dir, size, os.path.splitext(relpath)[0] + '.jpg')
+
+
+def tiles_path(derivatives_dir, relpath):
+    """Path of the .dzi descriptor; the tiles live in the sibling <name>_files directory."""
+    return os.path.join(derivatives_dir, TILES_DIR, os.path.splitext(relpath)[0] + '.dzi')
+
+
+def derivative_outputs(derivatives_dir, relpath, sizes, tiles=False):
+    outputs = [derivative_path(derivatives_dir, size, relpath) for size in sizes]
+    if tiles:
+        outputs.append(tiles_path(derivatives_dir, relpath))
+    return outputs
+
+
+def is_up_to_date(source_mtime_ns, outputs):
+    """True when every output exists and is not older than the source."""
+    for path in outputs:
+        try:
+            if os.stat(path).st_mtime_ns < source_mtime_ns:
+                return False
+        except FileNotFoundError:
+            return False
+    return True
+
+
+def downscale(img, max_edge):
+    """Shrinks img so its longest edge is max_edge: Image.reduce first, then one LANCZOS resize."""
+    long_edge = max(img.size)
+    if long_edge <= max_edge:
+        return img
+    factor = long_edge // (max_edge * REDUCING_GAP)
+    if factor > 1:
+        img = img.reduce(factor)
+    scale = max_edge / max(img.size)
+    return img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.LANCZOS)
+
+
+def save_jpeg(img, path):
+    """Writes img as a JPEG to path + '.part' and renames it, so path is never half-written."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    part_path = path + '.part'
+    img.save(part_path, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=max(img.size) > SIZES['thumb'])
+    os.replace(part_path, path)
+    return os.path.getsize(path)
+
+
+def write_deepzoom(img, dzi_path):
+    """
+    Writes a DeepZoom pyramid for img: level N is the full image, each lower level halves it
+    (Image.reduce(2) rounds up like the DeepZoom spec) down to 1x1. The .dzi descriptor is
+    written last, so its presence marks a complete set of tiles.
+    """
+    files_dir = os.path.splitext(dzi_path)[0] + '_files'
+    shutil.rmtree(files_dir, ignore_errors=True)
+    max_level = math.ceil(math.log2(max(img.size))) if max(img.size) > 1 else 0
+    level_img = img
+    for level in range(max_level, -1, -1):
+        level_dir = os.path.join(files_dir, str(level))
+        os.makedirs(level_dir, exist_ok=True)
+        width, height = level_img.size
+        for col in range(math.ceil(width / TILE_SIZE)):
+            for row in range(math.ceil(height / TILE_SIZE)):
+                x, y = col * TILE_SIZE, row * TILE_SIZE
+                box = (max(0, x - TILE_OVERLAP), max(0, y - TILE_OVERLAP),
+                       min(width, x + TILE_SIZE + TILE_OVERLAP), min(height, y + TILE_SIZE + TILE_OVERLAP))
+                level_img.crop(box).save(os.path.join(level_dir, f"{col}_{row}.jpg"), 'JPEG', quality=JPEG_QUALITY)
+        if level:
+            level_img = level_img.reduce(2)
+    part_path = dzi_path + '.part'
+    with open(part_path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                f'<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" Format="jpg" Overlap="{TILE_OVERLAP}" '
+                f'TileSize="{TILE_SIZE}"><Size Width="{img.width}" Height="{img.height}"/></Image>\n')
+    os.replace(part_path, dzi_path)
+
+
+def derive_image(source_path, relpath, derivatives_dir, sizes=DEFAULT_SIZES, tiles=False):
+    """
+    Writes every derivative of one source. Returns {size: bytes written} for the resized copies.
+    """
+    with Image.open(source_path) as img:
+        if not tiles:
+            # Only JPEG supports draft mode; the decoded image is at least as large as the biggest size
+            scale = max(SIZES[size] for size in sizes) / max(img.size)
+            if scale < 1:
+                img.draft('RGB', (math.ceil(img.width * scale), math.ceil(img.height * scale)))
+        img = img.convert('RGB')
+    if tiles:
+        os.makedirs(os.path.dirname(tiles_path(derivatives_dir, relpath)), exist_ok=True)
+        write_deepzoom(img, tiles_path(derivatives_dir, relpath))
+    written = {}
+    for size in sorted(sizes, key=SIZES.get, reverse=True):
+        img = downscale(img, SIZES[size])
+        written[size] = save_jpeg(img, derivative_path(derivatives_dir, size, relpath))
+    return written
+
+
+def derive_batch(items, derivatives_dir, sizes=DEFAULT_SIZES, tiles=False):
+    """
+    Derives a batch of (source path, relpath) items. Returns ([(source path, source bytes, {size: bytes})],
+    [(source path, error)]) so one bad file does not fail the batch.
+    """
+    results, errors = [], []
+    for source_path, relpath in items:
+        try:
+            written = derive_image(source_path, relpath, derivatives_dir, sizes, tiles)
+            results.append((source_path, os.path.getsize(source_path), written))
+        except Exception as e:
+            errors.append((source_path, str(e)))
+    return results, errors
+
+
+class DerivativePlanner:
+    """
+    Decides which sources need derivatives; runs in the parent process, workers only decode and write.
+
+    plan() skips sources whose derivatives are up to date. A later path of a file already planned
+    (same device and inode) is not decoded again: link_duplicates() hardlinks the first path's
+    derivatives once they have been written.
+    """
+
+    def __init__(self, derivatives_dir, sizes=DEFAULT_SIZES, tiles=False, force=False):
+        self.derivatives_dir = derivatives_dir
+        self.sizes = tuple(sizes)
+        self.tiles = tiles
+        self.force = force
+        self.skipped = 0
+        self._primaries = {}  # (st_dev, st_ino) -> relpath of the first path seen for that file
+        self._duplicates = []  # (primary relpath, duplicate relpath)
+        self._in_flight = {}  # source path -> relpath, for sources handed to derive_batch
+
+    def derive_args(self):
+        """Extra arguments for derive_batch."""
+        return self.derivatives_dir, self.sizes, self.tiles
+
+    def plan(self, source_path, base_dir):
+        """
+        Returns (source path, relpath) if the source must be decoded, otherwise None.
+        relpath is relative to base_dir, normally output/, so it starts with the image folder name.
+        """
+        st = os.stat(source_path)
+        relpath = os.path.relpath(os.path.abspath(source_path), base_dir)
+        key = (st.st_dev, st.st_ino)
+        primary = self._primaries.setdefault(key, relpath)
+        if not self.force and is_up_to_date(st.st_mtime_ns, derivative_outputs(self.derivatives_dir, relpath,
+                                                                                self.sizes, self.tiles)):
+            self.skipped += 1
+            return None
+        if primary != relpath:
+            self._duplicates.append((primary, relpath))
+            return None
+        self._in_flight[source_path] = relpath
+        return source_path, relpath
+
+    def done(self, source_path):
+        """Marks a planned source as finished and returns its relpath."""
+        return self._in_flight.pop(source_path)
+
+    def link_duplicates(self, failed=()):
+        """Hardlinks the derivatives of each duplicate from its primary. Returns the number of sources linked."""
+        linked = 0
+        for primary, duplicate in self._duplicates:
+            if primary in failed:
+                continue
+            for size in self.sizes:
+                target = derivative_path(self.derivatives_dir, size, duplicate)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                link_or_copy(derivative_path(self.derivatives_dir, size, primary), target)
+            if self.tiles:
+                source_dzi = tiles_path(self.derivatives_dir, primary)
+                target_dzi = tiles_path(self.derivatives_dir, duplicate)
+                target_files = os.path.splitext(target_dzi)[0] + '_files'
+                shutil.rmtree(target_files, ignore_errors=True)
+                shutil.copytree(os.path.splitext(source_dzi)[0] + '_files', target_files, copy_function=link_or_copy)
+                link_or_copy(source_dzi, target_dzi)
+            linked += 1
+        DERIVATIVES_CREATED.inc(linked, result='linked')
+        self._duplicates = []
+        return linked
+
+
+def generate_derivatives(roots, derivatives_dir, sizes=DEFAULT_SIZES, tiles=False, workers=1, force=False):
+    """
+    Generates derivatives for every image below roots (directories inside output_dir) on a process pool.
+
+    Args:
+        roots (list): Image directories, e.g. output/taipei_museum_artifacts and output/main_images;
+            derivatives keep the path below each root's parent, so they start with the folder name.
+        derivatives_dir (str): Where the derivatives are written (output/derivatives).
+        sizes (tuple): Keys of SIZES to generate.
+        tiles (bool): Also write DeepZoom tiles.
+        workers (int): Number of worker processes; 1 derives in the calling process.
+        force (bool): Regenerate derivatives that are already up to date.
+    """
+    planner = DerivativePlanner(derivatives_dir, sizes, tiles, force)
+
+    def pending():
+        for root in roots:
+            base_dir = os.path.dirname(os.path.abspath(root))
+            for entry in iter_image_entries(root):
+                item = planner.plan(entry.path, base_dir)
+                if item:
+                    yield item
+
+    derived, failed = 0, set()
+    source_bytes, derived_bytes = 0, {size: 0 for size in sizes}
+    with tqdm(desc="生成派生图", unit="张") as progress:
+        for results, errors in iter_batch_results(batched(pending(), DERIVATIVE_BATCH_SIZE), derive_batch,
+                                                  planner.derive_args(), workers, use_processes=True):
+            for source_path, size_bytes, written in results:
+                planner.done(source_path)
+                source_bytes += size_bytes
+                for size, n in written.items():
+                    derived_bytes[size] += n
+            for source_path, error in errors:
+                failed.add(planner.done(source_path))
+                tqdm.write(f"无法生成派生图 {source_path}: {error}")
+            derived += len(results)
+            DERIVATIVES_CREATED.inc(len(results), result='ok')
+            DERIVATIVES_CREATED.inc(len(errors), result='failed')
+            progress.update(len(results) + len(errors))
+    linked = planner.link_duplicates(failed)
+
+    print(f"\n新生成 {derived} 张，硬链接 {linked} 张，已是最新而跳过 {planner.skipped} 张，失败 {len(failed)} 张。")
+    if derived:
+        sizes_report = '，'.join(f"{size} {derived_bytes[size] / derived / 1024:.0f} KB" for size in sizes)
+        print(f"平均大小: 原图 {source_bytes / derived / 1024 / 1024:.1f} MB，{sizes_report}")
+    print(f"派生图保存在: {derivatives_dir}")
+    return {'derived': derived, 'linked': linked, 'skipped': planner.skipped, 'failed': len(failed)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="为下载的图片生成多种尺寸的缩略图/预览图，以及可选的 DeepZoom 瓦片。")
+    parser.add_argument('dirs', nargs='*', help="要处理的图片目录 (默认: output/taipei_museum_artifacts 和 output/main_images)")
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=list(DEFAULT_SIZES),
+                        help=f"要生成的尺寸（最长边像素: {', '.join(f'{k}={v}' for k, v in SIZES.items())}）"
+                             f" (默认: {' '.join(DEFAULT_SIZES)})")
+    parser.add_argument('--tiles', action='store_true', help="同时生成 DeepZoom 瓦片 (.dzi)，需要完整解码原图")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="并行处理的进程数 (默认: CPU核数)")
+    parser.add_argument('--force', action='store_true', help="重新生成已是最新的派生图")
+    add_telemetry_arguments(parser)
+    args = parser.parse_args()
+    start_telemetry(args)
+
+    # --- 动态路径处理 ---
+    SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+    PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+    OUTPUT_DIR = os.path.join(PROJECT_ROOT, 'output')
+    DERIVATIVES_DIR = os.path.join(OUTPUT_DIR, 'derivatives')
+    # ---
+
+    roots = args.dirs or [os.path.join(OUTPUT_DIR, 'taipei_museum_artifacts'), os.path.join(OUTPUT_DIR, 'main_images')]
+    roots = [root for root in roots if os.path.isdir(root)]
+    if not roots:
+        print("错误: 没有找到可处理的图片目录。")
+        sys.exit(1)
+
+    generate_derivatives(roots, DERIVATIVES_DIR, args.sizes, args.tiles, args.workers, args.force)
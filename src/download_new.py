@@ -2,170 +2,601 @@ import requests
 import os
 import re
 import time
-import io
 import json
+import queue
+import argparse
+import threading
+from contextlib import nullcontext
 from bs4 import BeautifulSoup
-from PIL import Image
-import pytesseract
 from tqdm import tqdm
 
+from captcha_sessions import EXTRA_SESSIONS, CaptchaSessionPool
+from captcha_solver import CaptchaSolver, CaptchaStats, ocr_captcha_bytes
+from crawl_state import open_default_state
+from http_client import DOWNLOAD_TIMEOUT, add_http_arguments, configure_http, new_session
+from rate_limit import Throttle, ByteBudget, backoff_delay, throttled_request
+from response_cache import ResponseCache
+from sharding import add_shard_argument, write_shard_marker
+from stream_download import stream_to_file, link_or_copy, IncompleteDownloadError, UnexpectedContentError
+from telemetry import (COUNT_BUCKETS, QUEUE_DEPTH, REGISTRY, add_telemetry_arguments, start_telemetry,
+                       traced)
+
 # --- 全局配置 ---
 MAX_RETRIES = 10
-REQUEST_TIMEOUT = 60
 PROXIES = {'http': None, 'https': None}
+# 设置环境变量 NPM_BASE_URL 可把请求指向其他服务器，例如 benchmark/mock_server.py 的本地模拟服务
+BASE_URL = os.environ.get("NPM_BASE_URL", "https://digitalarchive.npm.gov.tw")
+
+# --all / --main-only / --both 分别对应的图片类型，见 crawl_state.IMAGE_KINDS
+DOWNLOAD_MODES = {'all': ('all',), 'main': ('main',), 'both': ('all', 'main')}
+
+# Download600 返回这些类型时说明令牌无效，服务器给的是错误页面而不是图片
+NOT_IMAGE_CONTENT_TYPES = ('text/', 'application/json')
+
+# 多个下载线程共用失败日志文件
+_log_lock = threading.Lock()
+
+CAPTCHA_ATTEMPTS = REGISTRY.counter('npm_captcha_attempts_total', "验证码尝试: accepted / rejected / empty / error",
+                                    ['result'])
+CAPTCHA_ATTEMPTS_PER_IMAGE = REGISTRY.histogram('npm_captcha_attempts_per_image', "每张图片用了几次验证码",
+                                                buckets=COUNT_BUCKETS)
+OCR_SECONDS = REGISTRY.histogram('npm_ocr_seconds', "单次验证码 OCR 的耗时（秒，不含排队）")
+IMAGES_DOWNLOADED = REGISTRY.counter('npm_images_downloaded_total', "图片下载结果: ok / failed", ['result'])
 
 
 # --- 核心功能函数 ---
-def solve_captcha(session, captcha_url, headers):
+@traced('solve_captcha')
+def solve_captcha(session, captcha_url, headers, limiter=None, solver=None, preprocess=True):
+    """
+    下载并识别验证码，返回 (识别结果, OCR 耗时毫秒)；下载或识别出错时返回 ("", None)。
+    传入 solver (CaptchaSolver) 时在 OCR 进程池中识别（按 solver 自己的预处理设置），
+    否则在当前线程识别，preprocess 决定识别前是否做图像预处理。
+    """
     try:
         print("  正在下载验证码...")
-        captcha_response = session.get(captcha_url, headers=headers, timeout=REQUEST_TIMEOUT, proxies=PROXIES)
+        captcha_response = throttled_request(limiter, session, 'GET', captcha_url, headers=headers,
+                                             timeout=DOWNLOAD_TIMEOUT, proxies=PROXIES)
         captcha_response.raise_for_status()
-        captcha_image = Image.open(io.BytesIO(captcha_response.content))
-        config = r'--psm 7 -c tessedit_char_whitelist=0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
-        ocr_result = pytesseract.image_to_string(captcha_image, config=config).strip()
-        print(f"  OCR自动识别结果: '{ocr_result}'")
-        return ocr_result
+        if solver:
+            ocr_result, ocr_ms = solver.solve(captcha_response.content)
+        else:
+            ocr_result, ocr_ms = ocr_captcha_bytes(captcha_response.content, preprocess=preprocess)
+        OCR_SECONDS.observe(ocr_ms / 1000)
+        print(f"  OCR自动识别结果: '{ocr_result}' ({ocr_ms} ms)")
+        return ocr_result, ocr_ms
     except Exception as e:
         print(f"  下载或识别验证码时出错: {e}")
-        return ""
+        return "", None
+
+
+def open_session_pool(headers, size, limiter=None, solver=None, reuse_tokens=True, preprocess=True):
+    """创建预热的验证码会话池（见 captcha_sessions.py），后台线程用 solve_captcha 为每个会话准备验证码。"""
+    captcha_url = f"{BASE_URL}/opendata/Image/GetCaptchaImageFor600"
+    return CaptchaSessionPool(
+        lambda session: solve_captcha(session, captcha_url, headers, limiter, solver, preprocess), size,
+        reuse_tokens=reuse_tokens)
+
 
+def submit_download_dialog(session, item_id, image_info, captcha_solution, headers, detail_page_url, limiter=None):
+    """为一张图片提交 DownloadDialog600，返回服务器的 JSON。网络错误时抛出 requests.exceptions.RequestException。"""
+    payload = {'ImageId': image_info['id'], 'Dep': 'U', 'RandomCode': image_info['code'], 'ItemId': item_id,
+               'CaptchaCode': captcha_solution}
+    post_headers = headers.copy()
+    post_headers['Referer'] = detail_page_url
+    validation_response = throttled_request(limiter, session, 'POST', f"{BASE_URL}/opendata/Image/DownloadDialog600",
+                                            data=payload, headers=post_headers, timeout=DOWNLOAD_TIMEOUT,
+                                            proxies=PROXIES)
+    return validation_response.json()
 
-def download_single_image(session, item_id, image_info, download_folder, headers, detail_page_url, log_file_path):
+
+def fetch_image(session, params, file_path, headers, limiter=None, byte_budget=None):
+    """
+    请求 Download600 并保存到 file_path。
+    流式写入临时文件，校验长度后原子重命名；中断时保留 .part，下次重试从断点续传。
+    服务器返回错误页面而不是图片时抛出 UnexpectedContentError，不会写入任何数据。
+    """
+    stream_to_file(session, f"{BASE_URL}/opendata/Image/Download600", file_path, params=params, headers=headers,
+                   timeout=DOWNLOAD_TIMEOUT, proxies=PROXIES, byte_budget=byte_budget, throttle=limiter,
+                   reject_content_types=NOT_IMAGE_CONTENT_TYPES)
+
+
+def _token_rejected(error):
+    """复用令牌请求 Download600 失败时，判断是令牌被拒绝还是网络问题。"""
+    if isinstance(error, UnexpectedContentError):
+        return True
+    response = getattr(error, 'response', None)
+    return response is not None and 400 <= response.status_code < 500 and response.status_code != 429
+
+
+# 只计时不剖析，使其中的 solve_captcha 得到单独的剖析结果
+@traced('download_single_image', profile=False)
+def download_single_image(session, item_id, image_info, download_folder, headers, detail_page_url, log_file_path,
+                          limiter=None, byte_budget=None, solver=None, stats=None, sessions=None, preprocess=True):
+    """
+    下载单张图片：识别验证码 -> 提交 DownloadDialog600 -> 下载 Download600。
+    图片保存到 image_info['path']，没有该键时保存为 download_folder/<图片名>.jpg。
+    limiter 为按端点自适应限速、熔断的 rate_limit.Throttle，byte_budget 为全局在途字节上限，
+    solver 为 OCR 进程池，stats 为 CaptchaStats，用于记录每次验证码尝试的结果，均可省略。
+    没有 solver 时在当前线程识别验证码，preprocess 决定识别前是否做图像预处理（与 CaptchaSolver 的同名参数一致）。
+    识别错误只需换一张验证码重试，请求间隔由 limiter 控制；网络错误按带抖动的指数退避等待后重试。
+
+    传入 sessions (captcha_sessions.CaptchaSessionPool) 时不使用 session，每次尝试从池中领取一个会话:
+    先复用该会话上次验证成功的令牌，再使用后台预先识别好的答案，都不可用时才在当前线程识别验证码。
+    """
     print(f"\n--- 正在下载新图片: {image_info['name']} ---")
-    base_url = "https://digitalarchive.npm.gov.tw"
+    file_path = image_info.get('path') or os.path.join(download_folder, f"{image_info['name']}.jpg")
+    round_trips = 0
+
+    def try_reuse(http, lease):
+        """尝试复用会话上的令牌。图片已下载时返回 'ok'，得到新的下载参数时返回它，网络错误时返回 'error'。"""
+        nonlocal round_trips
+        token, age = sessions.reusable_token(lease, 'download')
+        if token:
+            params = {"imageId": image_info['id'], "dept": token['Dep'], "cid": item_id,
+                      "capchaCode": token['Captcha'], "code": image_info['code']}
+            try:
+                fetch_image(http, params, file_path, headers, limiter, byte_budget)
+            except (requests.exceptions.RequestException, IncompleteDownloadError, UnexpectedContentError) as e:
+                if not _token_rejected(e):
+                    print(f"  复用令牌下载时出错: {e}。即将重试...")
+                    return 'error'
+                sessions.record_reuse('download', age, False)
+            else:
+                sessions.record_reuse('download', age, True)
+                print(f"  复用 {age:.1f} 秒前的验证令牌直接下载成功")
+                return 'ok'
+
+        # 会话上已有预先识别的答案时，再提交旧验证码不会更快，反而会用掉服务器上待验证的那张验证码
+        token, age = sessions.reusable_token(lease, 'dialog') if not lease.answer else (None, None)
+        if token:
+            try:
+                validation_data = submit_download_dialog(http, item_id, image_info, token['Captcha'], headers,
+                                                         detail_page_url, limiter)
+            except requests.exceptions.RequestException as e:
+                print(f"  复用验证码提交时网络错误: {e}。即将重试...")
+                return 'error'
+            round_trips += 1
+            accepted = bool(validation_data.get("result"))
+            sessions.record_reuse('dialog', age, accepted)
+            if accepted:
+                print(f"  复用 {age:.1f} 秒前通过的验证码验证成功")
+                lease.set_token(validation_data)
+                return validation_data
+        lease.drop_token()
+        return None
+
+    def attempt_once(http, lease, attempt):
+        """进行一次尝试，返回 'ok'、'retry'（立即重试）或 'backoff'（退避后重试）。"""
+        nonlocal round_trips
+        validation_data = None
+        if lease:
+            reused = try_reuse(http, lease)
+            if reused in ('ok', 'error'):
+                return 'ok' if reused == 'ok' else 'backoff'
+            validation_data = reused
+
+        if validation_data is None:
+            answer, answer_age = sessions.take_answer(lease) if lease else (None, None)
+            if answer:
+                print(f"  使用后台预先识别的验证码: '{answer}' ({answer_age:.1f} 秒前)")
+            if answer:
+                captcha_solution, ocr_ms = answer, lease.ocr_ms
+            elif lease and sessions.take_empty(lease):
+                # 后台已经为这次尝试下载过一张验证码，不再另外识别
+                captcha_solution, ocr_ms = '', lease.ocr_ms
+            else:
+                captcha_solution, ocr_ms = solve_captcha(http, f"{BASE_URL}/opendata/Image/GetCaptchaImageFor600",
+                                                         headers, limiter, solver, preprocess)
+            if not captcha_solution:
+                print("  OCR识别为空，直接进入下一次尝试...")
+                CAPTCHA_ATTEMPTS.inc(result='empty')
+                if stats:
+                    stats.record_attempt(image_info['id'], attempt + 1, captcha_solution, None, ocr_ms)
+                return 'retry'
+
+            print(f"  提交验证信息...")
+            try:
+                validation_data = submit_download_dialog(http, item_id, image_info, captcha_solution, headers,
+                                                         detail_page_url, limiter)
+            except requests.exceptions.RequestException as e:
+                print(f"  提交验证时网络错误: {e}。即将重试...")
+                CAPTCHA_ATTEMPTS.inc(result='error')
+                return 'backoff'
+
+            round_trips += 1
+            accepted = bool(validation_data.get("result"))
+            CAPTCHA_ATTEMPTS.inc(result='accepted' if accepted else 'rejected')
+            if stats:
+                stats.record_attempt(image_info['id'], attempt + 1, captcha_solution, accepted, ocr_ms)
+            if answer:
+                sessions.record_answer(answer_age, accepted)
+            if not accepted:
+                print(f"  验证失败 (服务器信息: {validation_data.get('message')})，即将重试...")
+                return 'retry'
+            if lease:
+                lease.set_token(validation_data)
+
+        print("  验证成功！准备下载...")
+        try:
+            fetch_image(http, {"imageId": validation_data['ImageId'], "dept": validation_data['Dep'],
+                               "cid": validation_data['Cid'], "capchaCode": validation_data['Captcha'],
+                               "code": validation_data['ImageCode']}, file_path, headers, limiter, byte_budget)
+        except (requests.exceptions.RequestException, IncompleteDownloadError, UnexpectedContentError) as e:
+            print(f"  下载图片时出错: {e}。即将重试...")
+            return 'backoff'
+        return 'ok'
+
     for attempt in range(MAX_RETRIES):
         print(f"第 {attempt + 1} / {MAX_RETRIES} 次尝试...")
-        captcha_solution = solve_captcha(session, f"{base_url}/opendata/Image/GetCaptchaImageFor600", headers)
-        if not captcha_solution:
-            print("  OCR识别为空，直接进入下一次尝试...")
-            time.sleep(2)
-            continue
-
-        payload = {'ImageId': image_info['id'], 'Dep': 'U', 'RandomCode': image_info['code'], 'ItemId': item_id,
-                   'CaptchaCode': captcha_solution}
-        post_headers = headers.copy()
-        post_headers['Referer'] = detail_page_url
-        print(f"  提交验证信息...")
+        lease = sessions.acquire() if sessions else None
         try:
-            validation_response = session.post(f"{base_url}/opendata/Image/DownloadDialog600", data=payload,
-                                               headers=post_headers, timeout=REQUEST_TIMEOUT, proxies=PROXIES)
-            validation_data = validation_response.json()
-        except requests.exceptions.RequestException as e:
-            print(f"  提交验证时网络错误: {e}。即将重试...")
-            time.sleep(2)
-            continue
-
-        if validation_data.get("result"):
-            print("  验证成功！准备下载...")
-            final_params = validation_data
-            img_response = session.get(f"{base_url}/opendata/Image/Download600",
-                                       params={"imageId": final_params['ImageId'], "dept": final_params['Dep'],
-                                               "cid": final_params['Cid'], "capchaCode": final_params['Captcha'],
-                                               "code": final_params['ImageCode']}, headers=headers,
-                                       timeout=REQUEST_TIMEOUT, proxies=PROXIES)
-            img_response.raise_for_status()
-            file_path = os.path.join(download_folder, f"{image_info['name']}.jpg")
-            with open(file_path, 'wb') as f:
-                f.write(img_response.content)
+            outcome = attempt_once(lease.session if lease else session, lease, attempt)
+        finally:
+            if lease:
+                sessions.release(lease)
+        if outcome == 'ok':
             print(f"图片成功下载至: {file_path}")
+            CAPTCHA_ATTEMPTS_PER_IMAGE.observe(attempt + 1)
+            IMAGES_DOWNLOADED.inc(result='ok')
+            if stats:
+                stats.record_image(round_trips, True)
             return True
-        else:
-            print(f"  验证失败 (服务器信息: {validation_data.get('message')})，即将重试...")
-            time.sleep(2)
+        if outcome == 'backoff':
+            time.sleep(backoff_delay(attempt + 1))
 
     print(f"--- 图片 {image_info['name']} 尝试{MAX_RETRIES}次后仍然失败 ---")
-    with open(log_file_path, "a", encoding="utf-8") as f:
+    CAPTCHA_ATTEMPTS_PER_IMAGE.observe(MAX_RETRIES)
+    IMAGES_DOWNLOADED.inc(result='failed')
+    if stats:
+        stats.record_image(round_trips, False)
+    with _log_lock, open(log_file_path, "a", encoding="utf-8") as f:
         log_entry = {"detail_page_url": detail_page_url, "image_info": image_info,
                      "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")}
         f.write(json.dumps(log_entry, ensure_ascii=False) + "\n")
     return False
 
 
-def run_scraper_for_url(page_url, headers, project_root):
-    """对单个详情页进行完整的图片抓取流程，采用精准断点续传。"""
-    LOG_FILE_PATH = os.path.join(project_root, 'output', 'failed_images.log')
-    DOWNLOAD_ROOT_DIR = os.path.join(project_root, 'output', 'taipei_museum_artifacts')
-    os.makedirs(DOWNLOAD_ROOT_DIR, exist_ok=True)
+def reuse_downloaded_images(state, page_url, kind, images):
+    """
+    同一张图片（相同的 image_id）已经作为其他类型下载过时，直接以硬链接放到目标路径并记为完成，
+    不再解验证码重新下载。返回仍需下载的图片信息列表。
+    """
+    remaining = []
+    for info in images:
+        existing = state.find_done_image(info['id'])
+        if existing and os.path.abspath(existing) != os.path.abspath(info['path']):
+            method = link_or_copy(existing, info['path'])
+            state.mark_image(page_url, info['id'], kind, True)
+            tqdm.write(f"图片 {info['name']} 已下载过，{'硬链接' if method == 'link' else '复制'}自 {existing}")
+        else:
+            remaining.append(info)
+    return remaining
 
-    with requests.Session() as session:
-        try:
-            response = session.get(page_url, headers=headers, timeout=REQUEST_TIMEOUT, proxies=PROXIES)
-            response.raise_for_status()
-            html_content = response.text
-            soup = BeautifulSoup(html_content, 'html.parser')
-
-            item_id_match = re.search(r"GetJson?cid=(\d+)", html_content)
-            item_id = item_id_match.group(1) if item_id_match else None
-            gallery_div = soup.find('div', id='gallery')
-            image_tags = gallery_div.find_all('img') if gallery_div else []
-
-            if not (item_id and image_tags):
-                tqdm.write(f"错误：在详情页 {page_url} 未找到文物ID或图片列表。")
-                return
 
-            image_info_list = [
-                {'name': tag.get('data-image-name'), 'id': tag.get('data-image-id'), 'code': tag.get('data-image-code')}
-                for tag in image_tags]
-            
-            page_title = soup.title.string.strip().replace(' ', '_').replace('　', '_')
-            safe_page_title = re.sub(r'[\\/:*?"<>|]', '_', page_title)
-            download_folder = os.path.join(DOWNLOAD_ROOT_DIR, safe_page_title)
-            os.makedirs(download_folder, exist_ok=True)
+def parse_detail_page(session, page_url, headers, cache, limiter=None):
+    """获取并解析详情页，返回 (文物ID, 可用作文件名的页面标题, 图片信息列表)。"""
+    # 详情页与元数据抓取脚本共享同一份响应缓存，只需从服务器获取一次；命中缓存时不经过限速
+    html_content = cache.fetch(session, page_url, headers, limiter=limiter, timeout=DOWNLOAD_TIMEOUT, proxies=PROXIES)
+    soup = BeautifulSoup(html_content, 'html.parser')
+
+    item_id_match = re.search(r"GetJson\?cid=(\d+)", html_content)
+    item_id = item_id_match.group(1) if item_id_match else None
+    gallery_div = soup.find('div', id='gallery')
+    image_tags = gallery_div.find_all('img') if gallery_div else []
+    image_info_list = [
+        {'name': tag.get('data-image-name'), 'id': tag.get('data-image-id'), 'code': tag.get('data-image-code')}
+        for tag in image_tags]
+
+    page_title = soup.title.string.strip().replace(' ', '_').replace('　', '_')
+    safe_page_title = re.sub(r'[\\/:*?"<>|]', '_', page_title)
+    return item_id, safe_page_title, image_info_list
+
 
-            expected_filenames = {f"{info['name']}.jpg" for info in image_info_list}
+def find_missing_images(session, page_url, headers, project_root, cache, limiter=None, state=None, modes=('all',),
+                        index=None):
+    """
+    解析详情页（每个详情页只获取、解析一次），返回 (文物ID, 待下载的图片任务列表)。
+
+    modes 为 'all'（全部图片，保存到 taipei_museum_artifacts/<标题>/）和 'main'（主图，保存为
+    main_images/<index>_<标题>.jpg）的组合。两者都有时主图就是图集中的第一张，不单独下载：
+    它作为该图片任务的 followers 在下载成功后以硬链接生成。
+    传入爬取状态库 state 时按状态库判断哪些图片尚未完成，否则按文件是否存在判断。
+    详情页中找不到文物ID或图片列表时返回 None。
+    """
+    item_id, safe_page_title, image_info_list = parse_detail_page(session, page_url, headers, cache, limiter)
+    if not (item_id and image_info_list):
+        tqdm.write(f"错误：在详情页 {page_url} 未找到文物ID或图片列表。")
+        if state:
+            for kind in modes:
+                state.mark_images_failed(page_url, kind, "未找到文物ID或图片列表")
+        return None
+
+    tasks = []
+    if 'all' in modes:
+        download_folder = os.path.join(project_root, 'output', 'taipei_museum_artifacts', safe_page_title)
+        os.makedirs(download_folder, exist_ok=True)
+        images = [dict(info, kind='all', path=os.path.join(download_folder, f"{info['name']}.jpg"), followers=[])
+                  for info in image_info_list]
+        if state:
+            missing = reuse_downloaded_images(state, page_url, 'all',
+                                              state.register_images(page_url, 'all', item_id, images))
+        else:
             existing_filenames = set(os.listdir(download_folder))
-            missing_files_info = [info for info in image_info_list if f"{info['name']}.jpg" not in existing_filenames]
+            missing = [info for info in images if f"{info['name']}.jpg" not in existing_filenames]
+        if not missing:
+            tqdm.write(f"文件夹 '{safe_page_title}' 内容已完整，精准跳过。")
+        else:
+            tqdm.write(f"文件夹 '{safe_page_title}' 检查完毕，发现 {len(missing)} / {len(images)} 个文件需要下载。")
+        tasks.extend(missing)
 
-            if not missing_files_info:
-                tqdm.write(f"文件夹 '{safe_page_title}' 内容已完整，精准跳过。")
-                return
+    if 'main' in modes:
+        if index is None:
+            raise ValueError("下载主图需要提供文物序号 index")
+        main_image_dir = os.path.join(project_root, 'output', 'main_images')
+        os.makedirs(main_image_dir, exist_ok=True)
+        # 使用 序号_标题.jpg 格式命名
+        main_image = dict(image_info_list[0], kind='main', index=index, followers=[],
+                          path=os.path.join(main_image_dir, f"{index:05d}_{safe_page_title}.jpg"))
+        if state:
+            pending = reuse_downloaded_images(state, page_url, 'main',
+                                              state.register_images(page_url, 'main', item_id, [main_image]))
+        else:
+            pending = [] if os.path.exists(main_image['path']) else [main_image]
+        if not pending:
+            tqdm.write(f"主图 '{os.path.basename(main_image['path'])}' 已存在，跳过。")
+        else:
+            leader = next((task for task in tasks if task['id'] == main_image['id']), None)
+            if leader:
+                leader['followers'].append(main_image)
             else:
-                tqdm.write(f"文件夹 '{safe_page_title}' 检查完毕，发现 {len(missing_files_info)} / {len(expected_filenames)} 个文件需要下载。")
+                tasks.append(main_image)
+    return item_id, tasks
+
+
+def finish_image_task(page_url, task, success, state=None):
+    """写回一张图片的下载结果；成功时把同一张图片的其他输出（followers，例如 --both 模式下的主图）硬链接到位。"""
+    for follower in task['followers']:
+        if success:
+            link_or_copy(task['path'], follower['path'])
+        if state:
+            state.mark_image(page_url, follower['id'], follower['kind'], success)
+    if state:
+        state.mark_image(page_url, task['id'], task['kind'], success)
 
-            for i, single_image in enumerate(missing_files_info):
-                success = download_single_image(session, item_id, single_image, download_folder, headers, page_url, LOG_FILE_PATH)
+
+def failed_log_path(project_root, kind):
+    name = 'failed_main_images.log' if kind == 'main' else 'failed_images.log'
+    return os.path.join(project_root, 'output', name)
+
+
+def run_scraper_for_url(page_url, headers, project_root, solver=None, stats=None, state=None, modes=('all',),
+                        index=None, limiter=None, sessions=None, session=None, preprocess=True):
+    """
+    对单个详情页按 modes 进行完整的图片抓取流程，采用精准断点续传。limiter 为共享的 rate_limit.Throttle，
+    sessions 为预热的验证码会话池 (captcha_sessions.CaptchaSessionPool)，可省略；preprocess 见 download_single_image。
+    逐个处理多个详情页时应传入同一个 session (http_client.new_session)，连接在文物之间复用。
+    """
+    cache = ResponseCache(os.path.join(project_root, 'output', 'html_cache'))
+
+    with nullcontext(session) if session else new_session(1) as session:
+        try:
+            found = find_missing_images(session, page_url, headers, project_root, cache, limiter, state, modes, index)
+            if not found:
+                return
+            item_id, tasks = found
+
+            for task in tasks:
+                log_file_path = failed_log_path(project_root, task['kind'])
+                success = download_single_image(session, item_id, task, None, headers, page_url, log_file_path,
+                                                limiter=limiter, solver=solver, stats=stats, sessions=sessions,
+                                                preprocess=preprocess)
+                finish_image_task(page_url, task, success, state)
                 if not success:
-                    tqdm.write(f"警告：图片 {single_image['name']} 未能成功下载，详情已记录到 {LOG_FILE_PATH}")
-                if i < len(missing_files_info) - 1:
-                    time.sleep(1)
+                    tqdm.write(f"警告：图片 {task['name']} 未能成功下载，详情已记录到 {log_file_path}")
         except Exception as e:
             tqdm.write(f"处理详情页 {page_url} 时发生严重错误: {e}")
+            if state:
+                for kind in modes:
+                    state.mark_images_failed(page_url, kind, str(e))
 
 
-if __name__ == '__main__':
+def run_concurrent_download(pages, headers, project_root, workers=4, rate=2.0, max_bytes_in_flight=256 * 1024 * 1024,
+                            solver=None, stats=None, state=None, modes=('all',), max_rate=None, limiter=None,
+                            on_image_done=None, warm_sessions=None, reuse_tokens=True, preprocess=True):
+    """
+    并发下载引擎。pages 为 (文物序号, 详情页URL) 的列表或迭代器（可以是上一阶段边产生边消费的队列），
+    序号用于主图文件名。
+
+    一个生产者线程逐个解析详情页，把待下载的图片放入共享的有界队列；workers 个下载线程各自持有
+    独立的会话 (http_client.new_session，因此各自拥有独立的验证码 Cookie 状态)，从队列中取任务并行下载。
+    各端点的请求速率从每秒 rate 次开始自适应调整（不超过 max_rate），也可以传入与其他阶段共享的 limiter。
+    所有线程的在途字节总数不超过 max_bytes_in_flight。每张图片下载成功后，它及其 followers 的路径会传给 on_image_done。
+
+    warm_sessions 个预热的验证码会话（默认比下载线程多 EXTRA_SESSIONS 个，只有一个下载线程时默认不使用，
+    0 表示不使用）由后台线程提前
+    识别好验证码，下载线程领取会话而不再自己识别；reuse_tokens 为 True 时尝试复用验证成功的令牌。
+    没有 solver 时在线程中识别验证码，preprocess 决定识别前是否做图像预处理。
+    返回 {'ok': 成功张数, 'failed': 失败张数, 'sessions': 会话池统计（未使用时为 None）}。
+    """
+    cache = ResponseCache(os.path.join(project_root, 'output', 'html_cache'))
+    limiter = limiter or Throttle(rate, max_rate)
+    byte_budget = ByteBudget(max_bytes_in_flight)
+    # 队列有界：生产者不会远远跑在下载线程前面
+    jobs = queue.Queue(maxsize=workers * 4)
+    QUEUE_DEPTH.set_function(jobs.qsize, queue='download_jobs')
+    progress = tqdm(desc="图片下载", unit="张")
+    counts = {'ok': 0, 'failed': 0}
+    counts_lock = threading.Lock()
+    if warm_sessions is None:
+        warm_sessions = workers + EXTRA_SESSIONS if workers > 1 else 0
+    sessions = (open_session_pool(headers, warm_sessions, limiter, solver, reuse_tokens, preprocess)
+                if warm_sessions else None)
+
+    def producer():
+        with new_session(1) as session:
+            for index, page_url in tqdm(pages, desc="详情页解析"):
+                try:
+                    found = find_missing_images(session, page_url, headers, project_root, cache, limiter, state,
+                                                modes, index)
+                except Exception as e:
+                    tqdm.write(f"处理详情页 {page_url} 时发生严重错误: {e}")
+                    if state:
+                        for kind in modes:
+                            state.mark_images_failed(page_url, kind, str(e))
+                    continue
+                if not found:
+                    continue
+                item_id, tasks = found
+                for task in tasks:
+                    jobs.put((item_id, task, page_url))
+        for _ in range(workers):
+            jobs.put(None)
+
+    def worker():
+        with new_session(1) as session:
+            while True:
+                job = jobs.get()
+                if job is None:
+                    return
+                item_id, task, page_url = job
+                try:
+                    success = download_single_image(session, item_id, task, None, headers, page_url,
+                                                    failed_log_path(project_root, task['kind']), limiter,
+                                                    byte_budget, solver, stats, sessions, preprocess)
+                    finish_image_task(page_url, task, success, state)
+                    if success and on_image_done:
+                        for done in [task] + task['followers']:
+                            on_image_done(done['path'])
+                except Exception as e:
+                    tqdm.write(f"下载图片 {task['name']} 时发生错误: {e}")
+                    success = False
+                    if state:
+                        state.mark_image(page_url, task['id'], task['kind'], False, str(e))
+                with counts_lock:
+                    counts['ok' if success else 'failed'] += 1
+                progress.update(1)
+
+    threads = [threading.Thread(target=producer, daemon=True)]
+    threads += [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    progress.close()
+    QUEUE_DEPTH.remove(queue='download_jobs')
+    session_summary = None
+    if sessions:
+        sessions.close()
+        session_summary = sessions.summary()
+    print(f"\n并发下载结束：成功 {counts['ok']} 张，失败 {counts['failed']} 张。")
+    print(f"请求统计: {json.dumps(limiter.summary(), ensure_ascii=False)}")
+    if session_summary:
+        print(f"验证码会话池: {json.dumps(session_summary, ensure_ascii=False)}")
+    return dict(counts, sessions=session_summary)
+
+
+def add_session_pool_arguments(parser):
+    """添加验证码会话池的命令行参数，crawl_pipeline.py 与本脚本共用。"""
+    parser.add_argument('--warm-sessions', type=int, default=None,
+                        help=f"后台预先识别好验证码的会话数，0 表示不预热、每张图片在下载线程中识别 "
+                             f"(默认: 下载线程数 + {EXTRA_SESSIONS}；只有 1 个下载线程时为 0)")
+    parser.add_argument('--no-token-reuse', action='store_true', help="不尝试复用验证成功的验证码令牌")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="下载文物详情页中的高清图片和主图。")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--all', dest='mode', action='store_const', const='all',
+                      help="下载详情页中的全部图片到 output/taipei_museum_artifacts/ (默认)")
+    mode.add_argument('--main-only', dest='mode', action='store_const', const='main',
+                      help="只下载主图到 output/main_images/")
+    mode.add_argument('--both', dest='mode', action='store_const', const='both',
+                      help="两者都要：每个详情页只解析一次、每张图片只下载一次，主图以硬链接生成")
+    # 待处理的文物从爬取状态库 output/crawl_state.sqlite 中领取
+    parser.add_argument('--limit', type=int, default=0, help="本次最多处理的文物数，0 表示全部待处理的 (默认: 0)")
+    parser.add_argument('--retry-failed', action='store_true', help="只重试之前有图片下载失败的文物")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="并行下载线程数，每个线程使用独立会话；1 表示原有的串行模式 (默认: 1)")
+    parser.add_argument('--rate', type=float, default=2.0, help="每个端点的初始每秒请求次数，之后按服务器响应自适应调整 (默认: 2.0)")
+    parser.add_argument('--max-rate', type=float, default=None, help="自适应调速的上限，次/秒 (默认: --rate 的 4 倍)")
+    parser.add_argument('--max-mb-in-flight', type=int, default=256, help="并发模式下在途图片数据上限 MB (默认: 256)")
+    parser.add_argument('--ocr-workers', type=int, default=2, help="验证码 OCR 进程数，0 表示在下载线程中直接识别 (默认: 2)")
+    parser.add_argument('--no-preprocess', action='store_true', help="OCR 前不做验证码图像预处理")
+    add_session_pool_arguments(parser)
+    add_shard_argument(parser)
+    add_http_arguments(parser)
+    add_telemetry_arguments(parser)
+    args = parser.parse_args(argv)
+    start_telemetry(args)
+    configure_http(args)
+    modes = DOWNLOAD_MODES[args.mode or 'all']
+
     # --- 动态路径处理 ---
     SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
     PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
-    URL_FILE = os.path.join(PROJECT_ROOT, 'output', 'urls.txt')
-    LOG_FILE = os.path.join(PROJECT_ROOT, 'output', 'failed_images.log')
+    CAPTCHA_LOG_FILE = os.path.join(PROJECT_ROOT, 'output', 'captcha_attempts.jsonl')
     # ---
 
-    if not os.path.exists(URL_FILE):
-        print(f"错误: 未找到URL列表文件 '{URL_FILE}'。请先运行 'src/harvest_urls.py'。")
-    else:
-        with open(URL_FILE, "r", encoding="utf-8") as f:
-            urls_to_scrape = [line.strip() for line in f if line.strip()]
-        print(f"从 '{URL_FILE}' 文件中加载了 {len(urls_to_scrape)} 个URL。")
+    state = open_default_state()
+    if len(state) == 0:
+        print("错误: 爬取状态库中没有任何文物。请先运行 'src/harvest_urls.py'。")
+        return
 
-        START_INDEX = 1
-        END_INDEX = 10
+    if args.shard:
+        write_shard_marker(os.path.join(PROJECT_ROOT, 'output'), args.shard)
+        print(f"只处理分片 {args.shard}。")
+    # 序号为文物在状态库中的登记顺序，与旧版 urls.txt 中的行号一致，用作主图文件名前缀。
+    # pages 按需分页读取状态库，不会一次性载入全部待处理的文物
+    pages = state.pending_image_artifacts(modes, args.retry_failed, args.limit, shard=args.shard)
+    print(f"本次任务将处理 {len(pages)} 个{'之前下载失败的' if args.retry_failed else '待下载的'}文物。")
 
-        urls_to_process = urls_to_scrape[START_INDEX - 1:END_INDEX] if END_INDEX is not None else urls_to_scrape[START_INDEX - 1:]
-        print(f"本次任务将处理第 {START_INDEX} 到 {END_INDEX if END_INDEX is not None else len(urls_to_scrape)} 个URL，共计 {len(urls_to_process)} 个。")
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/138.0.0.0 Safari/537.36'}
 
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/138.0.0.0 Safari/537.36'}
-
-        for url in tqdm(urls_to_process, desc="下载总进度"):
+    solver = CaptchaSolver(args.ocr_workers, preprocess=not args.no_preprocess) if args.ocr_workers > 0 else None
+    stats = CaptchaStats(CAPTCHA_LOG_FILE)
+    try:
+        if args.workers > 1:
+            run_concurrent_download(pages, headers, PROJECT_ROOT, workers=args.workers, rate=args.rate,
+                                    max_bytes_in_flight=args.max_mb_in_flight * 1024 * 1024,
+                                    solver=solver, stats=stats, state=state, modes=modes, max_rate=args.max_rate,
+                                    warm_sessions=args.warm_sessions, reuse_tokens=not args.no_token_reuse,
+                                    preprocess=not args.no_preprocess)
+        else:
+            # 请求间隔由自适应节流器控制，不再在文物之间固定休息
+            limiter = Throttle(args.rate, args.max_rate)
+            # 串行模式默认不预热，需要时用 --warm-sessions 开启
+            sessions = (open_session_pool(headers, args.warm_sessions, limiter, solver, not args.no_token_reuse,
+                                          not args.no_preprocess)
+                        if args.warm_sessions else None)
             try:
-                run_scraper_for_url(url, headers, PROJECT_ROOT)
-                tqdm.write("--- 单个文物处理完毕，休息3秒 ---")
-                time.sleep(3)
-            except Exception as e:
-                tqdm.write(f"处理URL {url} 时发生顶级未知错误: {e}。将继续处理下一个URL。")
-                time.sleep(5)
-
-        print("\n本次指定的下载任务已全部完成！")
-        if os.path.exists(LOG_FILE):
-            print(f"\n警告：有部分图片下载失败，详情请查看 {LOG_FILE} 文件。")
+                with new_session(1) as session:
+                    for index, url in tqdm(pages, desc="下载总进度"):
+                        try:
+                            run_scraper_for_url(url, headers, PROJECT_ROOT, solver, stats, state, modes, index,
+                                                limiter, sessions, session, not args.no_preprocess)
+                        except Exception as e:
+                            tqdm.write(f"处理URL {url} 时发生顶级未知错误: {e}。将继续处理下一个URL。")
+            finally:
+                if sessions:
+                    sessions.close()
+            print(f"请求统计: {json.dumps(limiter.summary(), ensure_ascii=False)}")
+            if sessions:
+                print(f"验证码会话池: {json.dumps(sessions.summary(), ensure_ascii=False)}")
+    finally:
+        if solver:
+            solver.close()
+
+    print(f"\n验证码统计: {json.dumps(stats.summary(), ensure_ascii=False)}")
+
+    print("\n本次指定的下载任务已全部完成！")
+    for kind in modes:
+        failed = state.failed_images(kind)
+        if failed:
+            print(f"\n警告：共有 {len(failed)} 张{'主图' if kind == 'main' else '图片'}下载失败，"
+                  f"可运行 'python src/crawl_state.py failed {kind}' 查看，或加上 --retry-failed 重新下载。"
+                  f"详情另见 {failed_log_path(PROJECT_ROOT, kind)} 文件。")
+
+
+if __name__ == '__main__':
+    main()
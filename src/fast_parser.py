@@ -0,0 +1,271 @@
+"""
+基于 lxml 的详情页快速解析后端。
+
+与 scrape_metadata 中基于 BeautifulSoup(html.parser) 的解析函数逐项等价：只构建一次 lxml 树，
+一次遍历所有 div 就定位到标题和 details-1 ~ details-9 九个区块，再用与原函数相同的规则提取字段，
+输出的 JSON 与原实现逐字节一致。
+
+这一保证只对结构完整的页面成立：libxml2 与 html.parser 修复不完整页面的方式不同（例如省略 </td> 时
+libxml2 按 HTML 规则自动闭合单元格，html.parser 则把后面的单元格嵌套在前一个里；CDATA 段也各自处理），
+得到的树不同。is_well_formed() 先做一次只看标签的快速检查，scrape_metadata.parse_artifact_html 对
+不完整的页面自动改用 bs4 实现。
+
+用法（校验两种后端在已保存页面上的输出是否一致，目录可以是响应缓存 output/html_cache）：
+    python src/fast_parser.py <保存的详情页HTML目录>
+    python src/fast_parser.py benchmark/parser_corpus     # 仓库中附带的样例，包括结构不完整的页面
+"""
+import os
+import re
+import sys
+import json
+import time
+
+try:
+    import lxml.html
+except ImportError:  # lxml 为可选依赖
+    lxml = None
+
+# BeautifulSoup 的 get_text() 不返回这些标签内的文字（它们属于 Script/Stylesheet 等特殊字符串类型）
+_NON_TEXT_TAGS = {'script', 'style', 'template', 'rt', 'rp'}
+
+# is_well_formed 使用：没有结束标签的空元素，以及内容不按标签解析的元素
+_VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'meta', 'param',
+              'source', 'track', 'wbr'}
+_RAW_TEXT_TAGS = {'textarea', 'title', 'xmp', 'iframe', 'noembed', 'noframes', 'plaintext'}
+_SKIP_RE = re.compile(r'<!--.*?-->|<(script|style)\b.*?</\1\s*>', re.S | re.I)
+_TAG_RE = re.compile(r'<(/?)([a-zA-Z][^\s/>]*)[^>]*?(/?)>')
+
+
+def is_well_formed(html):
+    """
+    快速检查页面的标签结构是否完整：除空元素外每个标签都有显式的结束标签且正确嵌套，
+    没有 CDATA 段和 NUL 字符，textarea 等元素内没有标签。只有这样 lxml 与 html.parser 才构建出相同的树。
+    检查偏保守，返回 False 只表示应改用 bs4 解析，不代表页面一定会解析出不同的结果。
+    """
+    if '<![CDATA[' in html or '\x00' in html:
+        return False
+    stack = []
+    for closing, tag, self_closing in _TAG_RE.findall(_SKIP_RE.sub('', html)):
+        tag = tag.lower()
+        if stack and stack[-1] in _RAW_TEXT_TAGS and not (closing and tag == stack[-1]):
+            return False
+        if tag in _VOID_TAGS:
+            if closing:
+                return False
+        elif closing:
+            if not stack or stack.pop() != tag:
+                return False
+        elif self_closing or tag == 'plaintext':
+            return False
+        else:
+            stack.append(tag)
+    return not stack
+
+
+def _classes(el):
+    return (el.get('class') or '').split()
+
+
+def _find(el, tag, class_=None):
+    """等价于 bs4 的 tag.find(name, class_=...)：返回第一个匹配的后代元素。"""
+    for descendant in el.iterdescendants(tag):
+        if class_ is None or class_ in _classes(descendant):
+            return descendant
+    return None
+
+
+def _strings(el):
+    if el.text:
+        yield el.text
+    for child in el:
+        # 注释和处理指令的 tag 不是字符串，其文字不计入，但 tail 属于父元素
+        if isinstance(child.tag, str) and child.tag not in _NON_TEXT_TAGS:
+            yield from _strings(child)
+        if child.tail:
+            yield child.tail
+
+
+def _get_text(el, separator=''):
+    """等价于 bs4 的 tag.get_text(separator=..., strip=True)。"""
+    return separator.join(s.strip() for s in _strings(el) if s.strip())
+
+
+def _parse_key_value_table(table_tag):
+    data = {}
+    if table_tag is None: return data
+    for row in table_tag.iterdescendants('tr'):
+        first_th = _find(row, 'th')
+        first_td = _find(row, 'td')
+        key_cell = first_th if first_th is not None else first_td
+        if key_cell is not None and key_cell.tag == 'td':
+            value_cell = next(first_td.itersiblings('td'), None)
+        else:
+            value_cell = first_td
+        if key_cell is not None and value_cell is not None:
+            key = _get_text(key_cell)
+            value = _get_text(value_cell, separator='\n')
+            if key in data:
+                if isinstance(data[key], list):
+                    data[key].append(value)
+                else:
+                    data[key] = [data[key], value]
+            else:
+                data[key] = value
+    return data
+
+
+def _parse_header_row_table(table_tag):
+    data = []
+    if table_tag is None: return data
+    headers = [_get_text(th) for th in table_tag.iterdescendants('th')]
+    if not headers: return data
+    for row in table_tag.iterdescendants('tr'):
+        cells = list(row.iterdescendants('td'))
+        if cells and len(cells) == len(headers):
+            data.append({headers[i]: _get_text(cell, separator='\n') for i, cell in enumerate(cells)})
+    return data
+
+
+def _parse_inscription_table(table_tag):
+    data = []
+    if table_tag is None: return data
+    first_row = _find(table_tag, 'tr')
+    if first_row is None:
+        # 与原实现一致：没有任何行时 table.find('tr') 为 None，属于页面结构错误
+        raise AttributeError("'NoneType' object has no attribute 'find_all'")
+    headers = [_get_text(th) for th in first_row.iterdescendants('th')]
+    if not headers: return []
+    tbody = _find(table_tag, 'tbody')
+    all_rows = list((tbody if tbody is not None else table_tag).iterdescendants('tr'))
+    i = 0
+    while i < len(all_rows):
+        row = all_rows[i]
+        if _find(row, 'th') is not None or next(row.iterancestors('table'), None) is not table_tag:
+            i += 1
+            continue
+        cells = [child for child in row if child.tag == 'td']
+        if len(cells) == len(headers):
+            row_data = {header: _get_text(cell, separator='\n') for header, cell in zip(headers, cells)}
+            if i + 1 < len(all_rows):
+                seals_table = _find(all_rows[i + 1], 'table', 'table-details2')
+                if seals_table is not None:
+                    row_data['印記資料'] = _parse_header_row_table(seals_table)
+                    i += 1
+            data.append(row_data)
+        i += 1
+    return data
+
+
+def _parse_conservation_info(div_tag):
+    data = {}
+    if div_tag is None: return data
+    info_div = _find(div_tag, 'div', 'nav-info')
+    if info_div is not None: data['說明'] = _get_text(info_div)
+    data['相關連結'] = [{'文本': _get_text(a_tag), 'onclick': a_tag.get('onclick')}
+                      for a_tag in div_tag.iterdescendants('a') if 'btn-project2' in _classes(a_tag)]
+    return data
+
+
+# 区块名 -> (div id, 解析函数, 解析函数是否作用于区块内的第一个 table)
+SECTIONS_TO_SCRAPE = {
+    "基本資料": ("details-1", _parse_key_value_table, True),
+    "典藏尺寸": ("details-2", _parse_header_row_table, True),
+    "質地": ("details-3", _parse_header_row_table, True),
+    "題跋資料": ("details-4", _parse_inscription_table, True),
+    "印記資料": ("details-5", _parse_header_row_table, True),
+    "主題": ("details-6", _parse_header_row_table, True),
+    "技法": ("details-7", _parse_header_row_table, True),
+    "參考資料": ("details-8", _parse_key_value_table, True),
+    "保存維護": ("details-9", _parse_conservation_info, False)
+}
+_SECTION_IDS = {div_id for div_id, _, _ in SECTIONS_TO_SCRAPE.values()}
+
+
+def parse_artifact_html(url, html):
+    """与 scrape_metadata.parse_artifact_html 输出一致的 lxml 实现。"""
+    if lxml is None:
+        raise ImportError("lxml 解析后端需要先安装 lxml: pip install lxml")
+    root = lxml.html.fromstring(html)
+
+    # 一次遍历找出标题和所有区块
+    title_div = None
+    section_divs = {}
+    for div in root.iter('div'):
+        div_id = div.get('id')
+        if div_id in _SECTION_IDS and div_id not in section_divs:
+            section_divs[div_id] = div
+        if title_div is None and 'details-title' in _classes(div):
+            title_div = div
+
+    item_id_match = re.search(r"GetJson\?cid=(\d+)", html)
+    unique_id = item_id_match.group(1) if item_id_match else url.split('Detail/')[1].split('?')[0]
+
+    artifact_data = {
+        "UniqueID": unique_id,
+        "URL": url,
+        "文物名称": _get_text(title_div) if title_div is not None else "N/A"
+    }
+
+    for section_name, (div_id, parse_func, wants_table) in SECTIONS_TO_SCRAPE.items():
+        section_div = section_divs.get(div_id)
+        if section_div is not None:
+            artifact_data[section_name] = parse_func(_find(section_div, 'table') if wants_table else section_div)
+        else:
+            artifact_data[section_name] = {}
+    return artifact_data
+
+
+def _iter_corpus(html_dir):
+    # 响应缓存目录：直接使用缓存中的详情页
+    if os.path.isdir(os.path.join(html_dir, 'index')):
+        from response_cache import ResponseCache
+        cache = ResponseCache(html_dir)
+        for entry in cache.entries():
+            if 'Detail/' in entry['url']:
+                yield entry['url'], entry['url'], cache.read_body(entry)
+        return
+    # 普通目录：文件名（去掉扩展名）作为 Detail ID 构造URL
+    for name in sorted(os.listdir(html_dir)):
+        if name.endswith(('.html', '.htm')):
+            with open(os.path.join(html_dir, name), "r", encoding="utf-8") as f:
+                html = f.read()
+            yield name, f"https://digitalarchive.npm.gov.tw/opendata/Pub/Detail/{os.path.splitext(name)[0]}", html
+
+
+def verify_corpus(html_dir):
+    """
+    在已保存的详情页上对比 bs4 与 lxml 两种后端（即 --parser lxml，结构不完整时回退到 bs4）的 JSON 输出，
+    返回不一致的页面列表。
+    """
+    import scrape_metadata
+
+    mismatches = []
+    timings = {'bs4': 0.0, 'lxml': 0.0}
+    total = fallbacks = 0
+    for name, url, html in _iter_corpus(html_dir):
+        total += 1
+        if not is_well_formed(html):
+            fallbacks += 1
+        outputs = {}
+        for backend in ('bs4', 'lxml'):
+            started = time.perf_counter()
+            try:
+                outputs[backend] = json.dumps(scrape_metadata.parse_artifact_html(url, html, backend), indent=4,
+                                              ensure_ascii=False)
+            except Exception as e:
+                outputs[backend] = f"{type(e).__name__}: {e}"
+            timings[backend] += time.perf_counter() - started
+        if outputs['bs4'] != outputs['lxml']:
+            mismatches.append(name)
+    print(f"共校验 {total} 个页面，不一致 {len(mismatches)} 个；其中 {fallbacks} 个页面结构不完整，lxml 后端改用 bs4 解析。")
+    print(f"解析耗时: bs4 {timings['bs4']:.2f}s, lxml {timings['lxml']:.2f}s")
+    for name in mismatches:
+        print(f"  不一致: {name}")
+    return mismatches
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or not os.path.isdir(sys.argv[1]):
+        print("用法: python src/fast_parser.py <保存的详情页HTML目录>")
+        sys.exit(1)
+    sys.exit(1 if verify_corpus(sys.argv[1]) else 0)
@@ -1,13 +1,141 @@
-import requests
 import json
 import time
 import os
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 from bs4 import BeautifulSoup
 
+from rate_limit import Throttle, backoff_delay, throttled_request
+from url_frontier import UrlFrontier
+from crawl_state import CrawlState, default_state_path
+from http_client import TIMEOUT, add_http_arguments, configure_http, new_session
+from telemetry import REGISTRY, add_telemetry_arguments, start_telemetry, traced
 
-def harvest_all_urls(target_category="繪畫", page_size=30):
+# --- 全局配置 ---
+# 设置环境变量 NPM_BASE_URL 可把请求指向其他服务器，例如 benchmark/mock_server.py 的本地模拟服务
+BASE_URL = os.environ.get("NPM_BASE_URL", "https://digitalarchive.npm.gov.tw")
+SEARCH_URL = f"{BASE_URL}/opendata/Pub/Search"
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/138.0.0.0 Safari/537.36',
+    'Content-Type': 'application/json;charset=UTF-8',
+}
+MAX_RETRIES = 4
+
+SEARCH_PAGES = REGISTRY.counter('npm_search_pages_total', "采集的列表页数: ok / failed / empty", ['result'])
+URLS_DISCOVERED = REGISTRY.counter('npm_urls_discovered_total', "新发现的详情页URL数", ['category'])
+
+
+@traced('fetch_search_page')
+def fetch_search_page(session, target_category, page_num, page_size, limiter=None):
     """
-    采集指定分类下所有文物详情页的URL。
+    请求一页搜索结果并返回解析后的 soup。limiter 为共享的 rate_limit.Throttle。
+    失败时按带抖动的指数退避重试，超过 MAX_RETRIES 次后抛出最后一次的异常。
+    """
+    payload = {"RegisterType": target_category, "PageInfo": {"PageIndex": page_num, "PageSize": page_size}}
+    for attempt in range(1, MAX_RETRIES + 1):
+        try:
+            response = throttled_request(limiter, session, 'POST', SEARCH_URL, headers=HEADERS,
+                                         json=payload, timeout=TIMEOUT)
+            response.raise_for_status()
+            return BeautifulSoup(response.text, 'html.parser')
+        except Exception as e:
+            if attempt == MAX_RETRIES:
+                raise
+            wait = backoff_delay(attempt, base=2.0)
+            print(f"采集第 {page_num} 页失败 (第 {attempt} / {MAX_RETRIES} 次): {e}，{wait:.1f} 秒后重试...")
+            time.sleep(wait)
+
+
+def extract_detail_urls(soup):
+    """从列表页中提取所有文物详情页的完整URL。"""
+    return [f"{BASE_URL}{link_tag.get('href')}" for link_tag in soup.find_all('a', class_='openblank')]
+
+
+def _harvest_page(session, limiter, target_category, page_num, page_size, first_page):
+    # 第 1 页在获取总页数时已经请求过，直接复用
+    try:
+        soup = first_page if page_num == 1 else fetch_search_page(session, target_category, page_num,
+                                                                  page_size, limiter)
+        return page_num, extract_detail_urls(soup), None
+    except Exception as e:
+        return page_num, None, e
+
+
+def harvest_category(session, limiter, frontier, target_category, page_size=30, concurrency=4, refresh=False,
+                     on_new_urls=None):
+    """
+    采集单个分类的所有列表页，把新发现的URL记录进 frontier。
+    每采集完一页，就把该页新发现的URL列表和分类传给 on_new_urls 回调（crawl_pipeline 用它把URL立即交给下一阶段）。
+
+    refresh 模式下按页码顺序每次并发请求 concurrency 页，一旦某页的文物ID全部已知即停止翻页，
+    因此夜间增量刷新通常只需要少量请求。返回 (新增URL数, 失败页码列表)。
+    """
+    print(f"正在获取分类【{target_category}】的总页数信息...")
+    try:
+        first_page = fetch_search_page(session, target_category, 1, page_size, limiter)
+        total_pages_tag = first_page.find('span', id='total-pageCount')
+        if not total_pages_tag:
+            print("错误：未能找到总页数。")
+            return 0, []
+        total_pages = int(total_pages_tag.text)
+    except Exception as e:
+        print(f"获取总页数失败: {e}")
+        return 0, []
+    if total_pages <= 0:
+        # 分类名有误或分类为空
+        print(f"分类【{target_category}】没有任何列表页，跳过。")
+        return 0, []
+    print(f"目标分类【{target_category}】共有 {total_pages} 页，并发数 {concurrency}。")
+
+    new_count = 0
+    failed_pages = []
+    page_numbers = list(range(1, total_pages + 1))
+    # 非刷新模式一次提交全部页面；刷新模式按批提交，以便尽早停止
+    batch_size = concurrency if refresh else len(page_numbers)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for batch_start in range(0, len(page_numbers), batch_size):
+            batch = page_numbers[batch_start:batch_start + batch_size]
+            reached_known = False
+            # executor.map 按提交顺序返回结果，保证写入顺序与页码一致
+            for page_num, page_urls, error in executor.map(
+                    lambda n: _harvest_page(session, limiter, target_category, n, page_size, first_page), batch):
+                if error is not None:
+                    print(f"采集第 {page_num} 页时发生错误 (已重试 {MAX_RETRIES} 次): {error}")
+                    failed_pages.append(page_num)
+                    SEARCH_PAGES.inc(result='failed')
+                    continue
+                if not page_urls:
+                    print(f"警告：第 {page_num} 页没有找到任何文物链接。")
+                    SEARCH_PAGES.inc(result='empty')
+                    continue
+                SEARCH_PAGES.inc(result='ok')
+                if refresh and frontier.all_known(page_urls):
+                    reached_known = True
+                new_urls = [url for url in page_urls if frontier.add(url, target_category)]
+                page_new = len(new_urls)
+                new_count += page_new
+                URLS_DISCOVERED.inc(page_new, category=target_category)
+                if on_new_urls and new_urls:
+                    on_new_urls(new_urls, target_category)
+                print(f"已采集第 {page_num} / {total_pages} 页，获得 {len(page_urls)} 个URL，其中新增 {page_new} 个。")
+            if reached_known:
+                print(f"分类【{target_category}】已遇到全部已知的列表页，停止翻页。")
+                break
+
+    return new_count, failed_pages
+
+
+def harvest_all_urls(target_category="繪畫", page_size=30, concurrency=4, rate=2.0, refresh=False, max_rate=None,
+                     limiter=None, on_new_urls=None):
+    """
+    采集指定分类（可传入分类列表）下所有文物详情页的URL。
+
+    所有发现过的URL按 Detail ID 去重后持久化在 output/url_frontier.tsv 中，
+    每次运行结束后由它重新生成完整的 urls.txt，并登记到爬取状态库 output/crawl_state.sqlite。列表页由最多 concurrency 个线程
+    共享一个连接池并发请求。请求速率从每秒 rate 次开始，由自适应节流器按服务器的响应情况在
+    max_rate（默认为 rate 的 4 倍）以内调整，服务器持续出错时熔断暂停；也可以传入与其他阶段共享的 limiter。
+    on_new_urls 见 harvest_category。
     """
     # --- 动态路径处理 ---
     # 获取当前脚本所在的目录的绝对路径
@@ -16,73 +144,53 @@ def harvest_all_urls(target_category="繪畫", page_size=30):
     PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
     # 构造输出文件的绝对路径
     output_filepath = os.path.join(PROJECT_ROOT, 'output', 'urls.txt')
+    frontier_filepath = os.path.join(PROJECT_ROOT, 'output', 'url_frontier.tsv')
     # 确保输出目录存在
     os.makedirs(os.path.dirname(output_filepath), exist_ok=True)
     # ---
 
-    base_url = "https://digitalarchive.npm.gov.tw"
-    search_url = f"{base_url}/opendata/Pub/Search"
-
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/138.0.0.0 Safari/537.36',
-        'Content-Type': 'application/json;charset=UTF-8',
-    }
-
-    all_urls = []
+    categories = [target_category] if isinstance(target_category, str) else list(target_category)
+    frontier = UrlFrontier(frontier_filepath)
+    limiter = limiter or Throttle(rate, max_rate)
+    total_new = 0
+    failed = {}
 
-    with requests.Session() as session:
-        print("正在获取总页数信息...")
-        payload_for_page1 = {
-            "RegisterType": target_category, "PageInfo": {"PageIndex": 1, "PageSize": page_size}
-        }
-        try:
-            response = session.post(search_url, headers=headers, data=json.dumps(payload_for_page1))
-            response.raise_for_status()
-            soup = BeautifulSoup(response.text, 'html.parser')
-            total_pages_tag = soup.find('span', id='total-pageCount')
-            if not total_pages_tag:
-                print("错误：未能找到总页数。")
-                return
-            total_pages = int(total_pages_tag.text)
-            print(f"目标分类【{target_category}】共有 {total_pages} 页。")
-        except Exception as e:
-            print(f"获取总页数失败: {e}")
-            return
-
-        for page_num in range(1, total_pages + 1):
-            print(f"正在采集第 {page_num} / {total_pages} 页的URL...")
-            payload = {
-                "RegisterType": target_category, "PageInfo": {"PageIndex": page_num, "PageSize": page_size}
-            }
-            try:
-                response = session.post(search_url, headers=headers, data=json.dumps(payload))
-                response.raise_for_status()
-                list_page_html = response.text
-                soup = BeautifulSoup(list_page_html, 'html.parser')
-                detail_links = soup.find_all('a', class_='openblank')
-
-                if not detail_links:
-                    print(f"警告：第 {page_num} 页没有找到任何文物链接。")
-                    continue
-
-                for link_tag in detail_links:
-                    relative_url = link_tag.get('href')
-                    full_detail_url = f"{base_url}{relative_url}"
-                    all_urls.append(full_detail_url)
-
-                time.sleep(1)
-
-            except Exception as e:
-                print(f"采集第 {page_num} 页时发生错误: {e}")
-                time.sleep(5)
+    with new_session(concurrency) as session:
+        for category in categories:
+            new_count, failed_pages = harvest_category(session, limiter, frontier, category, page_size,
+                                                       concurrency, refresh, on_new_urls)
+            total_new += new_count
+            if failed_pages:
+                failed[category] = failed_pages
 
+    all_urls = frontier.urls()
     with open(output_filepath, "w", encoding="utf-8") as f:
         for url in all_urls:
             f.write(url + "\n")
+    # 同步到爬取状态库，后续脚本从状态库领取任务
+    CrawlState(default_state_path()).add_artifacts(frontier.entries())
 
-    print(f"\n采集完成！共获取 {len(all_urls)} 个URL，已保存至 {output_filepath}")
+    print(f"\n采集完成！本次新增 {total_new} 个URL，累计 {len(all_urls)} 个URL，已保存至 {output_filepath}")
+    print(f"请求统计: {json.dumps(limiter.summary(), ensure_ascii=False)}")
+    for category, failed_pages in failed.items():
+        print(f"警告：分类【{category}】以下页面在重试后仍然失败: {failed_pages}")
 
 
 if __name__ == '__main__':
-    # 您可以在这里修改想爬取的分类，例如 "铜器", "陶瓷", "玉器" 等
-    harvest_all_urls(target_category="繪畫")")}``)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="采集台北故宫开放资料平台指定分类下的文物详情页URL。")
+    # 可以同时指定多个分类，例如 "繪畫" "銅器" "陶瓷" "玉器" 等
+    parser.add_argument('--category', nargs='+', default=["繪畫"], help="要采集的文物分类，可指定多个 (默认: 繪畫)")
+    parser.add_argument('--page-size', type=int, default=30, help="每页条目数 (默认: 30)")
+    parser.add_argument('--concurrency', type=int, default=4, help="并发请求的最大线程数 (默认: 4)")
+    parser.add_argument('--rate', type=float, default=2.0, help="初始每秒请求次数 (默认: 2.0)")
+    parser.add_argument('--max-rate', type=float, default=None, help="自适应调速的上限，次/秒 (默认: --rate 的 4 倍)")
+    parser.add_argument('--refresh', action='store_true', help="增量刷新：遇到全部已知的列表页即停止翻页")
+    add_http_arguments(parser)
+    add_telemetry_arguments(parser)
+    args = parser.parse_args()
+    start_telemetry(args)
+    configure_http(args)
+
+    harvest_all_urls(target_category=args.category, page_size=args.page_size,
+                     concurrency=args.concurrency, rate=args.rate, refresh=args.refresh,
+                     max_rate=args.max_rate)
@@ -0,0 +1,263 @@
+"""
+所有抓取脚本共用的 HTTP 客户端。
+
+new_session(pool_size) 返回配置好的会话，各脚本不再自己创建 requests.Session 或挂载 HTTPAdapter:
+
+- 连接池: 每个主机最多保持 pool_size 个空闲连接（与使用该会话的线程数一致），连接在各个文物之间
+  复用，开启 TCP keepalive，处理慢的阶段（如 OCR）期间空闲连接也不会被中间设备断开；
+- 重试: 只对建立连接失败（请求尚未发出）自动重试 CONNECT_RETRIES 次，其余错误仍由各脚本按端点退避处理；
+- 压缩: Accept-Encoding 协商 gzip/deflate，安装了 brotli（或 brotlicffi）时加上 br；
+- DNS 缓存: 域名解析结果在进程内缓存 --dns-ttl 秒，新建连接时不再每次解析；
+- 超时: 统一的 (连接, 读取) 超时，TIMEOUT 用于页面和接口，DOWNLOAD_TIMEOUT 用于验证码和图片下载；
+- HTTP/2 (--http2): 改用 httpx 的 HTTP/2 客户端（需安装 httpx[http2]），同一会话的各线程在一条连接上
+  多路复用。返回的对象与 requests.Session 接口兼容，网络错误同样抛出 requests.exceptions 中的异常。
+
+新建的连接数记录在指标 npm_http_connections_total{host} 中，用于确认连接确实被复用。
+"""
+import socket
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.util.retry import Retry
+
+from telemetry import REGISTRY
+
+try:
+    import httpx
+except ImportError:  # httpx 为可选依赖，只在 --http2 时需要
+    httpx = None
+
+try:
+    import brotli  # noqa: F401  urllib3 检测到后自动解码 br
+    HAS_BROTLI = True
+except ImportError:
+    try:
+        import brotlicffi  # noqa: F401
+        HAS_BROTLI = True
+    except ImportError:
+        HAS_BROTLI = False
+
+CONNECT_TIMEOUT = 10
+TIMEOUT = (CONNECT_TIMEOUT, 30)
+DOWNLOAD_TIMEOUT = (CONNECT_TIMEOUT, 60)
+CONNECT_RETRIES = 2
+DEFAULT_POOL_SIZE = 4
+# 会话池内同时连接的主机数；所有请求都发往同一个站点，留一些余量即可
+POOL_HOSTS = 4
+DNS_TTL = 300.0
+ACCEPT_ENCODING = 'gzip, deflate, br' if HAS_BROTLI else 'gzip, deflate'
+SOCKET_OPTIONS = HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+
+HTTP_CONNECTIONS = REGISTRY.counter('npm_http_connections_total', "新建的 HTTP 连接数（按主机，即解析域名的次数）",
+                                    ['host'])
+DNS_LOOKUPS = REGISTRY.counter('npm_dns_lookups_total', "域名解析: hit / miss", ['result'])
+
+# 由 configure_http() 按命令行参数设置
+_options = {'http2': False, 'dns_ttl': DNS_TTL}
+_default_session = None
+_default_lock = threading.Lock()
+
+
+class _CachingResolver:
+    """替换 socket.getaddrinfo，把解析结果缓存 ttl 秒；同时统计新建连接的次数。"""
+
+    def __init__(self, getaddrinfo):
+        self._getaddrinfo = getaddrinfo
+        self._cache = {}
+        self._lock = threading.Lock()
+        self.ttl = DNS_TTL
+
+    def __call__(self, host, port, family=0, type=0, proto=0, flags=0):
+        HTTP_CONNECTIONS.inc(host=host if isinstance(host, str) else repr(host))
+        if self.ttl <= 0:
+            return self._getaddrinfo(host, port, family, type, proto, flags)
+        key = (host, port, family, type, proto, flags)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(key)
+        if cached and cached[0] > now:
+            DNS_LOOKUPS.inc(result='hit')
+            return list(cached[1])
+        DNS_LOOKUPS.inc(result='miss')
+        # 解析失败时直接抛出，不缓存
+        result = self._getaddrinfo(host, port, family, type, proto, flags)
+        with self._lock:
+            self._cache[key] = (now + self.ttl, result)
+        return list(result)
+
+
+def _install_resolver():
+    resolver = socket.getaddrinfo
+    if not isinstance(resolver, _CachingResolver):
+        resolver = socket.getaddrinfo = _CachingResolver(socket.getaddrinfo)
+    resolver.ttl = _options['dns_ttl']
+
+
+def _default_headers(headers):
+    result = {'Accept-Encoding': ACCEPT_ENCODING}
+    result.update(headers or {})
+    return result
+
+
+class _PooledAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['socket_options'] = SOCKET_OPTIONS
+        super().init_poolmanager(*args, **kwargs)
+
+
+def _requests_session(pool_size, headers):
+    session = requests.Session()
+    retries = Retry(total=CONNECT_RETRIES, connect=CONNECT_RETRIES, read=0, status=0, redirect=5,
+                    backoff_factor=0.2, raise_on_status=False)
+    adapter = _PooledAdapter(pool_connections=POOL_HOSTS, pool_maxsize=pool_size, max_retries=retries)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update(_default_headers(headers))
+    return session
+
+
+def _httpx_timeout(timeout):
+    if timeout is None:
+        return httpx.USE_CLIENT_DEFAULT
+    if isinstance(timeout, tuple):
+        connect, read = timeout
+        return httpx.Timeout(read, connect=connect)
+    return httpx.Timeout(timeout)
+
+
+def _translate(error):
+    """把 httpx 的异常转换为 requests.exceptions 中对应的异常，调用方只需处理一种。"""
+    if isinstance(error, httpx.TimeoutException):
+        return requests.exceptions.Timeout(str(error))
+    if isinstance(error, httpx.TransportError):
+        return requests.exceptions.ConnectionError(str(error))
+    return requests.exceptions.RequestException(str(error))
+
+
+class Http2Response:
+    """以 requests.Response 的接口包装 httpx.Response（只包含本项目用到的部分）。"""
+
+    def __init__(self, response):
+        self._response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.url = str(response.url)
+
+    @property
+    def content(self):
+        return self._response.read()
+
+    @property
+    def text(self):
+        self._response.read()
+        return self._response.text
+
+    def json(self):
+        self._response.read()
+        return self._response.json()
+
+    def iter_content(self, chunk_size=None):
+        try:
+            yield from self._response.iter_bytes(chunk_size)
+        except httpx.HTTPError as e:
+            raise _translate(e) from e
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+    def close(self):
+        self._response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Http2Session:
+    """
+    以 requests.Session 的接口包装 httpx.Client(http2=True)，可直接交给 throttled_request、
+    stream_to_file 和 ResponseCache.fetch 使用。Cookie 保存在各自的会话中，与 requests.Session 相同。
+    单个请求的 proxies 参数被忽略，不使用代理（本项目传入 proxies 只是为了禁用代理）。
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, headers=None):
+        if httpx is None:
+            raise ImportError("HTTP/2 需要先安装 httpx: pip install 'httpx[http2]'")
+        limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        transport = httpx.HTTPTransport(http2=True, limits=limits, retries=CONNECT_RETRIES,
+                                        socket_options=SOCKET_OPTIONS)
+        self._client = httpx.Client(transport=transport, headers=_default_headers(headers), follow_redirects=True,
+                                    timeout=_httpx_timeout(TIMEOUT))
+        self.headers = self._client.headers
+        self.cookies = self._client.cookies
+
+    def request(self, method, url, params=None, data=None, json=None, headers=None, timeout=None, proxies=None,
+                stream=False):
+        content = None
+        if isinstance(data, (str, bytes)):
+            content, data = data, None
+        try:
+            request = self._client.build_request(method, url, params=params, data=data, content=content, json=json,
+                                                 headers=headers, timeout=_httpx_timeout(timeout))
+            response = self._client.send(request, stream=stream)
+        except httpx.HTTPError as e:
+            raise _translate(e) from e
+        return Http2Response(response)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def close(self):
+        self._client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def new_session(pool_size=DEFAULT_POOL_SIZE, headers=None):
+    """
+    创建一个会话。pool_size 为同时使用该会话的线程数；headers 为每个请求都带上的默认请求头。
+    按 configure_http() 的设置返回 requests.Session 或 Http2Session。
+    """
+    _install_resolver()
+    if _options['http2']:
+        return Http2Session(pool_size, headers)
+    return _requests_session(pool_size, headers)
+
+
+def default_session():
+    """进程内共享的会话，供没有传入会话的调用方使用，连接在多次调用之间复用。"""
+    global _default_session
+    with _default_lock:
+        if _default_session is None:
+            _default_session = new_session()
+        return _default_session
+
+
+def add_http_arguments(parser):
+    """添加 HTTP 客户端的命令行参数，各抓取脚本共用。"""
+    group = parser.add_argument_group("HTTP 连接")
+    group.add_argument('--http2', action='store_true', help="使用 HTTP/2 多路复用（需安装 httpx[http2]）")
+    group.add_argument('--dns-ttl', type=float, default=DNS_TTL,
+                       help=f"域名解析结果的缓存秒数，0 表示不缓存 (默认: {DNS_TTL:g})")
+    return group
+
+
+def configure_http(args):
+    """按命令行参数设置之后创建的所有会话。"""
+    if args.http2 and httpx is None:
+        raise ImportError("HTTP/2 需要先安装 httpx: pip install 'httpx[http2]'")
+    _options['http2'] = args.http2
+    _options['dns_ttl'] = args.dns_ttl
@@ -0,0 +1,83 @@
+"""
+Persistent index for incremental image analysis.
+
+Each analyzed file is stored under its path relative to the analyzed root together with the
+(size, mtime_ns) it had when it was probed. On the next run a file whose size and mtime are
+unchanged is not opened again; only new or modified files are probed, and rows for files that
+no longer exist are dropped. The full report is then emitted straight from the index.
+"""
+import json
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    relpath TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    size_kb REAL,
+    metrics TEXT
+);
+"""
+
+
+class ImageIndex:
+    """
+    SQLite index of (relpath, size, mtime_ns) -> (width, height, size KB, extra metrics).
+
+    Not thread-safe: the scan and all writes happen on the thread that owns the index,
+    worker pools only probe files.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        # Paths seen during the current scan; everything else is deleted by remove_unseen()
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS seen (relpath TEXT PRIMARY KEY)")
+
+    def is_current(self, relpath, size, mtime_ns, need_metrics=False):
+        """
+        Records relpath as seen and returns whether its indexed entry is still up to date.
+        With need_metrics an entry without metrics is treated as out of date.
+        """
+        self.conn.execute("INSERT OR IGNORE INTO seen (relpath) VALUES (?)", (relpath,))
+        row = self.conn.execute("SELECT size, mtime_ns, metrics FROM images WHERE relpath = ?", (relpath,)).fetchone()
+        return (row is not None and row[0] == size and row[1] == mtime_ns
+                and not (need_metrics and row[2] is None))
+
+    def upsert(self, relpath, size, mtime_ns, width, height, size_kb, metrics=None):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO images (relpath, size, mtime_ns, width, height, size_kb, metrics) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (relpath, size, mtime_ns, width, height, size_kb,
+             json.dumps(metrics, ensure_ascii=False) if metrics is not None else None))
+
+    def discard(self, relpath):
+        """Drops a file that could not be probed, so it is retried on the next run."""
+        self.conn.execute("DELETE FROM images WHERE relpath = ?", (relpath,))
+
+    def remove_unseen(self):
+        """Deletes rows for files that were not seen during this scan. Returns the number removed."""
+        cursor = self.conn.execute("DELETE FROM images WHERE relpath NOT IN (SELECT relpath FROM seen)")
+        self.conn.execute("DELETE FROM seen")
+        return cursor.rowcount
+
+    def commit(self):
+        self.conn.commit()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def iter_rows(self):
+        """Yields (relpath, width, height, size_kb, metrics) ordered by path."""
+        for relpath, width, height, size_kb, metrics in self.conn.execute(
+                "SELECT relpath, width, height, size_kb, metrics FROM images ORDER BY relpath"):
+            yield relpath, width, height, size_kb, json.loads(metrics) if metrics else None
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
@@ -0,0 +1,156 @@
+"""
+Image quality metrics for dataset curation.
+
+Each image is decoded at reduced scale (JPEG draft mode lets libjpeg decode directly at
+1/2, 1/4 or 1/8 size) and resized to a fixed SAMPLE_SIZE square, so a whole batch can be
+stacked into one array and every metric is computed with vectorized NumPy over the batch:
+
+- sharpness: variance of the 4-neighbour Laplacian of the luminance (low = blurry)
+- brightness / contrast: mean and standard deviation of the luminance
+- dark_clip / bright_clip: percentage of pixels at the ends of the luminance histogram
+- entropy: Shannon entropy of the 256-bin luminance histogram
+- mean_r/g/b, std_r/g/b: per-channel statistics
+- phash: 64-bit DCT perceptual hash as 16 hex digits
+
+Metrics are relative measures at the sample scale, meant for ranking and filtering bad scans.
+"""
+import numpy as np
+from PIL import Image
+
+SAMPLE_SIZE = 256
+HASH_SIZE = 32
+DARK_LEVEL = 5
+BRIGHT_LEVEL = 250
+
+METRIC_COLUMNS = [
+    ('sharpness', 'Sharpness'),
+    ('brightness', 'Brightness'),
+    ('contrast', 'Contrast'),
+    ('dark_clip', 'Dark Clip (%)'),
+    ('bright_clip', 'Bright Clip (%)'),
+    ('entropy', 'Entropy'),
+    ('mean_r', 'Mean R'), ('mean_g', 'Mean G'), ('mean_b', 'Mean B'),
+    ('std_r', 'Std R'), ('std_g', 'Std G'), ('std_b', 'Std B'),
+    ('phash', 'pHash'),
+]
+
+LUMA_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def _dct_matrix(n):
+    """Orthonormal DCT-II matrix, so D @ X @ D.T is the 2-D DCT of X."""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.sqrt(2.0 / n) * np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+    matrix[0] /= np.sqrt(2.0)
+    return matrix.astype(np.float32)
+
+
+DCT_MATRIX = _dct_matrix(HASH_SIZE)
+
+
+def load_sample(file_path):
+    """Decodes an image at reduced scale. Returns (RGB array SAMPLE_SIZE^2 x 3, grayscale HASH_SIZE^2 array)."""
+    with Image.open(file_path) as img:
+        # Only JPEG supports draft mode; other formats ignore it and are decoded at full size
+        img.draft('RGB', (SAMPLE_SIZE, SAMPLE_SIZE))
+        rgb = img.convert('RGB').resize((SAMPLE_SIZE, SAMPLE_SIZE), Image.BILINEAR)
+    gray = rgb.convert('L').resize((HASH_SIZE, HASH_SIZE), Image.BILINEAR)
+    return np.asarray(rgb, dtype=np.uint8), np.asarray(gray, dtype=np.float32)
+
+
+def phash_batch(grays):
+    """Computes 64-bit perceptual hashes for a (B, 32, 32) batch of grayscale samples."""
+    # Only the 8x8 lowest frequencies are needed, so only the first 8 DCT basis rows are applied
+    basis = DCT_MATRIX[:8]
+    low = (basis @ grays @ basis.T).reshape(len(grays), 64)
+    # The DC term is kept in the hash but excluded from the median
+    bits = low > np.median(low[:, 1:], axis=1, keepdims=True)
+    weights = np.left_shift(np.uint64(1), np.arange(63, -1, -1, dtype=np.uint64))
+    return [f"{int(value):016x}" for value in (bits.astype(np.uint64) * weights).sum(axis=1, dtype=np.uint64)]
+
+
+def metrics_batch(samples, grays):
+    """
+    Computes the metrics for a batch.
+
+    Args:
+        samples (np.ndarray): (B, SAMPLE_SIZE, SAMPLE_SIZE, 3) uint8 RGB samples.
+        grays (np.ndarray): (B, HASH_SIZE, HASH_SIZE) float32 grayscale samples for the hash.
+
+    Returns:
+        list[dict]: One metrics dict per image.
+    """
+    batch = len(samples)
+    rgb = samples.astype(np.float32)
+    luma = rgb @ LUMA_WEIGHTS
+
+    laplacian = (luma[:, :-2, 1:-1] + luma[:, 2:, 1:-1] + luma[:, 1:-1, :-2] + luma[:, 1:-1, 2:]
+                 - 4 * luma[:, 1:-1, 1:-1])
+    sharpness = laplacian.var(axis=(1, 2))
+
+    levels = np.clip(luma, 0, 255).astype(np.int64).reshape(batch, -1)
+    # One bincount for the whole batch: offset each image's levels into its own 256-bin range
+    hist = np.bincount((levels + 256 * np.arange(batch)[:, None]).ravel(),
+                       minlength=256 * batch).reshape(batch, 256).astype(np.float64)
+    prob = hist / levels.shape[1]
+    entropy = -(prob * np.log2(np.where(prob > 0, prob, 1))).sum(axis=1)
+    entropy[entropy == 0] = 0  # avoid -0.0 for flat images
+    dark_clip = prob[:, :DARK_LEVEL + 1].sum(axis=1) * 100
+    bright_clip = prob[:, BRIGHT_LEVEL:].sum(axis=1) * 100
+
+    # Per-channel sums as (B, N, 3) reductions; much faster than reducing over the strided image axes
+    pixels = rgb.reshape(batch, -1, 3)
+    count = pixels.shape[1]
+    channel_mean = pixels.sum(axis=1, dtype=np.float64) / count
+    channel_sq = np.einsum('bnc,bnc->bc', pixels, pixels, dtype=np.float64) / count
+    channel_std = np.sqrt(np.maximum(channel_sq - channel_mean ** 2, 0))
+    brightness = luma.mean(axis=(1, 2))
+    contrast = luma.std(axis=(1, 2))
+    hashes = phash_batch(grays)
+
+    results = []
+    for b in range(batch):
+        results.append({
+            'sharpness': round(float(sharpness[b]), 2),
+            'brightness': round(float(brightness[b]), 2),
+            'contrast': round(float(contrast[b]), 2),
+            'dark_clip': round(float(dark_clip[b]), 3),
+            'bright_clip': round(float(bright_clip[b]), 3),
+            'entropy': round(float(entropy[b]), 3),
+            'mean_r': round(float(channel_mean[b, 0]), 2),
+            'mean_g': round(float(channel_mean[b, 1]), 2),
+            'mean_b': round(float(channel_mean[b, 2]), 2),
+            'std_r': round(float(channel_std[b, 0]), 2),
+            'std_g': round(float(channel_std[b, 1]), 2),
+            'std_b': round(float(channel_std[b, 2]), 2),
+            'phash': hashes[b],
+        })
+    return results
+
+
+def compute_metrics(file_paths):
+    """
+    Loads and measures a list of files.
+
+    Returns:
+        tuple: ({file_path: metrics dict}, [(file_path, error message)]).
+    """
+    loaded, samples, grays, errors = [], [], [], []
+    for file_path in file_paths:
+        try:
+            sample, gray = load_sample(file_path)
+        except Exception as e:
+            errors.append((file_path, str(e)))
+            continue
+        loaded.append(file_path)
+        samples.append(sample)
+        grays.append(gray)
+    if not loaded:
+        return {}, errors
+    return dict(zip(loaded, metrics_batch(np.stack(samples), np.stack(grays)))), errors
+
+
+def metrics_to_columns(metrics):
+    """Flattens a metrics dict (or None) into CSV cells in METRIC_COLUMNS order."""
+    return [metrics.get(key, '') if metrics else '' for key, _ in METRIC_COLUMNS]
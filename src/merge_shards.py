@@ -0,0 +1,166 @@
+"""
+合并各分片主机（见 sharding.py）的爬取结果到本项目的 output/。
+
+每个参数是一台主机的 output/ 目录（或包含 output/ 的项目目录），依次：
+1. 合并状态库 crawl_state.sqlite，同一文物的各状态取 done > failed > pending 中较好的一方；
+2. 把分片的元数据（metadata_json/ 和 metadata_store/，存在哪个读哪个）写入 --store 指定的存储；
+3. 把图片目录 taipei_museum_artifacts/ 和 main_images/ 以硬链接（跨文件系统时复制）合并进来，
+   已存在的同名文件保持不变，大小不同时列为冲突；
+4. 由合并后的元数据存储重新生成 metadata.csv，每个文物一行，按 UniqueID 排序。
+
+合并前根据各分片 output/ 中的 shard.json 检查分片数是否一致、是否有缺少或重复的分片。
+响应缓存、Parquet 数据集和全文检索索引不合并，需要时在合并后重新生成。
+
+用法:
+    python src/merge_shards.py /mnt/host1/output /mnt/host2/output /mnt/host3/output
+    python src/merge_shards.py shards/* --store segments --allow-partial
+"""
+import os
+import sys
+import argparse
+
+from tqdm import tqdm
+
+from crawl_state import CrawlState, default_state_path
+from metadata_store import STORE_KINDS, JsonDirStore, SegmentStore, copy_records, open_store
+from scrape_metadata import rebuild_csv
+from sharding import SHARD_MARKER, read_shard_marker
+from stream_download import link_or_copy
+
+# 需要合并的图片目录（相对 output/）
+IMAGE_DIRS = ('taipei_museum_artifacts', 'main_images')
+
+
+def shard_output_dir(path):
+    """参数可以是 output/ 目录本身，也可以是包含 output/ 的项目目录。"""
+    nested = os.path.join(path, 'output')
+    return nested if os.path.isdir(nested) and not os.path.exists(os.path.join(path, SHARD_MARKER)) else path
+
+
+def check_shards(output_dirs):
+    """
+    检查各分片的 shard.json，返回问题列表（为空表示分片齐全）。
+    没有 shard.json 的目录（未分片运行的结果）照样可以合并，只是无法检查。
+    """
+    problems = []
+    seen = {}
+    for output_dir in output_dirs:
+        shard = read_shard_marker(output_dir)
+        if shard is None:
+            problems.append(f"'{output_dir}' 中没有 {SHARD_MARKER}，无法确认它属于哪个分片")
+        elif shard in seen:
+            problems.append(f"分片 {shard} 出现了两次: '{seen[shard]}' 和 '{output_dir}'")
+        else:
+            seen[shard] = output_dir
+    counts = {shard.count for shard in seen}
+    if len(counts) > 1:
+        problems.append("各分片的总数 N 不一致: " + ", ".join(sorted(str(shard) for shard in seen)))
+    elif counts:
+        count = counts.pop()
+        missing = sorted(set(range(1, count + 1)) - {shard.index for shard in seen})
+        if missing:
+            problems.append("缺少分片: " + ", ".join(f"{index}/{count}" for index in missing))
+    return problems
+
+
+def shard_stores(output_dir):
+    """打开分片 output/ 中已存在的元数据存储（不创建新的目录）。"""
+    stores = []
+    if os.path.isdir(os.path.join(output_dir, 'metadata_json')):
+        stores.append(JsonDirStore(os.path.join(output_dir, 'metadata_json')))
+    if os.path.isdir(os.path.join(output_dir, 'metadata_store')):
+        stores.append(SegmentStore(os.path.join(output_dir, 'metadata_store')))
+    return stores
+
+
+def merge_image_tree(source_root, target_root):
+    """
+    把 source_root 下的文件以相同的相对路径合并到 target_root。
+    返回 (新增文件数, 已存在的文件数, 冲突的相对路径列表)。
+    """
+    added, existing, conflicts = 0, 0, []
+    for dirpath, _, filenames in os.walk(source_root):
+        relative_dir = os.path.relpath(dirpath, source_root)
+        target_dir = os.path.normpath(os.path.join(target_root, relative_dir))
+        for filename in filenames:
+            # 中断时留下的未完成下载不合并
+            if filename.endswith('.part'):
+                continue
+            source_path = os.path.join(dirpath, filename)
+            target_path = os.path.join(target_dir, filename)
+            if os.path.exists(target_path):
+                if os.path.getsize(target_path) == os.path.getsize(source_path):
+                    existing += 1
+                else:
+                    conflicts.append(os.path.join(relative_dir, filename))
+                continue
+            os.makedirs(target_dir, exist_ok=True)
+            link_or_copy(source_path, target_path)
+            added += 1
+    return added, existing, conflicts
+
+
+def merge_shards(shard_dirs, project_root, store_kind='json'):
+    """把 shard_dirs 中各分片的 output/ 合并到 project_root/output/，返回统计信息。"""
+    output_dir = os.path.join(project_root, 'output')
+    summary = {"artifacts_added": 0, "image_records": 0, "metadata_records": 0,
+               "images_added": 0, "images_existing": 0, "conflicts": []}
+    state = CrawlState(default_state_path())
+    with open_store(store_kind, project_root) as store:
+        for shard_dir in shard_dirs:
+            print(f"\n合并 '{shard_dir}' ...")
+            db_path = os.path.join(shard_dir, 'crawl_state.sqlite')
+            if os.path.exists(db_path):
+                added, images = state.merge_from(db_path)
+                summary["artifacts_added"] += added
+                summary["image_records"] += images
+                print(f"状态库: 新增 {added} 个文物，新增或更新 {images} 条图片记录。")
+            for source in shard_stores(shard_dir):
+                with source:
+                    summary["metadata_records"] += copy_records(source, store, "合并元数据")
+            for name in IMAGE_DIRS:
+                source_root = os.path.join(shard_dir, name)
+                if not os.path.isdir(source_root):
+                    continue
+                added, existing, conflicts = merge_image_tree(source_root, os.path.join(output_dir, name))
+                summary["images_added"] += added
+                summary["images_existing"] += existing
+                summary["conflicts"] += [os.path.join(shard_dir, name, path) for path in conflicts]
+                print(f"{name}/: 新增 {added} 个文件，{existing} 个已存在，{len(conflicts)} 个冲突。")
+        summary["csv_rows"] = rebuild_csv(store, os.path.join(output_dir, 'metadata.csv'))
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="把各分片主机的 output/ 合并到本项目的 output/。")
+    parser.add_argument('shard_dirs', nargs='+', help="各分片的 output/ 目录（或包含 output/ 的项目目录）")
+    parser.add_argument('--store', choices=STORE_KINDS, default='json', help="合并到哪种元数据存储 (默认: json)")
+    parser.add_argument('--allow-partial', action='store_true', help="分片不齐全或缺少 shard.json 时仍然合并")
+    args = parser.parse_args()
+
+    # --- 动态路径处理 ---
+    SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+    PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+    OUTPUT_DIR = os.path.join(PROJECT_ROOT, 'output')
+    # ---
+
+    shard_dirs = [shard_output_dir(os.path.abspath(path)) for path in args.shard_dirs]
+    if any(os.path.samefile(path, OUTPUT_DIR) for path in shard_dirs
+           if os.path.exists(path) and os.path.exists(OUTPUT_DIR)):
+        parser.error("分片目录不能是本项目的 output/ 本身")
+    problems = check_shards(shard_dirs)
+    for problem in problems:
+        print(f"警告: {problem}")
+    if problems and not args.allow_partial:
+        print("已停止。确认无误后可加上 --allow-partial 继续合并。")
+        sys.exit(1)
+
+    summary = merge_shards(shard_dirs, PROJECT_ROOT, args.store)
+    print(f"\n合并完成: 新增 {summary['artifacts_added']} 个文物记录，合并 {summary['metadata_records']} 条元数据，"
+          f"新增 {summary['images_added']} 个图片文件。")
+    print(f"元数据CSV已重新生成: '{os.path.join(OUTPUT_DIR, 'metadata.csv')}'，共 {summary['csv_rows']} 行。")
+    if summary['conflicts']:
+        print(f"\n以下 {len(summary['conflicts'])} 个文件与本地已有的同名文件大小不同，未覆盖:")
+        for path in summary['conflicts']:
+            print(f"  {path}")
+    print("如需更新 Parquet 数据集或全文检索索引，请重新运行 metadata_export.py / metadata_search.py build。")
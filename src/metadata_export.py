@@ -0,0 +1,178 @@
+"""
+元数据的列式导出（Parquet）。
+
+metadata.csv 把 題跋資料、印記資料 等嵌套区块存成 JSON 字符串，分析时要么逐个读取 metadata_json/ 下的
+JSON 文件，要么再解析一遍 CSV 里的 JSON。这里把元数据按固定的嵌套 schema 写成 Parquet：
+
+- 基本資料、參考資料: map<string, list<string>>，同名字段出现多次时保留全部取值；
+- 典藏尺寸、質地、印記資料、主題、技法: list<map<string, string>>，每个元素为表格的一行；
+- 題跋資料: list<struct<欄位: map<string, string>, 印記資料: list<map<string, string>>>>；
+- 保存維護: struct<說明: string, 相關連結: list<struct<文本, onclick>>>。
+
+写入是流式的：每攒够 row_group_size 行就写出一个 row group，内存占用与文物总数无关。
+输出是一个目录（Parquet 数据集），每次抓取写一个新的 part 文件，从元数据存储重建时整体替换。
+只读取需要的列:
+
+    pq.read_table('output/metadata_parquet', columns=['UniqueID', '題跋資料'])
+
+用法（从元数据存储重建整个数据集）:
+    python src/metadata_export.py
+    python src/metadata_export.py --store segments
+"""
+import os
+import sys
+import time
+import argparse
+
+from tqdm import tqdm
+
+from metadata_store import STORE_KINDS, open_store
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow 为可选依赖
+    pa = pq = None
+
+ROW_GROUP_SIZE = 1000
+TABLE_SECTIONS = ["典藏尺寸", "質地", "印記資料", "主題", "技法"]
+KEY_VALUE_SECTIONS = ["基本資料", "參考資料"]
+
+
+def _schema():
+    row = pa.map_(pa.string(), pa.string())
+    key_value = pa.map_(pa.string(), pa.list_(pa.string()))
+    inscription = pa.struct([('欄位', row), ('印記資料', pa.list_(row))])
+    link = pa.struct([('文本', pa.string()), ('onclick', pa.string())])
+    return pa.schema([
+        ('UniqueID', pa.string()),
+        ('URL', pa.string()),
+        ('文物名称', pa.string()),
+        ('基本資料', key_value),
+        ('典藏尺寸', pa.list_(row)),
+        ('質地', pa.list_(row)),
+        ('題跋資料', pa.list_(inscription)),
+        ('印記資料', pa.list_(row)),
+        ('主題', pa.list_(row)),
+        ('技法', pa.list_(row)),
+        ('參考資料', key_value),
+        ('保存維護', pa.struct([('說明', pa.string()), ('相關連結', pa.list_(link))])),
+    ])
+
+
+SCHEMA = _schema() if pa else None
+
+
+def _rows(value):
+    # 页面上不存在的区块被解析为空字典，统一视为空表
+    return [list(row.items()) for row in value] if isinstance(value, list) else []
+
+
+def metadata_to_record(metadata):
+    """把 scrape_metadata 解析出的元数据字典转换为符合 SCHEMA 的一行。"""
+    record = {key: metadata.get(key) for key in ('UniqueID', 'URL', '文物名称')}
+    for section in KEY_VALUE_SECTIONS:
+        record[section] = [(key, value if isinstance(value, list) else [value])
+                           for key, value in (metadata.get(section) or {}).items()]
+    for section in TABLE_SECTIONS:
+        record[section] = _rows(metadata.get(section))
+    inscriptions = metadata.get('題跋資料')
+    record['題跋資料'] = [{
+        '欄位': [(key, value) for key, value in row.items() if key != '印記資料'],
+        '印記資料': _rows(row.get('印記資料')),
+    } for row in (inscriptions if isinstance(inscriptions, list) else [])]
+    conservation = metadata.get('保存維護') or {}
+    record['保存維護'] = {'說明': conservation.get('說明'), '相關連結': conservation.get('相關連結') or []}
+    return record
+
+
+class ParquetExporter:
+    """
+    把元数据流式写入 Parquet 数据集目录 dataset_dir 下的一个新 part 文件。
+
+    文件先以 "." 开头的临时名写入（读取数据集时会被忽略），close() 时才改为正式文件名。
+    replace 为 True 时，close() 会同时删除目录中已有的 part 文件，即整体替换数据集。
+    只应由写入线程调用，不需要加锁。
+    """
+
+    def __init__(self, dataset_dir, replace=False, row_group_size=ROW_GROUP_SIZE):
+        if pa is None:
+            raise ImportError("Parquet 导出需要先安装 pyarrow: pip install pyarrow")
+        os.makedirs(dataset_dir, exist_ok=True)
+        self.dataset_dir = dataset_dir
+        self.replace = replace
+        self.row_group_size = row_group_size
+        name = f"part-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.parquet"
+        self.path = os.path.join(dataset_dir, name)
+        self._tmp_path = os.path.join(dataset_dir, f".{name}.tmp")
+        self._writer = pq.ParquetWriter(self._tmp_path, SCHEMA, compression='zstd')
+        self._buffer = []
+        self.count = 0
+
+    def write(self, metadata):
+        self._buffer.append(metadata_to_record(metadata))
+        if len(self._buffer) >= self.row_group_size:
+            self._flush()
+
+    def _flush(self):
+        if self._buffer:
+            self._writer.write_table(pa.Table.from_pylist(self._buffer, schema=SCHEMA))
+            self.count += len(self._buffer)
+            self._buffer = []
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+        if self.count == 0 and not self.replace:
+            os.remove(self._tmp_path)
+            return
+        if self.replace:
+            for name in os.listdir(self.dataset_dir):
+                if name.endswith('.parquet'):
+                    os.remove(os.path.join(self.dataset_dir, name))
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        """放弃本次写入，已有的数据集保持不变。"""
+        self._writer.close()
+        os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # 抓取中断时已写出的 row group 仍然有效，只有整体替换数据集的重建才需要放弃
+        if exc_type is not None and self.replace:
+            self.abort()
+        else:
+            self.close()
+
+
+def rebuild_from_store(store, dataset_dir, row_group_size=ROW_GROUP_SIZE):
+    """用元数据存储 (metadata_store) 中的所有文物重建整个 Parquet 数据集。返回写入的文物数。"""
+    with ParquetExporter(dataset_dir, replace=True, row_group_size=row_group_size) as exporter:
+        for metadata in tqdm(store, total=len(store), desc="导出Parquet", unit="个"):
+            exporter.write(metadata)
+    return exporter.count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="从元数据存储重建 Parquet 格式的元数据数据集。")
+    parser.add_argument('--store', choices=STORE_KINDS, default='json',
+                        help="读取的元数据存储: json 为 output/metadata_json/，segments 为 output/metadata_store/ (默认: json)")
+    parser.add_argument('--row-group-size', type=int, default=ROW_GROUP_SIZE,
+                        help=f"每个 row group 的文物数 (默认: {ROW_GROUP_SIZE})")
+    args = parser.parse_args()
+
+    # --- 动态路径处理 ---
+    SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+    PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+    DATASET_DIR = os.path.join(PROJECT_ROOT, 'output', 'metadata_parquet')
+    # ---
+
+    with open_store(args.store, PROJECT_ROOT) as store:
+        if len(store) == 0:
+            print(f"错误: 元数据存储 '{store.path}' 中没有任何文物。请先运行 src/scrape_metadata.py")
+            sys.exit(1)
+        count = rebuild_from_store(store, DATASET_DIR, args.row_group_size)
+    print(f"已导出 {count} 个文物的元数据至: {DATASET_DIR}")
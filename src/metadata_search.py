@@ -0,0 +1,308 @@
+"""
+元数据全文检索。
+
+倒排索引使用 SQLite FTS5（output/search_index.sqlite），排序使用 FTS5 自带的 BM25。FTS5 的内置分词器
+不能切分中文，因此写入前先自行分词：连续的汉字切成重叠的二元组（"乾隆御覽" -> 乾隆 隆御 御覽 覽，
+末字单独保留，使单字查询也能用前缀匹配命中），其他文字按单词切分并转为小写。查询词按同样的规则切分后
+作为短语匹配，相邻的二元组必须连续出现，因此不会误命中被拆开的词。
+
+可检索的字段（查询时用 "字段:词" 限定，字段名可用中文或英文别名）:
+    文物名称 (title)、作者 (author)、基本資料 (basic)、題跋資料 (inscription)、印記資料 (seal)、
+    主題 (subject)、參考資料 (reference)
+作者字段收集 基本資料 和 題跋資料 中的作者；題跋中附带的印記也计入 印記資料。
+
+用法:
+    python src/metadata_search.py build                     # 从元数据存储重建索引
+    python src/metadata_search.py query 印記資料:乾隆 雪山   # 多个词之间为"与"关系
+    python src/metadata_search.py serve --port 8000          # GET /search?q=...&limit=20 返回 JSON
+"""
+import os
+import re
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from tqdm import tqdm
+
+from metadata_store import STORE_KINDS, open_store
+
+# (FTS 列名, 中文字段名, BM25 权重)
+FIELDS = [
+    ('title', '文物名称', 5.0),
+    ('author', '作者', 3.0),
+    ('basic', '基本資料', 1.0),
+    ('inscription', '題跋資料', 2.0),
+    ('seal', '印記資料', 2.0),
+    ('subject', '主題', 2.0),
+    ('reference', '參考資料', 0.5),
+]
+FIELD_ALIASES = {name: column for column, name, _ in FIELDS}
+FIELD_ALIASES.update({column: column for column, _, _ in FIELDS})
+COMMIT_INTERVAL = 200
+
+CJK_RUN = r'[㐀-䶿一-鿿豈-﫿\U00020000-\U0002ebef]+'
+TOKEN_RE = re.compile(rf'({CJK_RUN})|([^\W_]+)')
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS docs (
+    id INTEGER PRIMARY KEY,
+    unique_id TEXT UNIQUE NOT NULL,
+    title TEXT,
+    url TEXT
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS fts USING fts5({', '.join(column for column, _, _ in FIELDS)}, detail=full);
+"""
+
+
+def tokenize(text):
+    """把文本切分为索引词：汉字为重叠二元组加末字，其他文字为小写单词。"""
+    tokens = []
+    for match in TOKEN_RE.finditer(text or ''):
+        run = match.group(1)
+        if run:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+            tokens.append(run[-1])
+        else:
+            tokens.append(match.group(2).lower())
+    return tokens
+
+
+def _values(value):
+    if isinstance(value, dict):
+        for item in value.values():
+            yield from _values(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _values(item)
+    elif value:
+        yield str(value)
+
+
+def metadata_to_fields(metadata):
+    """从元数据中提取各检索字段的原始文本。"""
+    basic = metadata.get('基本資料') or {}
+    inscriptions = metadata.get('題跋資料')
+    inscriptions = inscriptions if isinstance(inscriptions, list) else []
+    authors = [value for key, value in basic.items() if '作者' in key]
+    authors += [row.get('作者') for row in inscriptions]
+    seals = [metadata.get('印記資料')] + [row.get('印記資料') for row in inscriptions]
+    return {
+        'title': [metadata.get('文物名称')],
+        'author': authors,
+        'basic': [basic],
+        'inscription': [{key: value for key, value in row.items() if key != '印記資料'} for row in inscriptions],
+        'seal': seals,
+        'subject': [metadata.get('主題')],
+        'reference': [metadata.get('參考資料')],
+    }
+
+
+def term_expression(term):
+    """
+    把一个查询词转换为 FTS5 短语。
+
+    词尾的汉字串在文档中可能继续延伸，因此不使用它的末字词元；词尾只有单个汉字时按前缀匹配，
+    以便命中以该字开头的二元组。
+    """
+    matches = list(TOKEN_RE.finditer(term))
+    if not matches:
+        return None
+    tokens = tokenize(term)
+    last_run = matches[-1].group(1)
+    if last_run and len(last_run) > 1:
+        tokens.pop()
+    phrase = '"' + ' '.join(token.replace('"', '""') for token in tokens) + '"'
+    return phrase + '*' if last_run and len(last_run) == 1 else phrase
+
+
+def build_match(query):
+    """
+    把查询字符串转换为 FTS5 MATCH 表达式。
+
+    以空白分隔的各个词之间为"与"关系；"字段:词" 只在该字段中匹配。无法识别的字段名抛出 ValueError。
+    """
+    clauses = []
+    for term in query.split():
+        column = None
+        if ':' in term:
+            field, term = term.split(':', 1)
+            if field not in FIELD_ALIASES:
+                raise ValueError(f"未知的字段: {field}，可用字段: {', '.join(name for _, name, _ in FIELDS)}")
+            column = FIELD_ALIASES[field]
+        expression = term_expression(term)
+        if expression:
+            clauses.append(f"{column} : {expression}" if column else expression)
+    return ' AND '.join(clauses)
+
+
+class SearchIndex:
+    """
+    元数据的全文索引。write() 插入或更新一个文物，可以作为 scrape_metadata 的导出目标在抓取过程中增量更新。
+
+    写入只应由写入线程调用；HTTP 服务中的并发查询通过内部锁串行执行。
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._uncommitted = 0
+
+    def write(self, metadata):
+        fields = metadata_to_fields(metadata)
+        row = [' '.join(token for text in _values(fields[column]) for token in tokenize(text))
+               for column, _, _ in FIELDS]
+        with self._lock:
+            existing = self.conn.execute("SELECT id FROM docs WHERE unique_id = ?", (metadata['UniqueID'],)).fetchone()
+            if existing:
+                doc_id = existing[0]
+                self.conn.execute("DELETE FROM fts WHERE rowid = ?", (doc_id,))
+                self.conn.execute("UPDATE docs SET title = ?, url = ? WHERE id = ?",
+                                  (metadata.get('文物名称'), metadata.get('URL'), doc_id))
+            else:
+                doc_id = self.conn.execute("INSERT INTO docs (unique_id, title, url) VALUES (?, ?, ?)",
+                                           (metadata['UniqueID'], metadata.get('文物名称'), metadata.get('URL'))).lastrowid
+            self.conn.execute(f"INSERT INTO fts (rowid, {', '.join(column for column, _, _ in FIELDS)}) "
+                              f"VALUES (?, {', '.join('?' for _ in FIELDS)})", [doc_id] + row)
+            self._uncommitted += 1
+            if self._uncommitted >= COMMIT_INTERVAL:
+                self.conn.commit()
+                self._uncommitted = 0
+
+    def search(self, query, limit=20):
+        """返回按相关度排序的 [{UniqueID, 文物名称, URL, score}]，score 越大越相关。"""
+        match = build_match(query)
+        if not match:
+            return []
+        weights = ', '.join(str(weight) for _, _, weight in FIELDS)
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT docs.unique_id, docs.title, docs.url, bm25(fts, {weights}) AS rank "
+                f"FROM fts JOIN docs ON docs.id = fts.rowid WHERE fts MATCH ? ORDER BY rank, docs.id LIMIT ?",
+                (match, limit)).fetchall()
+        return [{'UniqueID': unique_id, '文物名称': title, 'URL': url, 'score': round(-rank, 4)}
+                for unique_id, title, url, rank in rows]
+
+    def clear(self):
+        with self._lock:
+            self.conn.execute("DELETE FROM fts")
+            self.conn.execute("DELETE FROM docs")
+
+    def optimize(self):
+        """合并 FTS5 的内部 b-tree 段，重建索引后执行可以加快查询。"""
+        with self._lock:
+            self.conn.execute("INSERT INTO fts (fts) VALUES ('optimize')")
+            self.conn.commit()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def default_index_path(project_root):
+    return os.path.join(project_root, 'output', 'search_index.sqlite')
+
+
+def rebuild_from_store(store, index):
+    """清空索引并用元数据存储中的所有文物重建。返回索引的文物数。"""
+    index.clear()
+    for metadata in tqdm(store, total=len(store), desc="建立检索索引", unit="个"):
+        index.write(metadata)
+    index.optimize()
+    return len(index)
+
+
+def make_handler(index):
+    class SearchHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path != '/search':
+                self.send_error(404)
+                return
+            params = parse_qs(url.query)
+            query = params.get('q', [''])[0]
+            try:
+                limit = int(params.get('limit', ['20'])[0])
+                start = time.perf_counter()
+                results = index.search(query, limit)
+                body = {'query': query, 'took_ms': round((time.perf_counter() - start) * 1000, 2), 'results': results}
+                status = 200
+            except (ValueError, sqlite3.OperationalError) as e:
+                body, status = {'error': str(e)}, 400
+            data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return SearchHandler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="文物元数据的全文检索。")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help="从元数据存储重建检索索引")
+    build_parser.add_argument('--store', choices=STORE_KINDS, default='json', help="读取的元数据存储 (默认: json)")
+    query_parser = subparsers.add_parser('query', help="检索并输出结果")
+    query_parser.add_argument('terms', nargs='+', help="检索词，可用 字段:词 限定字段")
+    query_parser.add_argument('--limit', type=int, default=20, help="最多返回的结果数 (默认: 20)")
+    serve_parser = subparsers.add_parser('serve', help="启动本地 HTTP 检索服务")
+    serve_parser.add_argument('--host', default='127.0.0.1', help="监听地址 (默认: 127.0.0.1)")
+    serve_parser.add_argument('--port', type=int, default=8000, help="监听端口 (默认: 8000)")
+    args = parser.parse_args()
+
+    # --- 动态路径处理 ---
+    SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+    PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+    INDEX_FILE = default_index_path(PROJECT_ROOT)
+    # ---
+
+    if args.command != 'build' and not os.path.exists(INDEX_FILE):
+        print("错误: 检索索引不存在。请先运行 python src/metadata_search.py build")
+        sys.exit(1)
+
+    with SearchIndex(INDEX_FILE) as index:
+        if args.command == 'build':
+            with open_store(args.store, PROJECT_ROOT) as store:
+                count = rebuild_from_store(store, index)
+            print(f"索引完成，共 {count} 个文物: {INDEX_FILE}")
+        elif args.command == 'query':
+            start = time.perf_counter()
+            try:
+                results = index.search(' '.join(args.terms), args.limit)
+            except ValueError as e:
+                print(f"错误: {e}")
+                sys.exit(1)
+            print(f"找到 {len(results)} 个结果，用时 {(time.perf_counter() - start) * 1000:.1f} ms。")
+            for result in results:
+                print(f"{result['score']:>8.3f}  {result['UniqueID']}  {result['文物名称']}  {result['URL']}")
+        elif args.command == 'serve':
+            server = ThreadingHTTPServer((args.host, args.port), make_handler(index))
+            print(f"检索服务已启动: http://{args.host}:{args.port}/search?q=乾隆")
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                server.server_close()
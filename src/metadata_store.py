@@ -0,0 +1,340 @@
+"""
+元数据存储后端。
+
+- JsonDirStore: 原有的布局，每个文物一个缩进的 artifact_{UniqueID}.json 文件；
+- SegmentStore: 只追加的压缩 JSON Lines 段文件。每条记录是一个独立的 gzip member（内容为一行紧凑的
+  JSON），按顺序追加到 segment-000001.jsonl.gz 等段文件中，段文件超过 SEGMENT_SIZE 后换新文件。
+  SQLite 索引记录每个 UniqueID 所在的段、偏移和长度，按 ID 读取只需一次 seek 加一次解压。
+  整个段文件仍是合法的 gzip 文件，可以直接 zcat 查看。
+
+同一文物再次写入时只追加新记录并更新索引，旧记录成为垃圾，由 compact 清理。
+
+用法:
+    python src/metadata_store.py import              # 把 metadata_json/ 导入段存储
+    python src/metadata_store.py export [目录]        # 从段存储导出为每个文物一个 JSON 文件的布局
+    python src/metadata_store.py compact             # 重写段文件，去掉被覆盖的旧记录
+    python src/metadata_store.py stats
+    python src/metadata_store.py get <UniqueID>
+"""
+import os
+import re
+import sys
+import json
+import zlib
+import sqlite3
+import argparse
+
+from tqdm import tqdm
+
+SEGMENT_SIZE = 64 * 1024 * 1024
+# 每写入这么多条记录提交一次索引；崩溃时未提交的尾部记录会在下次打开时从段文件恢复
+COMMIT_INTERVAL = 200
+STORE_KINDS = ('json', 'segments')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    unique_id TEXT PRIMARY KEY,
+    segment INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_records_position ON records(segment, offset);
+"""
+
+
+def _sort_key(unique_id):
+    # 文物 ID 是数字字符串，按数值顺序排列
+    return (len(unique_id), unique_id)
+
+
+class JsonDirStore:
+    """每个文物一个 JSON 文件的存储，与旧版本的 metadata_json/ 完全相同。"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, unique_id):
+        return os.path.join(self.path, f"artifact_{unique_id}.json")
+
+    def put(self, metadata):
+        with open(self._file(metadata['UniqueID']), "w", encoding="utf-8") as f:
+            json.dump(metadata, f, indent=4, ensure_ascii=False)
+
+    def get(self, unique_id):
+        try:
+            with open(self._file(unique_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def __contains__(self, unique_id):
+        return os.path.exists(self._file(unique_id))
+
+    def ids(self):
+        ids = [match.group(1) for match in map(re.compile(r'artifact_(.+)\.json').fullmatch, os.listdir(self.path))
+               if match]
+        return sorted(ids, key=_sort_key)
+
+    def __len__(self):
+        return len(self.ids())
+
+    def __iter__(self):
+        for unique_id in self.ids():
+            metadata = self.get(unique_id)
+            if metadata is not None:
+                yield metadata
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SegmentStore:
+    """
+    追加写入的 gzip JSON Lines 段存储，按 UniqueID 建立 SQLite 偏移索引。
+
+    只应由写入线程使用（抓取流水线中由写入阶段统一调用 put），不需要加锁。
+    """
+
+    def __init__(self, path, segment_size=SEGMENT_SIZE):
+        self.path = path
+        self.segment_size = segment_size
+        os.makedirs(path, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(path, 'index.sqlite'))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._readers = {}
+        self._writer = None
+        self._uncommitted = 0
+        segments = self.segments()
+        self._segment = segments[-1] if segments else 1
+        if segments:
+            self._recover_tail()
+
+    def _segment_file(self, segment):
+        return os.path.join(self.path, f"segment-{segment:06d}.jsonl.gz")
+
+    def segments(self):
+        """按编号返回目录中所有段文件的编号。"""
+        numbers = [int(match.group(1)) for match in
+                   map(re.compile(r'segment-(\d+)\.jsonl\.gz').fullmatch, os.listdir(self.path)) if match]
+        return sorted(numbers)
+
+    def _recover_tail(self):
+        """把最后一个段中已写入但索引尚未提交的记录补进索引，并截掉写了一半的记录。"""
+        end = self.conn.execute("SELECT MAX(offset + length) FROM records WHERE segment = ?",
+                                (self._segment,)).fetchone()[0] or 0
+        file_path = self._segment_file(self._segment)
+        with open(file_path, 'rb') as f:
+            f.seek(end)
+            tail = f.read()
+        position = recovered = 0
+        while position < len(tail):
+            decompressor = zlib.decompressobj(wbits=31)
+            try:
+                line = decompressor.decompress(tail[position:])
+                if not decompressor.eof:
+                    break
+                metadata = json.loads(line)
+            except (zlib.error, ValueError):
+                break
+            length = len(tail) - position - len(decompressor.unused_data)
+            self.conn.execute("INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?)",
+                              (metadata['UniqueID'], self._segment, end + position, length))
+            position += length
+            recovered += 1
+        if position < len(tail):
+            with open(file_path, 'r+b') as f:
+                f.truncate(end + position)
+        self.conn.commit()
+        if recovered:
+            print(f"从段文件恢复了 {recovered} 条未提交索引的记录。")
+
+    def _append(self, unique_id, member):
+        if self._writer is None or (self._writer.tell() and self._writer.tell() + len(member) > self.segment_size):
+            self._roll()
+        offset = self._writer.tell()
+        self._writer.write(member)
+        self._writer.flush()
+        self.conn.execute("INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?)",
+                          (unique_id, self._segment, offset, len(member)))
+        self._uncommitted += 1
+        if self._uncommitted >= COMMIT_INTERVAL:
+            self.commit()
+
+    def _roll(self):
+        """打开当前段用于追加；当前段已满时先提交索引，再换到下一个段。"""
+        if self._writer is not None:
+            self.commit()
+            self._writer.close()
+            self._segment += 1
+        self._writer = open(self._segment_file(self._segment), 'ab')
+        if self._writer.tell() >= self.segment_size:
+            self._writer.close()
+            self._segment += 1
+            self._writer = open(self._segment_file(self._segment), 'ab')
+
+    def put(self, metadata):
+        line = json.dumps(metadata, ensure_ascii=False, separators=(',', ':')) + '\n'
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        self._append(metadata['UniqueID'], compressor.compress(line.encode('utf-8')) + compressor.flush())
+
+    def _read(self, segment, offset, length):
+        reader = self._readers.get(segment)
+        if reader is None:
+            reader = self._readers[segment] = open(self._segment_file(segment), 'rb')
+        reader.seek(offset)
+        return reader.read(length)
+
+    def get(self, unique_id):
+        row = self.conn.execute("SELECT segment, offset, length FROM records WHERE unique_id = ?",
+                                (unique_id,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(zlib.decompress(self._read(*row), wbits=31))
+
+    def __contains__(self, unique_id):
+        return self.conn.execute("SELECT 1 FROM records WHERE unique_id = ?", (unique_id,)).fetchone() is not None
+
+    def ids(self):
+        return sorted((row[0] for row in self.conn.execute("SELECT unique_id FROM records")), key=_sort_key)
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def _positions(self):
+        # 先取出全部位置再读取，避免在遍历过程中写入导致游标失效
+        return self.conn.execute(
+            "SELECT unique_id, segment, offset, length FROM records ORDER BY segment, offset").fetchall()
+
+    def __iter__(self):
+        """按段内顺序遍历所有有效记录，每个段文件只被顺序读一遍。"""
+        for _, segment, offset, length in self._positions():
+            yield json.loads(zlib.decompress(self._read(segment, offset, length), wbits=31))
+
+    def stats(self):
+        live_bytes = self.conn.execute("SELECT COALESCE(SUM(length), 0) FROM records").fetchone()[0]
+        segments = self.segments()
+        total_bytes = sum(os.path.getsize(self._segment_file(segment)) for segment in segments)
+        return {'records': len(self), 'segments': len(segments), 'bytes': total_bytes,
+                'garbage_bytes': total_bytes - live_bytes}
+
+    def compact(self):
+        """
+        把所有有效记录按 UniqueID 顺序复制到新的段文件（直接复制压缩数据，不重新压缩），
+        在一个事务中切换索引，然后删除旧的段文件。返回释放的字节数。
+        """
+        self.commit()
+        before = self.stats()['bytes']
+        old_segments = self.segments()
+        positions = sorted(self._positions(), key=lambda row: _sort_key(row[0]))
+        self._close_files()
+        self._segment = (old_segments[-1] + 1) if old_segments else 1
+        new_rows = []
+        writer = open(self._segment_file(self._segment), 'wb')
+        for unique_id, segment, offset, length in tqdm(positions, desc="压缩段文件", unit="条"):
+            member = self._read(segment, offset, length)
+            if writer.tell() and writer.tell() + length > self.segment_size:
+                writer.close()
+                self._segment += 1
+                writer = open(self._segment_file(self._segment), 'wb')
+            new_rows.append((self._segment, writer.tell(), length, unique_id))
+            writer.write(member)
+        # 新段落盘后才切换索引；切换前崩溃时旧段和旧索引仍然完整
+        writer.flush()
+        os.fsync(writer.fileno())
+        writer.close()
+        with self.conn:
+            self.conn.executemany("UPDATE records SET segment = ?, offset = ?, length = ? WHERE unique_id = ?", new_rows)
+        self._close_files()
+        for segment in old_segments:
+            os.remove(self._segment_file(segment))
+        return before - self.stats()['bytes']
+
+    def commit(self):
+        if self._writer is not None:
+            self._writer.flush()
+        self.conn.commit()
+        self._uncommitted = 0
+
+    def _close_files(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        for reader in self._readers.values():
+            reader.close()
+        self._readers = {}
+
+    def close(self):
+        self.commit()
+        self._close_files()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_store(kind, project_root):
+    """按 kind ('json' 或 'segments') 打开 output/ 下对应的元数据存储。"""
+    if kind == 'segments':
+        return SegmentStore(os.path.join(project_root, 'output', 'metadata_store'))
+    return JsonDirStore(os.path.join(project_root, 'output', 'metadata_json'))
+
+
+def copy_records(source, target, desc):
+    count = 0
+    for metadata in tqdm(source, total=len(source), desc=desc, unit="个"):
+        target.put(metadata)
+        count += 1
+    return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="管理段文件格式的元数据存储 output/metadata_store/。")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('import', help="把 output/metadata_json/ 中的 JSON 文件导入段存储")
+    export_parser = subparsers.add_parser('export', help="导出为每个文物一个 JSON 文件的旧布局")
+    export_parser.add_argument('directory', nargs='?', help="导出目录 (默认: output/metadata_json)")
+    subparsers.add_parser('compact', help="重写段文件，去掉被覆盖的旧记录")
+    subparsers.add_parser('stats', help="显示记录数、段文件数和可回收的空间")
+    get_parser = subparsers.add_parser('get', help="按 UniqueID 输出一个文物的元数据")
+    get_parser.add_argument('unique_id')
+    args = parser.parse_args()
+
+    # --- 动态路径处理 ---
+    SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+    PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+    # ---
+
+    with open_store('segments', PROJECT_ROOT) as store:
+        if args.command == 'import':
+            with open_store('json', PROJECT_ROOT) as source:
+                count = copy_records(source, store, "导入JSON")
+            print(f"已导入 {count} 个文物，段存储中共 {len(store)} 个。")
+        elif args.command == 'export':
+            target = JsonDirStore(args.directory) if args.directory else open_store('json', PROJECT_ROOT)
+            count = copy_records(store, target, "导出JSON")
+            print(f"已导出 {count} 个文物至: {target.path}")
+        elif args.command == 'compact':
+            freed = store.compact()
+            print(f"压缩完成，释放 {freed / 1024 / 1024:.1f} MB。")
+        elif args.command == 'stats':
+            stats = store.stats()
+            print(f"记录 {stats['records']} 条，段文件 {stats['segments']} 个，共 {stats['bytes'] / 1024 / 1024:.1f} MB，"
+                  f"其中可回收 {stats['garbage_bytes'] / 1024 / 1024:.1f} MB。")
+        elif args.command == 'get':
+            metadata = store.get(args.unique_id)
+            if metadata is None:
+                print(f"未找到 UniqueID 为 {args.unique_id} 的文物。")
+                sys.exit(1)
+            print(json.dumps(metadata, ensure_ascii=False, indent=4))
@@ -0,0 +1,326 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+from telemetry import REGISTRY
+
+HTTP_REQUESTS = REGISTRY.counter('npm_http_requests_total', "各端点的请求数，status 为状态码或 error", ['endpoint', 'status'])
+HTTP_SECONDS = REGISTRY.histogram('npm_http_request_seconds', "各端点的响应延迟（秒，流式下载为首字节时间）", ['endpoint'])
+RATE_LIMIT = REGISTRY.gauge('npm_rate_limit', "各端点当前的自适应速率上限（次/秒）", ['endpoint'])
+
+
+class TokenBucket:
+    """
+    线程安全的令牌桶限速器。
+
+    rate 为每秒补充的令牌数，capacity 为桶容量（允许的瞬时突发请求数）。
+    多个线程共享同一个实例时，整体请求速率不会超过 rate。
+    """
+
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError("rate 必须大于 0")
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self, tokens=1):
+        """阻塞直到取得 tokens 个令牌。"""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def set_rate(self, rate):
+        """修改速率，桶容量随之调整。"""
+        with self._lock:
+            self._refill()
+            self.rate = float(rate)
+            self.capacity = max(1.0, self.rate)
+            self._tokens = min(self._tokens, self.capacity)
+
+
+class HostRateLimiter:
+    """按主机名分别限速：每个主机各自拥有一个 rate 次/秒的令牌桶。"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, url, tokens=1):
+        host = urlparse(url).netloc
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = self._buckets[host] = TokenBucket(self.rate, self.capacity)
+        bucket.acquire(tokens)
+
+
+class ByteBudget:
+    """
+    全局在途字节数上限。
+
+    下载前按响应的 Content-Length 申请额度，写盘后归还；所有下载线程的在途字节总和不超过 max_bytes。
+    单个请求超过上限时只要没有其他在途下载即可放行，避免永久阻塞。
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._in_flight = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, size):
+        with self._cond:
+            while self._in_flight > 0 and self._in_flight + size > self.max_bytes:
+                self._cond.wait()
+            self._in_flight += size
+
+    def release(self, size):
+        with self._cond:
+            self._in_flight -= size
+            self._cond.notify_all()
+
+
+# --- 自适应限速与熔断 ---
+# 按URL路径识别目标端点，顺序即匹配优先级
+ENDPOINTS = [
+    ('Captcha', 'GetCaptchaImageFor600'),
+    ('Download600', 'Download'),
+    ('Search', '/Search'),
+    ('Detail', '/Detail/'),
+]
+
+
+def endpoint_of(url):
+    """返回 URL 对应的端点名 (Search / Detail / Captcha / Download600)，无法识别时返回主机名。"""
+    for name, marker in ENDPOINTS:
+        if marker in url:
+            return name
+    return urlparse(url).netloc
+
+
+def metric_endpoint_of(url):
+    """指标和统计中使用的端点名：与 endpoint_of 相同，但把 DownloadDialog600 与 Download600 分开。"""
+    return 'DownloadDialog600' if 'DownloadDialog600' in url else endpoint_of(url)
+
+
+def backoff_delay(attempt, base=1.0, cap=60.0):
+    """第 attempt 次（从 1 开始）重试前的等待秒数：带完全抖动的指数退避，取值于 [0, min(cap, base * 2^(attempt-1))]。"""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+def retry_after_seconds(headers):
+    """解析 Retry-After 响应头（秒数或 HTTP 日期），没有或无法解析时返回 None。"""
+    value = headers.get('Retry-After') if headers else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveRateLimiter:
+    """
+    按 AIMD 调整速率的令牌桶。
+
+    请求成功且延迟不超过 target_latency 时速率加性增加 increase（次/秒），直到 max_rate；
+    出错、429/503 或延迟超标时速率乘以 decrease，不低于 min_rate。同一批并发请求往往一起失败，
+    因此两次减速之间至少间隔 cooldown 秒，避免一次拥塞把速率连续减半多次。
+    服务器给出 Retry-After 时，在该时间之前暂停发放令牌。
+    """
+
+    def __init__(self, rate, min_rate=0.2, max_rate=None, increase=0.1, decrease=0.5, target_latency=3.0,
+                 cooldown=2.0):
+        self.min_rate = min_rate
+        self.max_rate = max_rate if max_rate is not None else rate * 4
+        self.increase = increase
+        self.decrease = decrease
+        self.target_latency = target_latency
+        self.cooldown = cooldown
+        self._bucket = TokenBucket(rate)
+        self._lock = threading.Lock()
+        self._last_decrease = 0.0
+        self._paused_until = 0.0
+
+    @property
+    def rate(self):
+        return self._bucket.rate
+
+    def acquire(self, tokens=1):
+        while True:
+            with self._lock:
+                wait = self._paused_until - time.monotonic()
+            if wait <= 0:
+                break
+            time.sleep(wait)
+        self._bucket.acquire(tokens)
+
+    def on_success(self, latency=None):
+        if latency is not None and latency > self.target_latency:
+            self.on_failure()
+            return
+        with self._lock:
+            self._bucket.set_rate(min(self.max_rate, self._bucket.rate + self.increase))
+
+    def on_failure(self, retry_after=None):
+        now = time.monotonic()
+        with self._lock:
+            if retry_after:
+                self._paused_until = max(self._paused_until, now + retry_after)
+            if now - self._last_decrease >= self.cooldown:
+                self._last_decrease = now
+                self._bucket.set_rate(max(self.min_rate, self._bucket.rate * self.decrease))
+
+
+class CircuitBreaker:
+    """
+    熔断器。连续 failure_threshold 次失败后断开 reset_timeout 秒，期间所有请求在 allow() 中等待；
+    到期后进入半开状态，只放行一个试探请求：成功则闭合，失败则再次断开且等待时间加倍（不超过 max_reset_timeout）。
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, max_reset_timeout=600.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.state = 'closed'
+        self.opened = 0
+        self._failures = 0
+        self._timeout = reset_timeout
+        self._open_until = 0.0
+        self._trial_in_flight = False
+        self._cond = threading.Condition()
+
+    def allow(self):
+        """阻塞直到熔断器允许发出请求。"""
+        with self._cond:
+            while True:
+                if self.state == 'closed':
+                    return
+                if self.state == 'open':
+                    wait = self._open_until - time.monotonic()
+                    if wait > 0:
+                        self._cond.wait(wait)
+                        continue
+                    self.state = 'half_open'
+                if not self._trial_in_flight:
+                    self._trial_in_flight = True
+                    return
+                self._cond.wait()
+
+    def record_success(self):
+        with self._cond:
+            self._failures = 0
+            if self.state != 'closed':
+                self.state = 'closed'
+                self._timeout = self.reset_timeout
+                self._trial_in_flight = False
+                self._cond.notify_all()
+
+    def record_failure(self):
+        with self._cond:
+            self._failures += 1
+            if self.state == 'half_open':
+                self._timeout = min(self.max_reset_timeout, self._timeout * 2)
+                self._open()
+            elif self.state == 'closed' and self._failures >= self.failure_threshold:
+                self._open()
+
+    def _open(self):
+        self.state = 'open'
+        self.opened += 1
+        self._open_until = time.monotonic() + self._timeout
+        self._trial_in_flight = False
+        self._cond.notify_all()
+
+
+class Throttle:
+    """
+    所有抓取脚本共享的请求节流器：每个端点 (Search / Detail / Captcha / Download600)
+    各有一个 AdaptiveRateLimiter 和一个 CircuitBreaker。
+
+    用法与 HostRateLimiter 相同，请求前调用 acquire(url)；请求结束后用 record() 报告结果，
+    或直接用 request() 发送请求。5xx、429、网络错误和超时记为失败，其余响应记为成功。
+    """
+
+    def __init__(self, rate=2.0, max_rate=None, min_rate=0.2, target_latency=3.0, failure_threshold=5,
+                 reset_timeout=30.0):
+        self._make_limiter = lambda: AdaptiveRateLimiter(rate, min_rate, max_rate, target_latency=target_latency)
+        self._make_breaker = lambda: CircuitBreaker(failure_threshold, reset_timeout)
+        self._endpoints = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def _endpoint(self, url):
+        name = endpoint_of(url)
+        with self._lock:
+            endpoint = self._endpoints.get(name)
+            if endpoint is None:
+                endpoint = self._endpoints[name] = (self._make_limiter(), self._make_breaker())
+                self._counts[name] = {'ok': 0, 'failed': 0}
+        return name, endpoint
+
+    def acquire(self, url, tokens=1):
+        _, (limiter, breaker) = self._endpoint(url)
+        breaker.allow()
+        limiter.acquire(tokens)
+
+    def record(self, url, response=None, error=None, latency=None):
+        name, (limiter, breaker) = self._endpoint(url)
+        failed = error is not None or response is None or response.status_code >= 500 or response.status_code == 429
+        with self._lock:
+            self._counts[name]['failed' if failed else 'ok'] += 1
+        endpoint = metric_endpoint_of(url)
+        HTTP_REQUESTS.inc(endpoint=endpoint, status=response.status_code if response is not None else 'error')
+        if latency is not None:
+            HTTP_SECONDS.observe(latency, endpoint=endpoint)
+        if failed:
+            limiter.on_failure(retry_after_seconds(response.headers) if response is not None else None)
+            breaker.record_failure()
+        else:
+            limiter.on_success(latency)
+            breaker.record_success()
+        RATE_LIMIT.set(round(limiter.rate, 3), endpoint=name)
+
+    def request(self, session, method, url, **kwargs):
+        """限速后发送请求并记录结果，返回响应（不检查状态码）；网络错误在记录后原样抛出。"""
+        self.acquire(url)
+        started = time.monotonic()
+        try:
+            response = session.request(method, url, **kwargs)
+        except Exception as e:
+            self.record(url, error=e)
+            raise
+        self.record(url, response=response, latency=time.monotonic() - started)
+        return response
+
+    def summary(self):
+        with self._lock:
+            return {name: dict(self._counts[name], rate=round(limiter.rate, 2), breaker_opened=breaker.opened)
+                    for name, (limiter, breaker) in self._endpoints.items()}
+
+
+def throttled_request(throttle, session, method, url, **kwargs):
+    """throttle 为 Throttle 时经由它发送请求，为 None 时直接发送。"""
+    if throttle is None:
+        return session.request(method, url, **kwargs)
+    return throttle.request(session, method, url, **kwargs)
@@ -0,0 +1,132 @@
+import os
+import gzip
+import json
+import time
+import hashlib
+import tempfile
+
+from rate_limit import throttled_request
+from telemetry import REGISTRY
+
+CACHE_LOOKUPS = REGISTRY.counter('npm_html_cache_total', "详情页缓存的使用情况: hit / miss / not_modified / refreshed",
+                                 ['result'])
+
+
+class ResponseCache:
+    """
+    磁盘上的原始HTML响应缓存，按URL索引、按内容寻址存储。
+
+    目录结构：
+        index/<前2位>/<sha1(url)>.json      URL -> 内容哈希、抓取时间、ETag、Last-Modified
+        objects/<前2位>/<sha256(body)>.gz   gzip 压缩的页面正文，内容相同的页面只存一份
+
+    元数据抓取和图片下载脚本共享同一个缓存，因此每个详情页只需要从服务器获取一次；
+    修改解析逻辑后也可以完全基于缓存离线重新解析。
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.index_dir = os.path.join(cache_dir, 'index')
+        self.objects_dir = os.path.join(cache_dir, 'objects')
+        os.makedirs(self.index_dir, exist_ok=True)
+        os.makedirs(self.objects_dir, exist_ok=True)
+
+    # --- 底层读写 ---
+    def _index_path(self, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.index_dir, key[:2], f"{key}.json")
+
+    def _object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], f"{digest}.gz")
+
+    @staticmethod
+    def _atomic_write(path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def get_entry(self, url):
+        """返回URL对应的索引记录，未缓存时返回 None。"""
+        try:
+            with open(self._index_path(url), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def __contains__(self, url):
+        return os.path.exists(self._index_path(url))
+
+    def read_body(self, entry):
+        with gzip.open(self._object_path(entry['sha256']), 'rb') as f:
+            return f.read().decode('utf-8')
+
+    def get(self, url):
+        """返回缓存的页面正文，未缓存时返回 None。"""
+        entry = self.get_entry(url)
+        return self.read_body(entry) if entry else None
+
+    def store(self, url, text, etag=None, last_modified=None):
+        body = text.encode('utf-8')
+        digest = hashlib.sha256(body).hexdigest()
+        object_path = self._object_path(digest)
+        if not os.path.exists(object_path):
+            self._atomic_write(object_path, gzip.compress(body))
+        entry = {"url": url, "sha256": digest, "fetched_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+                 "etag": etag, "last_modified": last_modified}
+        self._atomic_write(self._index_path(url), json.dumps(entry, ensure_ascii=False).encode('utf-8'))
+        return entry
+
+    def entries(self):
+        """遍历所有索引记录。"""
+        for subdir in sorted(os.listdir(self.index_dir)):
+            subdir_path = os.path.join(self.index_dir, subdir)
+            for name in sorted(os.listdir(subdir_path)):
+                if name.endswith('.json'):
+                    with open(os.path.join(subdir_path, name), "r", encoding="utf-8") as f:
+                        yield json.load(f)
+
+    # --- 带缓存的抓取 ---
+    def fetch(self, session, url, headers, refresh=False, offline=False, limiter=None, timeout=30, proxies=None):
+        """
+        返回URL的页面正文，优先使用缓存。
+
+        refresh=True 时对已缓存的页面发送条件请求 (If-None-Match / If-Modified-Since)，
+        服务器返回 304 时沿用缓存；offline=True 时只读缓存，未命中则抛出 KeyError。
+        只有真正访问网络时才会经过 limiter (rate_limit.Throttle) 限速。
+        """
+        return self.fetch_with_result(session, url, headers, refresh, offline, limiter, timeout, proxies)[0]
+
+    def fetch_with_result(self, session, url, headers, refresh=False, offline=False, limiter=None, timeout=30,
+                          proxies=None):
+        """
+        与 fetch 相同，但返回 (页面正文, 结果)。结果与 npm_html_cache_total 的标签一致：
+        hit (直接读缓存) / miss (首次抓取) / not_modified (条件请求返回 304) / refreshed (页面有更新)。
+        """
+        entry = self.get_entry(url)
+        if entry and (offline or not refresh):
+            CACHE_LOOKUPS.inc(result='hit')
+            return self.read_body(entry), 'hit'
+        if offline:
+            raise KeyError(f"离线模式下缓存中没有该页面: {url}")
+
+        request_headers = dict(headers)
+        if entry:
+            if entry.get('etag'):
+                request_headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                request_headers['If-Modified-Since'] = entry['last_modified']
+
+        response = throttled_request(limiter, session, 'GET', url, headers=request_headers, timeout=timeout,
+                                     proxies=proxies)
+        if response.status_code == 304 and entry:
+            CACHE_LOOKUPS.inc(result='not_modified')
+            entry['fetched_at'] = time.strftime("%Y-%m-%d %H:%M:%S")
+            self._atomic_write(self._index_path(url), json.dumps(entry, ensure_ascii=False).encode('utf-8'))
+            return self.read_body(entry), 'not_modified'
+        response.raise_for_status()
+        result = 'refreshed' if entry else 'miss'
+        CACHE_LOOKUPS.inc(result=result)
+        self.store(url, response.text, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        return response.text, result
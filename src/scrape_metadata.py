@@ -6,6 +6,25 @@ import csv
 from bs4 import BeautifulSoup
 from tqdm import tqdm
 import time
+import argparse
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import fast_parser
+from rate_limit import Throttle, backoff_delay, throttled_request
+from crawl_state import open_default_state
+from http_client import TIMEOUT, add_http_arguments, configure_http, default_session, new_session
+from response_cache import ResponseCache
+from metadata_export import ParquetExporter, rebuild_from_store
+from metadata_store import STORE_KINDS, open_store
+from metadata_search import SearchIndex, default_index_path
+from sharding import add_shard_argument, write_shard_marker
+from telemetry import FUNCTION_SECONDS, REGISTRY, add_telemetry_arguments, start_telemetry, traced
+
+# --- 全局配置 ---
+MAX_RETRIES = 3
+
+METADATA_RESULTS = REGISTRY.counter('npm_metadata_total', "元数据抓取结果: ok / failed / unchanged", ['result'])
 
 
 # --- 更健壮的解析函数 (保持不变) ---
@@ -80,107 +99,400 @@ def parse_conservation_info(div_tag):
 
 
 # --- 主抓取函数 ---
-def scrape_artifact_metadata(url, headers):
+SECTIONS_TO_SCRAPE = {
+    "基本資料": ("details-1", parse_key_value_table),
+    "典藏尺寸": ("details-2", parse_header_row_table),
+    "質地": ("details-3", parse_header_row_table),
+    "題跋資料": ("details-4", parse_inscription_table),
+    "印記資料": ("details-5", parse_header_row_table),
+    "主題": ("details-6", parse_header_row_table),
+    "技法": ("details-7", parse_header_row_table),
+    "參考資料": ("details-8", parse_key_value_table),
+    "保存維護": ("details-9", parse_conservation_info)
+}
+
+CSV_HEADERS = ["UniqueID", "URL", "文物名称", "基本資料", "典藏尺寸", "質地", "題跋資料", "印記資料", "主題",
+               "技法", "參考資料", "保存維護"]
+
+
+@traced('parse_artifact_html')
+def parse_artifact_html(url, html, backend='bs4'):
+    """
+    把详情页HTML解析为元数据字典。纯CPU计算，可以在进程池中执行。
+    backend 为 'lxml' 时使用 fast_parser 中的单次遍历实现，输出与默认的 bs4 实现一致；
+    页面结构不完整时两者修复出的树可能不同，此时仍用 bs4 解析（见 fast_parser.is_well_formed）。
+    """
+    if backend == 'lxml' and fast_parser.is_well_formed(html):
+        return fast_parser.parse_artifact_html(url, html)
+    soup = BeautifulSoup(html, 'html.parser')
+
+    item_id_match = re.search(r"GetJson\?cid=(\d+)", html)
+    unique_id = item_id_match.group(1) if item_id_match else url.split('Detail/')[1].split('?')[0]
+
+    artifact_data = {
+        "UniqueID": unique_id,
+        "URL": url,
+        "文物名称": soup.find('div', class_='details-title').get_text(strip=True) if soup.find('div',
+                                                                                               class_='details-title') else "N/A"
+    }
+
+    for section_name, (div_id, parse_func) in SECTIONS_TO_SCRAPE.items():
+        section_div = soup.find('div', id=div_id)
+        if section_div:
+            target_tag = section_div.find('table') if "table" in parse_func.__name__ else section_div
+            artifact_data[section_name] = parse_func(target_tag)
+        else:
+            artifact_data[section_name] = {}
+    return artifact_data
+
+
+def parse_artifact_html_timed(url, html, backend='bs4'):
+    """
+    在进程池中调用的 parse_artifact_html，返回 (元数据, 解析耗时秒)。
+    工作进程中记录的指标不会回到主进程，由调用方用 record_parse_time() 记录耗时。
+    """
+    started = time.perf_counter()
+    return parse_artifact_html(url, html, backend), time.perf_counter() - started
+
+
+def record_parse_time(seconds):
+    FUNCTION_SECONDS.observe(seconds, function='parse_artifact_html')
+
+
+@traced('fetch_detail_page')
+def fetch_detail_page(session, url, headers, cache=None, refresh=False, limiter=None, skip_unchanged=False):
+    """
+    请求详情页并返回HTML文本。传入 cache 时优先读取本地响应缓存。
+    limiter 为共享的 rate_limit.Throttle；失败时按带抖动的指数退避重试，超过 MAX_RETRIES 次后抛出异常。
+    skip_unchanged=True 时（配合 refresh），服务器返回 304 的页面返回 None，调用方无需重新解析。
+    """
+    for attempt in range(1, MAX_RETRIES + 1):
+        try:
+            if cache is not None:
+                html, result = cache.fetch_with_result(session, url, headers, refresh=refresh, limiter=limiter,
+                                                        timeout=TIMEOUT)
+                return None if skip_unchanged and result == 'not_modified' else html
+            response = throttled_request(limiter, session, 'GET', url, headers=headers, timeout=TIMEOUT)
+            response.raise_for_status()
+            return response.text
+        except requests.exceptions.RequestException:
+            if attempt == MAX_RETRIES:
+                raise
+            time.sleep(backoff_delay(attempt))
+
+
+@traced('scrape_artifact_metadata')
+def scrape_artifact_metadata(url, headers, session=None, backend='bs4', cache=None, refresh=False, limiter=None):
+    """抓取并解析单个详情页，失败时返回 None。没有传入 session 时使用进程内共享的会话 (http_client.default_session)。"""
     try:
-        response = requests.get(url, headers=headers, timeout=30)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        item_id_match = re.search(r"GetJson\?cid=(\d+)", response.text)
-        unique_id = item_id_match.group(1) if item_id_match else url.split('Detail/')[1].split('?')[0]
-
-        artifact_data = {
-            "UniqueID": unique_id,
-            "URL": url,
-            "文物名称": soup.find('div', class_='details-title').get_text(strip=True) if soup.find('div',
-                                                                                                   class_='details-title') else "N/A"
-        }
-
-        sections_to_scrape = {
-            "基本資料": ("details-1", parse_key_value_table),
-            "典藏尺寸": ("details-2", parse_header_row_table),
-            "質地": ("details-3", parse_header_row_table),
-            "題跋資料": ("details-4", parse_inscription_table),
-            "印記資料": ("details-5", parse_header_row_table),
-            "主題": ("details-6", parse_header_row_table),
-            "技法": ("details-7", parse_header_row_table),
-            "參考資料": ("details-8", parse_key_value_table),
-            "保存維護": ("details-9", parse_conservation_info)
-        }
-
-        for section_name, (div_id, parse_func) in sections_to_scrape.items():
-            section_div = soup.find('div', id=div_id)
-            if section_div:
-                target_tag = section_div.find('table') if "table" in parse_func.__name__ else section_div
-                artifact_data[section_name] = parse_func(target_tag)
-            else:
-                artifact_data[section_name] = {} 
-        return artifact_data
+        html = fetch_detail_page(session or default_session(), url, headers, cache, refresh, limiter)
+        return parse_artifact_html(url, html, backend)
     except Exception as e:
         tqdm.write(f"处理URL {url} 时发生错误: {e}")
         return None
 
 
+def metadata_to_csv_row(metadata):
+    """把嵌套的元数据展平为CSV行，嵌套字段序列化为JSON字符串。"""
+    flat_data = {}
+    for key in CSV_HEADERS:
+        value = metadata.get(key, "")
+        if isinstance(value, (dict, list)) and value:
+            flat_data[key] = json.dumps(value, ensure_ascii=False)
+        elif not value:
+            flat_data[key] = ""
+        else:
+            flat_data[key] = value
+    return flat_data
+
+
+def write_metadata(metadata, writer, store, exporters=()):
+    """
+    把单个文物写入元数据存储 (metadata_store)，并向CSV追加一行（writer 为 None 时不写CSV）。
+    exporters 中的每个对象（Parquet 导出、全文检索索引）也会通过 write(metadata) 收到这条记录。
+    """
+    store.put(metadata)
+    if writer is not None:
+        writer.writerow(metadata_to_csv_row(metadata))
+    for exporter in exporters:
+        exporter.write(metadata)
+    METADATA_RESULTS.inc(result='ok')
+
+
+def rebuild_csv(store, csv_path):
+    """由元数据存储重新生成 metadata.csv（先写临时文件再替换）。"""
+    part_path = csv_path + '.part'
+    count = 0
+    with open(part_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_HEADERS)
+        writer.writeheader()
+        for metadata in tqdm(store, total=len(store), desc="生成CSV", unit="个"):
+            writer.writerow(metadata_to_csv_row(metadata))
+            count += 1
+    os.replace(part_path, csv_path)
+    return count
+
+
+def run_pipeline(urls, headers, writer, store, fetch_workers=8, parse_workers=None, rate=4.0,
+                 max_in_flight=64, backend='bs4', cache=None, refresh=False, state=None, max_rate=None,
+                 exporters=(), limiter=None, total=None):
+    """
+    流水线模式抓取元数据。urls 可以是任意可迭代对象，按需逐个读取；total 为进度条的总数（默认为 len(urls)）。
+
+    - 抓取阶段：fetch_workers 个线程共享一个保持长连接的 Session，请求速率从每秒 rate 次开始自适应调整，不超过 max_rate；
+    - 解析阶段：BeautifulSoup 解析是CPU密集型操作，交给 parse_workers 个进程的进程池；
+    - 写入阶段：只由当前线程写元数据存储和 CSV，不需要加锁。
+
+    同时在途（抓取中或解析中）的URL数不超过 max_in_flight，内存占用保持有界。
+    已缓存的页面直接从 cache 读取，不经过限速。每个URL的结果都会写回爬取状态库 state。
+    refresh=True 时对已缓存的页面发送条件请求，服务器返回 304 的页面不再解析和写入，直接记为完成。
+    写入阶段同时把元数据交给 exporters（Parquet 导出、全文检索索引）。
+    也可以传入与其他阶段共享的 limiter (rate_limit.Throttle)，此时忽略 rate 和 max_rate。
+    """
+    limiter = limiter or Throttle(rate, max_rate)
+    url_iter = iter(urls)
+    pending = {}
+
+    with new_session(fetch_workers) as session, \
+            ThreadPoolExecutor(max_workers=fetch_workers) as fetch_pool, \
+            ProcessPoolExecutor(max_workers=parse_workers) as parse_pool, \
+            tqdm(total=total if total is not None else len(urls), desc="元数据采集中") as progress:
+        def fetch(url):
+            return fetch_detail_page(session, url, headers, cache, refresh, limiter, skip_unchanged=refresh)
+
+        def fill_window():
+            while len(pending) < max_in_flight:
+                url = next(url_iter, None)
+                if url is None:
+                    return
+                pending[fetch_pool.submit(fetch, url)] = ('fetch', url)
+
+        fill_window()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, url = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    tqdm.write(f"处理URL {url} 时发生错误: {e}")
+                    METADATA_RESULTS.inc(result='failed')
+                    if state:
+                        state.mark_metadata(url, False, str(e))
+                    progress.update(1)
+                    continue
+                if stage == 'fetch' and result is None:
+                    # 页面没有变化，已有的元数据仍然有效
+                    METADATA_RESULTS.inc(result='unchanged')
+                    if state:
+                        state.mark_metadata(url, True)
+                    progress.update(1)
+                elif stage == 'fetch':
+                    pending[parse_pool.submit(parse_artifact_html_timed, url, result, backend)] = ('parse', url)
+                else:
+                    metadata, seconds = result
+                    record_parse_time(seconds)
+                    write_metadata(metadata, writer, store, exporters)
+                    if state:
+                        state.mark_metadata(url, True, item_id=metadata['UniqueID'])
+                    progress.update(1)
+            fill_window()
+    print(f"请求统计: {json.dumps(limiter.summary(), ensure_ascii=False)}")
+
+
+def mark_stored_as_done(state, store, pending):
+    """
+    兼容旧版本：状态库建立之前已经抓取过的文物（元数据存储中已有）直接记为完成，返回记录的个数。
+    应在按 --limit 领取文物之前调用，使本次处理的文物数和进度条总数都不包含这些文物。
+    """
+    if len(store) == 0:
+        return 0
+    count = 0
+    for _, url in pending:
+        item_id_match = re.search(r'Detail/(\d+)', url)
+        if item_id_match and item_id_match.group(1) in store:
+            state.mark_metadata(url, True)
+            count += 1
+    return count
+
+
+def _parse_cached_page(cache_dir, url, backend):
+    # 在解析进程中直接读取并解压缓存，主进程只传递URL
+    return parse_artifact_html_timed(url, ResponseCache(cache_dir).get(url), backend)
+
+
+def rebuild_from_cache(cache, writer, store, parse_workers=None, backend='bs4', max_in_flight=256,
+                       state=None, exporters=()):
+    """离线模式：不访问网络，用响应缓存中的所有详情页重新写入元数据存储和 CSV（以及 Parquet）。"""
+    urls = [entry['url'] for entry in cache.entries() if 'Detail/' in entry['url']]
+    print(f"离线模式：缓存中共有 {len(urls)} 个详情页。")
+    url_iter = iter(urls)
+    pending = {}
+    with ProcessPoolExecutor(max_workers=parse_workers) as parse_pool, \
+            tqdm(total=len(urls), desc="离线重新解析") as progress:
+        def fill_window():
+            while len(pending) < max_in_flight:
+                url = next(url_iter, None)
+                if url is None:
+                    return
+                pending[parse_pool.submit(_parse_cached_page, cache.cache_dir, url, backend)] = url
+
+        fill_window()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                url = pending.pop(future)
+                try:
+                    metadata, seconds = future.result()
+                    record_parse_time(seconds)
+                    write_metadata(metadata, writer, store, exporters)
+                    if state:
+                        state.mark_metadata(url, True, item_id=metadata['UniqueID'])
+                except Exception as e:
+                    tqdm.write(f"解析缓存页面 {url} 时发生错误: {e}")
+                    METADATA_RESULTS.inc(result='failed')
+                progress.update(1)
+            fill_window()
+
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="抓取文物详情页的元数据。")
+    # 待处理的文物从爬取状态库 output/crawl_state.sqlite 中领取
+    parser.add_argument('--limit', type=int, default=0, help="本次最多处理的文物数，0 表示全部待处理的 (默认: 0)")
+    parser.add_argument('--retry-failed', action='store_true', help="只重试之前失败的文物")
+    parser.add_argument('--pipeline', action='store_true', help="启用 抓取/解析/写入 三段式并行流水线")
+    parser.add_argument('--fetch-workers', type=int, default=8, help="流水线模式下的抓取线程数 (默认: 8)")
+    parser.add_argument('--parse-workers', type=int, default=None, help="流水线模式下的解析进程数 (默认: CPU核数)")
+    parser.add_argument('--rate', type=float, default=4.0, help="初始每秒请求次数，之后按服务器响应自适应调整 (默认: 4.0)")
+    parser.add_argument('--max-rate', type=float, default=None, help="自适应调速的上限，次/秒 (默认: --rate 的 4 倍)")
+    parser.add_argument('--parser', choices=['bs4', 'lxml'], default='bs4',
+                        help="HTML解析后端；lxml 更快，页面结构不完整时自动改用 bs4 解析 (默认: bs4)")
+    parser.add_argument('--refresh', action='store_true',
+                        help="同时重新检查已抓取的文物：对已缓存的详情页发送条件请求，只有页面有更新时才重新解析和写入")
+    parser.add_argument('--offline', action='store_true', help="不访问网络，完全基于响应缓存重建 JSON 和 CSV")
+    parser.add_argument('--no-cache', action='store_true', help="不读写本地响应缓存")
+    parser.add_argument('--store', choices=STORE_KINDS, default='json',
+                        help="元数据存储方式: json 为每个文物一个 output/metadata_json/ 文件，"
+                             "segments 为 output/metadata_store/ 中的压缩段文件 (默认: json)")
+    parser.add_argument('--parquet', action='store_true',
+                        help="同时把元数据写入 output/metadata_parquet/ 列式数据集（需安装 pyarrow）")
+    add_shard_argument(parser)
+    add_http_arguments(parser)
+    add_telemetry_arguments(parser)
+    args = parser.parse_args()
+    start_telemetry(args)
+    configure_http(args)
+
     # --- 动态路径处理 ---
     SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
     PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
-    URL_FILE = os.path.join(PROJECT_ROOT, 'output', 'urls.txt')
-    JSON_OUTPUT_DIR = os.path.join(PROJECT_ROOT, 'output', 'metadata_json')
     CSV_OUTPUT_FILE = os.path.join(PROJECT_ROOT, 'output', 'metadata.csv')
+    CACHE_DIR = os.path.join(PROJECT_ROOT, 'output', 'html_cache')
+    PARQUET_DIR = os.path.join(PROJECT_ROOT, 'output', 'metadata_parquet')
+    SEARCH_INDEX_FILE = default_index_path(PROJECT_ROOT)
     # ---
 
-    os.makedirs(JSON_OUTPUT_DIR, exist_ok=True)
+    store = open_store(args.store, PROJECT_ROOT)
+    # 建立过全文检索索引 (metadata_search.py build) 后，新抓取的文物会同步写入索引
+    search_index = SearchIndex(SEARCH_INDEX_FILE) if os.path.exists(SEARCH_INDEX_FILE) else None
+    cache = None if args.no_cache else ResponseCache(CACHE_DIR)
+    state = open_default_state()
 
-    if not os.path.exists(URL_FILE):
-        print(f"错误: 未找到URL列表文件 '{URL_FILE}'。请先运行 src/harvest_urls.py")
+    if args.offline:
+        if cache is None:
+            print("错误: --offline 需要使用响应缓存，不能与 --no-cache 同时使用。")
+        else:
+            # 离线重建会重写全部元数据和 CSV，Parquet 数据集也整体替换
+            with open(CSV_OUTPUT_FILE, "w", encoding="utf-8", newline="") as f, \
+                    (ParquetExporter(PARQUET_DIR, replace=True) if args.parquet else nullcontext()) as parquet:
+                writer = csv.DictWriter(f, fieldnames=CSV_HEADERS)
+                writer.writeheader()
+                rebuild_from_cache(cache, writer, store, parse_workers=args.parse_workers,
+                                   backend=args.parser, state=state,
+                                   exporters=[e for e in (parquet, search_index) if e is not None])
+            if parquet:
+                print(f"Parquet 数据集已保存至 '{PARQUET_DIR}'。")
+            print(f"\n离线重建完成！元数据已保存至CSV文件 '{CSV_OUTPUT_FILE}' 及 '{store.path}'。")
+    elif len(state) == 0:
+        print("错误: 爬取状态库中没有任何文物。请先运行 src/harvest_urls.py")
     else:
-        with open(URL_FILE, "r", encoding="utf-8") as f:
-            urls_to_scrape = [line.strip() for line in f if line.strip()]
-
-        print(f"从 '{URL_FILE}' 文件中加载了 {len(urls_to_scrape)} 个URL。")
+        if args.shard:
+            write_shard_marker(os.path.join(PROJECT_ROOT, 'output'), args.shard)
+            print(f"只处理分片 {args.shard}。")
+        # --refresh 时元数据存储中已有的文物同样需要重新检查
+        if not args.refresh:
+            legacy = mark_stored_as_done(state, store, state.pending_metadata(args.retry_failed, shard=args.shard))
+            if legacy:
+                print(f"元数据存储中已有 {legacy} 个文物，已在状态库中记为完成。")
+        pending_artifacts = state.pending_metadata(args.retry_failed, args.limit, shard=args.shard,
+                                                   include_done=args.refresh)
+        print(f"本次任务将处理 {len(pending_artifacts)} 个{'之前失败的' if args.retry_failed else '待抓取的'}"
+              f"{'及已完成的' if args.refresh else ''}文物。")
 
-        # 在这里配置您的爬取范围
-        START_INDEX = 1
-        END_INDEX = 10
-
-        urls_to_process = urls_to_scrape[START_INDEX - 1:END_INDEX] if END_INDEX is not None else urls_to_scrape[START_INDEX - 1:]
-        print(f"本次任务将处理第 {START_INDEX} 到 {END_INDEX if END_INDEX is not None else len(urls_to_scrape)} 个URL，共计 {len(urls_to_process)} 个。")
+        def iter_urls_to_process():
+            # 逐页读取状态库，不把全部待处理的URL放进内存
+            for _, url in pending_artifacts:
+                yield url
 
         headers = {
             'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/138.0.0.0 Safari/537.36'}
-        CSV_HEADERS = ["UniqueID", "URL", "文物名称", "基本資料", "典藏尺寸", "質地", "題跋資料", "印記資料", "主題",
-                       "技法", "參考資料", "保存維護"]
-
-        with open(CSV_OUTPUT_FILE, "a", encoding="utf-8", newline="") as f:
-            writer = csv.DictWriter(f, fieldnames=CSV_HEADERS)
-            if f.tell() == 0: writer.writeheader()
-
-            for url in tqdm(urls_to_process, desc="元数据采集中"):
-                item_id_match = re.search(r'Detail/(\d+)', url)
-                if item_id_match:
-                    unique_id = item_id_match.group(1)
-                    json_filepath = os.path.join(JSON_OUTPUT_DIR, f"artifact_{unique_id}.json")
-                    if os.path.exists(json_filepath):
-                        continue
-
-                metadata = scrape_artifact_metadata(url, headers)
-                if metadata:
-                    json_filepath = os.path.join(JSON_OUTPUT_DIR, f"artifact_{metadata['UniqueID']}.json")
-                    with open(json_filepath, "w", encoding="utf-8") as json_f:
-                        json.dump(metadata, json_f, indent=4, ensure_ascii=False)
-
-                    flat_data = {}
-                    for key in CSV_HEADERS:
-                        value = metadata.get(key, "")
-                        if isinstance(value, (dict, list)) and value:
-                            flat_data[key] = json.dumps(value, ensure_ascii=False)
-                        elif not value:
-                            flat_data[key] = ""
-                        else:
-                            flat_data[key] = value
-                    writer.writerow(flat_data)
-
-                time.sleep(1)
-
-        print(f"\n任务完成！元数据已保存至CSV文件 '{CSV_OUTPUT_FILE}' 及JSON文件夹 '{JSON_OUTPUT_DIR}'。")
\ No newline at end of file
+
+        # --refresh 会重写已有的文物，追加写入的 CSV 和 Parquet part 文件会出现重复行，
+        # 因此本次只写元数据存储（和原地更新的全文检索索引），结束后由存储整体重新生成 CSV 和 Parquet
+        append_outputs = not args.refresh
+        # 本次抓取的结果写入数据集中的一个新 part 文件，与之前的 part 文件一起构成完整数据集
+        parquet = ParquetExporter(PARQUET_DIR) if args.parquet and append_outputs else None
+        exporters = [e for e in (parquet, search_index) if e is not None]
+        try:
+            with (open(CSV_OUTPUT_FILE, "a", encoding="utf-8", newline="") if append_outputs
+                  else nullcontext()) as f:
+                writer = None
+                if f is not None:
+                    writer = csv.DictWriter(f, fieldnames=CSV_HEADERS)
+                    if f.tell() == 0: writer.writeheader()
+
+                if args.pipeline:
+                    print(f"流水线模式：抓取线程 {args.fetch_workers}，限速 {args.rate} 次/秒。")
+                    run_pipeline(iter_urls_to_process(), headers, writer, store, fetch_workers=args.fetch_workers,
+                                 parse_workers=args.parse_workers, rate=args.rate, backend=args.parser,
+                                 cache=cache, refresh=args.refresh, state=state, max_rate=args.max_rate,
+                                 exporters=exporters, total=len(pending_artifacts))
+                else:
+                    # 请求间隔由自适应节流器控制，命中缓存时不访问服务器也就无需等待
+                    limiter = Throttle(args.rate, args.max_rate)
+                    with new_session(1) as session:
+                        for url in tqdm(iter_urls_to_process(), total=len(pending_artifacts), desc="元数据采集中"):
+                            try:
+                                html = fetch_detail_page(session, url, headers, cache, args.refresh, limiter,
+                                                         skip_unchanged=args.refresh)
+                                metadata = parse_artifact_html(url, html, args.parser) if html is not None else None
+                            except Exception as e:
+                                tqdm.write(f"处理URL {url} 时发生错误: {e}")
+                                METADATA_RESULTS.inc(result='failed')
+                                state.mark_metadata(url, False, str(e))
+                                continue
+                            if metadata is None:
+                                # 页面没有变化，已有的元数据仍然有效
+                                METADATA_RESULTS.inc(result='unchanged')
+                                state.mark_metadata(url, True)
+                            else:
+                                write_metadata(metadata, writer, store, exporters)
+                                state.mark_metadata(url, True, item_id=metadata['UniqueID'])
+                    print(f"请求统计: {json.dumps(limiter.summary(), ensure_ascii=False)}")
+        finally:
+            # 中断时也保留已写出的 row group
+            if parquet:
+                parquet.close()
+        if parquet:
+            print(f"本次抓取的 {parquet.count} 个文物已写入 Parquet 数据集 '{PARQUET_DIR}'。")
+        if not append_outputs:
+            rows = rebuild_csv(store, CSV_OUTPUT_FILE)
+            print(f"已由元数据存储重新生成CSV，共 {rows} 行。")
+            if args.parquet:
+                count = rebuild_from_store(store, PARQUET_DIR)
+                print(f"已由元数据存储重新生成 Parquet 数据集 '{PARQUET_DIR}'，共 {count} 个文物。")
+
+        print(f"\n任务完成！元数据已保存至CSV文件 '{CSV_OUTPUT_FILE}' 及 '{store.path}'。")
+    store.close()
+    if search_index is not None:
+        search_index.close()
@@ -0,0 +1,105 @@
+"""
+多机分片爬取。
+
+每个文物按文物ID的哈希分配到 N 个分片之一（见 crawl_state.artifact_shard），各主机用
+``--shard i/N`` 只处理自己的分片，结果写在各自的 output/ 中，最后用 merge_shards.py 合并。
+分片只取决于文物ID，与 urls.txt 的顺序、状态库的 rowid 以及哪台主机先采集无关。
+
+主图文件名中的序号来自状态库的 rowid，因此建议先在一台主机上采集URL，再把
+output/crawl_state.sqlite 复制到各主机，各主机用 --skip-harvest 运行，序号在合并后保持一致。
+
+用法:
+    python src/sharding.py plan 4        # 查看状态库中待处理的文物在 4 个分片中的分布
+    python src/sharding.py which 4 <url或文物ID>...
+"""
+import os
+import sys
+import json
+import argparse
+
+from crawl_state import artifact_shard, open_default_state
+from url_frontier import detail_id_from_url
+
+# 各主机 output/ 中记录本机分片的文件，merge_shards.py 据此检查分片是否齐全
+SHARD_MARKER = 'shard.json'
+
+
+class Shard:
+    """第 index 个分片（从 1 开始）/ 共 count 个分片。"""
+
+    def __init__(self, index, count):
+        if count < 1 or not 1 <= index <= count:
+            raise ValueError(f"无效的分片 {index}/{count}")
+        self.index = index
+        self.count = count
+
+    def __contains__(self, artifact_id):
+        return artifact_shard(artifact_id, self.count) == self.index - 1
+
+    def contains_url(self, url):
+        return detail_id_from_url(url) in self
+
+    def __eq__(self, other):
+        return isinstance(other, Shard) and (self.index, self.count) == (other.index, other.count)
+
+    def __hash__(self):
+        return hash((self.index, self.count))
+
+    def __str__(self):
+        return f"{self.index}/{self.count}"
+
+    def __repr__(self):
+        return f"Shard({self.index}, {self.count})"
+
+
+def parse_shard(text):
+    """解析 'i/N' 形式的分片，用作 argparse 的 type。"""
+    try:
+        index, count = (int(part) for part in text.split('/'))
+        return Shard(index, count)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"分片应为 i/N 的形式且 1 <= i <= N，例如 2/4，而不是 '{text}'")
+
+
+def add_shard_argument(parser):
+    parser.add_argument('--shard', type=parse_shard, default=None,
+                        help="只处理第 i 个分片（共 N 个，i 从 1 开始），例如 --shard 2/4。"
+                             "各分片的 output/ 可用 src/merge_shards.py 合并")
+
+
+def write_shard_marker(output_dir, shard):
+    """在 output_dir 中记录本机处理的分片；同一个 output/ 不能先后用于不同的分片。"""
+    marker = read_shard_marker(output_dir)
+    if marker and marker != shard:
+        raise ValueError(f"'{output_dir}' 之前用于分片 {marker}，不能再用于分片 {shard}")
+    if marker is None:
+        os.makedirs(output_dir, exist_ok=True)
+        with open(os.path.join(output_dir, SHARD_MARKER), 'w', encoding='utf-8') as f:
+            json.dump({"index": shard.index, "count": shard.count}, f)
+
+
+def read_shard_marker(output_dir):
+    """返回 output_dir 中记录的分片，没有记录时返回 None。"""
+    path = os.path.join(output_dir, SHARD_MARKER)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        marker = json.load(f)
+    return Shard(marker['index'], marker['count'])
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command == 'plan' and len(sys.argv) == 3:
+        count = int(sys.argv[2])
+        counts = open_default_state().pending_by_shard(count)
+        for index, pending in enumerate(counts, start=1):
+            print(f"分片 {index}/{count}: {pending} 个待处理的文物")
+    elif command == 'which' and len(sys.argv) > 3:
+        count = int(sys.argv[2])
+        for value in sys.argv[3:]:
+            artifact_id = detail_id_from_url(value) or value
+            print(f"{value}\t{artifact_shard(artifact_id, count) + 1}/{count}")
+    else:
+        print(__doc__)
+        sys.exit(1)
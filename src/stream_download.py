@@ -0,0 +1,109 @@
+import os
+import shutil
+from contextlib import suppress
+
+from rate_limit import throttled_request
+from telemetry import REGISTRY
+
+DOWNLOAD_BYTES = REGISTRY.counter('npm_download_bytes_total', "流式下载写入磁盘的字节数")
+
+
+class IncompleteDownloadError(IOError):
+    """下载的字节数与服务器声明的 Content-Length 不一致。"""
+
+
+class UnexpectedContentError(IOError):
+    """响应的 Content-Type 表明服务器返回的不是要下载的文件（例如错误页面）。"""
+
+
+def _total_from_content_range(content_range):
+    # 格式: "bytes 100-999/1000"，总长度未知时为 "*"
+    try:
+        total = content_range.rsplit('/', 1)[1]
+        return int(total) if total != '*' else None
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def stream_to_file(session, url, dest_path, params=None, headers=None, timeout=60, proxies=None,
+                   byte_budget=None, chunk_size=256 * 1024, throttle=None, reject_content_types=()):
+    """
+    以流式方式把 url 的响应写入 dest_path，返回文件的总字节数。
+
+    - 数据按 chunk_size 分块写入同目录下的 ``<dest_path>.part``，内存占用与图片大小无关；
+    - 已存在 .part 文件时发送 ``Range: bytes=<已下载字节数>-`` 续传，服务器不支持 Range 时从头下载；
+    - 写完后核对 Content-Length，一致才 fsync 并原子地重命名为 dest_path，
+      因此 dest_path 要么不存在，要么是完整的文件；不一致时保留 .part 供下次续传并抛出 IncompleteDownloadError；
+    - byte_budget (rate_limit.ByteBudget) 按本次需要传输的字节数申请额度，传输结束后归还；
+    - throttle (rate_limit.Throttle) 用于请求限速，并根据响应状态调整速率；
+    - Content-Type 以 reject_content_types 中任一前缀开头时不写入任何数据，抛出 UnexpectedContentError。
+    """
+    part_path = dest_path + '.part'
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    request_headers = dict(headers or {})
+    if offset:
+        request_headers['Range'] = f'bytes={offset}-'
+
+    with throttled_request(throttle, session, 'GET', url, params=params, headers=request_headers, timeout=timeout,
+                           proxies=proxies, stream=True) as response:
+        if response.status_code == 416 and offset:
+            # .part 已经不小于服务器上的文件，无法判断是否完整，丢弃后重新下载。
+            # 没有发送 Range 时的 416 与 .part 无关，由下面的 raise_for_status 作为 HTTP 错误抛出
+            with suppress(FileNotFoundError):
+                os.remove(part_path)
+            raise IncompleteDownloadError(f"续传范围无效，已丢弃 {part_path}")
+        response.raise_for_status()
+        content_type = response.headers.get('Content-Type', '')
+        if reject_content_types and content_type.startswith(tuple(reject_content_types)):
+            raise UnexpectedContentError(f"服务器返回了 {content_type} 而不是文件内容")
+
+        content_length = response.headers.get('Content-Length')
+        if response.status_code == 206 and response.headers.get('Content-Range', '').startswith(f'bytes {offset}-'):
+            mode = 'ab'
+            expected_total = _total_from_content_range(response.headers.get('Content-Range'))
+        else:
+            # 服务器忽略了 Range 或没有 .part：从头开始
+            offset = 0
+            mode = 'wb'
+            expected_total = int(content_length) if content_length else None
+
+        reserved = int(content_length) if content_length else 0
+        if byte_budget:
+            byte_budget.acquire(reserved)
+        try:
+            written = offset
+            with open(part_path, mode) as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    if chunk:
+                        f.write(chunk)
+                        written += len(chunk)
+                        DOWNLOAD_BYTES.inc(len(chunk))
+                f.flush()
+                os.fsync(f.fileno())
+        finally:
+            if byte_budget:
+                byte_budget.release(reserved)
+
+    if expected_total is not None and written != expected_total:
+        raise IncompleteDownloadError(f"下载不完整: 已获得 {written} / {expected_total} 字节，保留 {part_path} 以便续传")
+    os.replace(part_path, dest_path)
+    return written
+
+
+def link_or_copy(src_path, dest_path):
+    """
+    把已有的文件 src_path 以硬链接的形式放到 dest_path（不支持硬链接时复制），返回 'link' 或 'copy'。
+    先写到 ``<dest_path>.part`` 再原子重命名，dest_path 已存在时会被替换。
+    """
+    part_path = dest_path + '.part'
+    if os.path.exists(part_path):
+        os.remove(part_path)
+    try:
+        os.link(src_path, part_path)
+        method = 'link'
+    except OSError:
+        # 跨文件系统或文件系统不支持硬链接
+        shutil.copy2(src_path, part_path)
+        method = 'copy'
+    os.replace(part_path, dest_path)
+    return method
@@ -0,0 +1,387 @@
+"""
+抓取过程的结构化指标与性能剖析。
+
+各脚本在模块顶层用 REGISTRY.counter() / histogram() / gauge() 声明自己的指标，运行时直接更新，
+开销只有一次加锁的字典更新，因此始终开启。指标可以通过两种方式输出:
+
+- --telemetry-port: 在本地启动 HTTP 服务，GET /metrics 返回 Prometheus 文本格式；
+- --telemetry-file: 每隔 --telemetry-interval 秒向 JSON Lines 文件追加一次快照，快照中同时给出
+  各计数器在这段时间内的每秒增量（例如下载字节数/秒）。
+
+主要的指标:
+    npm_http_requests_total{endpoint,status}   各端点的请求数（由 rate_limit.Throttle 记录）
+    npm_http_request_seconds{endpoint}         各端点的响应延迟
+    npm_function_seconds{function}             traced() 包装的函数（抓取、解析、识别验证码等）的耗时
+    npm_captcha_attempts_total{result}         验证码尝试: accepted / rejected / empty
+    npm_captcha_attempts_per_image             每张图片用了几次验证码
+    npm_download_bytes_total                   写入磁盘的图片字节数
+    npm_queue_depth{queue}                     各阶段之间队列的长度
+
+--profile-dir 打开 cProfile: traced() 包装的函数在每个线程中各自累计剖析数据，退出时按函数名合并写入
+<目录>/<函数名>.prof，可用 python -m pstats 或 snakeviz 查看。traced() 不改变被包装函数的调用栈，
+用 py-spy record --pid <PID> 采样时这些函数同样以原名出现。只剖析当前进程：要剖析验证码 OCR，
+请使用 --ocr-workers 0 让识别在下载线程中进行。
+"""
+import os
+import json
+import time
+import atexit
+import bisect
+import pstats
+import cProfile
+import functools
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+COUNT_BUCKETS = (1, 2, 3, 4, 5, 6, 8, 10)
+TELEMETRY_INTERVAL = 10.0
+
+
+def _label_key(labelnames, labels):
+    if set(labels) != set(labelnames):
+        raise ValueError(f"标签应为 {labelnames}，实际为 {tuple(labels)}")
+    return tuple(str(labels[name]) for name in labelnames)
+
+
+def _format_labels(labelnames, key, extra=()):
+    pairs = list(zip(labelnames, key)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _samples(self):
+        with self._lock:
+            return list(self._values.items())
+
+
+class Counter(_Metric):
+    """只增不减的计数器。"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in self._samples()]
+
+    def snapshot(self):
+        return [{'labels': dict(zip(self.labelnames, key)), 'value': value} for key, value in self._samples()]
+
+
+class Gauge(_Metric):
+    """当前值。可以直接 set()，也可以用 set_function() 登记一个在输出时才调用的函数（例如队列长度）。"""
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, func, **labels):
+        """登记一个无参数函数，每次输出时调用它取得当前值。"""
+        self.set(func, **labels)
+
+    def remove(self, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values.pop(key, None)
+
+    def _samples(self):
+        samples = []
+        for key, value in super()._samples():
+            try:
+                samples.append((key, value() if callable(value) else value))
+            except Exception:
+                continue
+        return samples
+
+    def render(self):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in self._samples()]
+
+    def snapshot(self):
+        return [{'labels': dict(zip(self.labelnames, key)), 'value': value} for key, value in self._samples()]
+
+
+class Histogram(_Metric):
+    """固定分桶的直方图，记录观测值的分布、总和与次数。"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _samples(self):
+        with self._lock:
+            return [(key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items()]
+
+    def render(self):
+        lines = []
+        for key, (counts, total, count) in self._samples():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+    def quantile(self, counts, count, q):
+        """按分桶估计第 q 分位数（取所在分桶的上界）。"""
+        rank, cumulative = q * count, 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return bound if bound != float('inf') else self.buckets[-1]
+        return None
+
+    def snapshot(self):
+        return [{'labels': dict(zip(self.labelnames, key)), 'count': count, 'sum': round(total, 6),
+                 'p50': self.quantile(counts, count, 0.5), 'p99': self.quantile(counts, count, 0.99)}
+                for key, (counts, total, count) in self._samples() if count]
+
+
+class Registry:
+    """指标的集合。同名指标只创建一次，多个模块可以声明同一个指标。"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"指标 {name} 已声明为 {metric.kind}")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets)
+
+    def metrics(self):
+        with self._lock:
+            return sorted(self._metrics.values(), key=lambda metric: metric.name)
+
+    def render_prometheus(self):
+        lines = []
+        for metric in self.metrics():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        return {metric.name: metric.snapshot() for metric in self.metrics()}
+
+
+REGISTRY = Registry()
+FUNCTION_SECONDS = REGISTRY.histogram('npm_function_seconds', "traced() 包装的函数的耗时（秒）", ['function'])
+QUEUE_DEPTH = REGISTRY.gauge('npm_queue_depth', "各阶段之间队列中等待的条目数", ['queue'])
+
+
+# --- 输出 ---
+def make_handler(registry):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            data = registry.render_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return MetricsHandler
+
+
+def start_http_server(port, host='127.0.0.1', registry=REGISTRY):
+    """在后台线程中提供 GET /metrics，返回 server。"""
+    server = ThreadingHTTPServer((host, port), make_handler(registry))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='telemetry-http', daemon=True).start()
+    return server
+
+
+class JsonLinesWriter:
+    """每隔 interval 秒向 path 追加一行快照；close() 时再写最后一次。"""
+
+    def __init__(self, path, interval=TELEMETRY_INTERVAL, registry=REGISTRY):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self._started = self._last_time = time.monotonic()
+        self._last_counters = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='telemetry-file', daemon=True)
+        self._thread.start()
+
+    def _rates(self, snapshot, now):
+        elapsed = now - self._last_time
+        counters = {}
+        for metric in self.registry.metrics():
+            if metric.kind == 'counter':
+                for sample in snapshot[metric.name]:
+                    labels = ','.join(f"{k}={v}" for k, v in sample['labels'].items())
+                    counters[f"{metric.name}{{{labels}}}" if labels else metric.name] = sample['value']
+        rates = {name: round((value - self._last_counters.get(name, 0)) / elapsed, 3)
+                 for name, value in counters.items()} if elapsed > 0 else {}
+        self._last_counters, self._last_time = counters, now
+        return rates
+
+    def write_snapshot(self):
+        now = time.monotonic()
+        snapshot = self.registry.snapshot()
+        entry = {'timestamp': time.strftime("%Y-%m-%d %H:%M:%S"), 'uptime_s': round(now - self._started, 1),
+                 'rates_per_s': self._rates(snapshot, now), 'metrics': snapshot}
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write_snapshot()
+
+    def close(self):
+        if not self._stop.is_set():
+            self._stop.set()
+            self._thread.join()
+            self.write_snapshot()
+
+
+# --- 剖析 ---
+_profile_dir = None
+_profiles = {}  # 函数名 -> 各线程的 cProfile.Profile 列表
+_profiles_lock = threading.Lock()
+_thread_state = threading.local()
+
+
+def enable_profiling(profile_dir):
+    """打开 traced() 的 cProfile 剖析，进程退出时把结果写入 profile_dir。"""
+    global _profile_dir
+    os.makedirs(profile_dir, exist_ok=True)
+    _profile_dir = profile_dir
+    atexit.register(dump_profiles)
+
+
+def _thread_profile(name):
+    profiles = getattr(_thread_state, 'profiles', None)
+    if profiles is None:
+        profiles = _thread_state.profiles = {}
+    profile = profiles.get(name)
+    if profile is None:
+        profile = profiles[name] = cProfile.Profile()
+        with _profiles_lock:
+            _profiles.setdefault(name, []).append(profile)
+    return profile
+
+
+def dump_profiles():
+    """把各线程的剖析数据按函数名合并，写入 <profile_dir>/<函数名>.prof。返回写入的文件列表。"""
+    written = []
+    with _profiles_lock:
+        items = [(name, list(profiles)) for name, profiles in _profiles.items()]
+    for name, profiles in items:
+        stats = None
+        for profile in profiles:
+            try:
+                stats = pstats.Stats(profile) if stats is None else stats.add(profile)
+            except TypeError:  # 这个线程还没有采集到数据
+                continue
+        if stats is not None:
+            path = os.path.join(_profile_dir, f"{name}.prof")
+            stats.dump_stats(path)
+            written.append(path)
+    return written
+
+
+def traced(name, profile=True):
+    """
+    装饰器: 把每次调用的耗时记入 npm_function_seconds{function=name}；打开剖析且 profile 为 True 时在 cProfile 下运行。
+    同一线程中嵌套的 traced 函数只由最外层开启剖析（cProfile 不能在同一线程上重复开启）。
+    Python 3.12 起 cProfile 同一时刻只能在一个线程中开启，其他线程上的并发调用只计时、不剖析。
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profiler = None
+            if profile and _profile_dir is not None and not getattr(_thread_state, 'active', False):
+                profiler = _thread_profile(name)
+                try:
+                    profiler.enable()
+                    _thread_state.active = True
+                except ValueError:  # Python 3.12+ 同一时刻只能有一个剖析器，此次调用不剖析
+                    profiler = None
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                FUNCTION_SECONDS.observe(time.perf_counter() - started, function=name)
+                if profiler is not None:
+                    profiler.disable()
+                    _thread_state.active = False
+        return wrapper
+    return decorator
+
+
+# --- 命令行 ---
+def add_telemetry_arguments(parser):
+    """添加指标输出和剖析的命令行参数，各抓取脚本共用。"""
+    group = parser.add_argument_group("指标与剖析")
+    group.add_argument('--telemetry-port', type=int, default=None,
+                       help="在该端口提供 Prometheus 格式的 GET /metrics")
+    group.add_argument('--telemetry-file', default=None, help="定期把指标快照追加到该 JSON Lines 文件")
+    group.add_argument('--telemetry-interval', type=float, default=TELEMETRY_INTERVAL,
+                       help=f"写入指标快照的间隔秒数 (默认: {TELEMETRY_INTERVAL:g})")
+    group.add_argument('--profile-dir', default=None, help="用 cProfile 剖析主要函数，退出时把 .prof 文件写入该目录")
+    return group
+
+
+def start_telemetry(args):
+    """按命令行参数启动指标输出和剖析。进程退出时自动写出最后一次快照。"""
+    if args.telemetry_port is not None:
+        start_http_server(args.telemetry_port)
+        print(f"指标服务已启动: http://127.0.0.1:{args.telemetry_port}/metrics")
+    if args.telemetry_file:
+        writer = JsonLinesWriter(args.telemetry_file, args.telemetry_interval)
+        atexit.register(writer.close)
+    if args.profile_dir:
+        enable_profiling(args.profile_dir)
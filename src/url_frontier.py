@@ -0,0 +1,64 @@
+import os
+import re
+import threading
+import time
+
+
+def detail_id_from_url(url):
+    """从详情页URL中提取 Detail ID，无法识别时返回 None。"""
+    match = re.search(r'Detail/(\d+)', url)
+    return match.group(1) if match else None
+
+
+class UrlFrontier:
+    """
+    以 Detail ID 为键去重的持久化 URL 集合。
+
+    磁盘格式为只追加的 TSV 文件，每行: ``detail_id  category  first_seen  url``。
+    同一个 ID 只会记录第一次见到时的分类和时间，因此多次运行、多个分类之间天然去重。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = {}
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    parts = line.rstrip("\n").split("\t")
+                    if len(parts) == 4 and parts[0] not in self._entries:
+                        self._entries[parts[0]] = (parts[1], parts[2], parts[3])
+
+    def __contains__(self, detail_id):
+        return detail_id in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, url, category):
+        """记录一个URL，返回它是否为新发现的ID。"""
+        detail_id = detail_id_from_url(url)
+        if detail_id is None:
+            return False
+        with self._lock:
+            if detail_id in self._entries:
+                return False
+            first_seen = time.strftime("%Y-%m-%d %H:%M:%S")
+            self._entries[detail_id] = (category, first_seen, url)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(f"{detail_id}\t{category}\t{first_seen}\t{url}\n")
+            return True
+
+    def all_known(self, urls):
+        """判断一组URL对应的ID是否都已经在集合中。"""
+        return all(detail_id_from_url(url) in self._entries for url in urls)
+
+    def urls(self, categories=None):
+        """按首次发现的顺序返回URL，可按分类过滤。"""
+        return [url for category, _, url in self._entries.values()
+                if categories is None or category in categories]
+
+    def entries(self):
+        """按首次发现的顺序返回 (url, category, first_seen)。"""
+        return [(url, category, first_seen) for category, first_seen, url in self._entries.values()]